@@ -0,0 +1,174 @@
+import functools
+import hashlib
+import importlib.metadata
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import face_bounding_box_detection
+
+# Bump when the way samples are produced changes, so stale caches are ignored
+ANALYSIS_VERSION = "1"
+# Model weights the face detector loads from outside its package, hashed into detector_version() when set
+DETECTOR_WEIGHTS = os.environ.get("ZOOM_DETECTOR_WEIGHTS")
+# Files of the detector package that change its results: code and model weights
+DETECTOR_FILE_SUFFIXES = (".py", ".pt", ".pth", ".onnx", ".pb", ".tflite", ".safetensors", ".caffemodel", ".dat",
+                          ".xml", ".bin")
+CACHE_DIR = Path("temp_output/face_cache")
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def write_atomically(path: Path, write: Callable, mode: str = "w"):
+    """
+    Write a file through `write(file)` into a unique temp file next to `path`, then move it into place,
+    so readers and concurrent writers never see a partly written file.
+    """
+    path.parent.mkdir(exist_ok=True, parents=True)
+    fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def detector_files() -> List[Path]:
+    """Code and model weight files of the installed face detector, plus DETECTOR_WEIGHTS when set."""
+    files = []
+    module_file = getattr(face_bounding_box_detection, "__file__", None)
+    if module_file and Path(module_file).name == "__init__.py":
+        files = sorted(path for path in Path(module_file).parent.rglob("*") if path.suffix in DETECTOR_FILE_SUFFIXES)
+    elif module_file:
+        files = [Path(module_file)]
+    if DETECTOR_WEIGHTS:
+        files.append(Path(DETECTOR_WEIGHTS))
+    return files
+
+
+@functools.lru_cache(maxsize=None)
+def detector_version() -> str:
+    """
+    Version of the face detector the caches were made with: the version of its installed distribution and
+    a hash of its code and weights, so upgrading it or swapping its weights invalidates the caches.
+    """
+    distributions = importlib.metadata.packages_distributions().get(face_bounding_box_detection.__name__, [])
+    digest = hashlib.sha256("|".join(f"{name}=={importlib.metadata.version(name)}"
+                                     for name in sorted(distributions)).encode())
+    for path in detector_files():
+        digest.update(path.name.encode())
+        try:
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+        except OSError as e:
+            logging.warning("Could not hash face detector file %s: %s", path, e)
+    return digest.hexdigest()[:16]
+
+
+def video_content_hash(video_path: str, cache_dir: Path = CACHE_DIR) -> str:
+    """
+    SHA-256 of the video file contents. Hashing an hour-long video takes a while, so the digest
+    is remembered per (path, size, mtime) in a small index next to the caches.
+    """
+    stat = os.stat(video_path)
+    index_key = f"{os.path.abspath(video_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    index_path = cache_dir / "hash_index.json"
+    index = {}
+    if index_path.exists():
+        try:
+            with open(index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning("Unreadable hash index %s, rebuilding it: %s", index_path, e)
+    if index_key in index:
+        return index[index_key]
+
+    digest = hashlib.sha256()
+    with open(video_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    index[index_key] = digest.hexdigest()
+
+    write_atomically(index_path, lambda f: json.dump(index, f))
+    return index[index_key]
+
+
+class FaceAnalysisCache:
+    """
+    On-disk face detector samples of one video: frame number -> (refined scale, face box),
+    plus the frame ranges that were scanned to produce them, stored as a single .npz file.
+
+    The file name is derived from the video content hash, the detector version and the sampling
+    policy, so a changed video, detector or policy never reads stale results.
+    """
+    def __init__(self, path: Path):
+        self.path = path
+        self.samples: Dict[int, tuple] = {}
+        self.covered: List[Tuple[int, int]] = []
+        if path.exists():
+            try:
+                self.load()
+            except Exception as e:
+                # A damaged cache only costs the analysis it held
+                logging.warning("Unreadable face cache %s, analysing again: %s", path, e)
+                self.samples, self.covered = {}, []
+
+    @classmethod
+    def for_video(cls, video_path: str, policy, cache_dir: Path = CACHE_DIR) -> "FaceAnalysisCache":
+        key = hashlib.sha256(
+            f"{video_content_hash(video_path, cache_dir)}|{detector_version()}|{ANALYSIS_VERSION}|{policy.signature()}".encode()
+        ).hexdigest()[:32]
+        return cls(cache_dir / f"{key}.npz")
+
+    def load(self):
+        with np.load(self.path) as data:
+            boxes = data["boxes"]
+            for frame_num, scale, box in zip(data["frames"].tolist(), data["scales"].tolist(), boxes):
+                self.samples[frame_num] = (
+                    None if np.isnan(scale) else scale,
+                    None if np.isnan(box).any() else tuple(box.tolist()),
+                )
+            self.covered = [tuple(r) for r in data["covered"].tolist()]
+        logging.info("Loaded %d face samples covering %d frames from %s", len(self.samples),
+                     sum(end - start for start, end in self.covered), self.path)
+
+    def save(self):
+        frames = sorted(self.samples)
+        scales = np.array([np.nan if self.samples[f][0] is None else self.samples[f][0] for f in frames], dtype=np.float32)
+        boxes = np.array([self.samples[f][1] or (np.nan,) * 4 for f in frames], dtype=np.float32).reshape(-1, 4)
+        covered = np.array(self.covered, dtype=np.int64).reshape(-1, 2)
+        write_atomically(self.path, lambda f: np.savez_compressed(f, frames=np.array(frames, dtype=np.int64),
+                                                                  scales=scales, boxes=boxes, covered=covered),
+                         mode="wb")
+
+    def uncovered(self, start: int, end: int) -> List[Tuple[int, int]]:
+        """Parts of [start, end) that no earlier analysis scanned."""
+        gaps = []
+        position = start
+        for covered_start, covered_end in self.covered:
+            if covered_end <= position or covered_start >= end:
+                continue
+            if covered_start > position:
+                gaps.append((position, covered_start))
+            position = max(position, covered_end)
+        if position < end:
+            gaps.append((position, end))
+        return gaps
+
+    def add(self, samples: Dict[int, tuple], start: int, end: int):
+        self.samples.update(samples)
+        if end <= start:
+            return
+        merged = []
+        for range_start, range_end in sorted(self.covered + [(start, end)]):
+            if merged and range_start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], range_end))
+            else:
+                merged.append((range_start, range_end))
+        self.covered = merged
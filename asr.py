@@ -4,7 +4,6 @@ from concurrent import futures
 from glob import glob
 from typing import List, Tuple, Dict
 
-import streamlit as st
 from speechmatics.models import ConnectionSettings
 from speechmatics.batch_client import BatchClient
 from httpx import HTTPStatusError, ReadError
@@ -64,6 +63,8 @@ def transcribe_audios(
 
     :return: tuple: Transcription of audio files in splited to sentences and indices of the corresponding sentences.
     """
+    # Only this progress UI needs streamlit, the headless pipeline (zoom_pipeline.py) does not
+    import streamlit as st
 
     # Initializing the progress bar
     progress_bar = st.progress(0, text='Transcribing recordings...')
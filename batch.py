@@ -0,0 +1,134 @@
+"""
+Run the zoom pipeline headless over many videos.
+
+    python -m batch videos/ --output-dir zoomed --jobs 2
+    python -m batch manifest.json --report report.json --render-mode smart
+
+Inputs are video files, directories (every video in them) or manifests: a .txt file with one video path
+per line, or a .json list of paths or of objects {"video": path, ...} whose other keys are process_video
+options for that video. Each video runs in its own process, at most --jobs at a time, and the JSON report
+lists the output, zooms and stage timings of every video, or its error.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List
+
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi")
+
+
+def read_inputs(inputs: List[str]) -> List[Dict]:
+    """
+    Expand the command line inputs into one entry per video.
+
+    :return: list: Dicts with the "video" path and the process_video options of that video
+    """
+    entries = []
+    for item in inputs:
+        path = Path(item)
+        if path.is_dir():
+            entries += [{"video": str(video)} for video in sorted(path.iterdir())
+                        if video.suffix.lower() in VIDEO_EXTENSIONS]
+        elif path.suffix == ".json":
+            with open(path) as f:
+                entries += [entry if isinstance(entry, dict) else {"video": entry} for entry in json.load(f)]
+        elif path.suffix == ".txt":
+            with open(path) as f:
+                entries += [{"video": line.strip()} for line in f if line.strip() and not line.startswith("#")]
+        else:
+            entries.append({"video": str(path)})
+
+    missing = [entry["video"] for entry in entries if not os.path.isfile(entry["video"])]
+    if missing:
+        raise FileNotFoundError(f"Videos not found: {', '.join(missing)}")
+    # Intermediate files are named after the video file name, so two videos must not share it
+    stems = [Path(entry["video"]).stem for entry in entries]
+    duplicates = sorted({stem for stem in stems if stems.count(stem) > 1})
+    if duplicates:
+        raise ValueError(f"Video names must be unique, found several of: {', '.join(duplicates)}")
+    return entries
+
+
+def run_video(entry: Dict, output_dir: str, work_dir: str, render_options: Dict) -> Dict:
+    """Runs in a worker process: the whole pipeline for one video, errors reported instead of raised."""
+    from zoom_pipeline import zoom_video
+
+    options = {**render_options, **{key: value for key, value in entry.items() if key != "video"}}
+    start = time.perf_counter()
+    try:
+        report = zoom_video(entry["video"], output_dir, work_dir, **options)
+        report["status"] = "ok"
+    except Exception as e:
+        logging.exception("Processing %s failed", entry["video"])
+        report = {"video": entry["video"], "status": "error", "error": repr(e), "traceback": traceback.format_exc()}
+    report["wall_s"] = round(time.perf_counter() - start, 3)
+    return report
+
+
+def run_batch(entries: List[Dict], output_dir: str, work_dir: str, jobs: int = 1, **render_options) -> Dict:
+    """
+    Process the videos of `entries` (see read_inputs), `jobs` at a time.
+
+    :param render_options: Keyword arguments of process_video for every video
+    :return: dict: Report with one entry per video, in input order
+    """
+    from frame_pipeline import default_workers
+
+    # The videos of a batch share the cores, instead of each one sizing its pipeline for the whole machine
+    render_options.setdefault("workers", max(1, default_workers() // jobs))
+    start = time.perf_counter()
+    results = [None] * len(entries)
+    with ProcessPoolExecutor(max_workers=max(1, min(jobs, len(entries)))) as executor:
+        futures = {executor.submit(run_video, entry, output_dir, work_dir, render_options): i
+                   for i, entry in enumerate(entries)}
+        for future in as_completed(futures):
+            result = future.result()
+            results[futures[future]] = result
+            logging.info("%s: %s (%d of %d done)", result["video"], result.get("output") or result["status"],
+                         sum(r is not None for r in results), len(entries))
+    return {
+        "videos": results,
+        "succeeded": sum(result["status"] == "ok" for result in results),
+        "failed": sum(result["status"] != "ok" for result in results),
+        "wall_s": round(time.perf_counter() - start, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Add zooms to videos without the Streamlit app")
+    parser.add_argument("inputs", nargs="+", help="Video files, directories of videos, or .txt/.json manifests")
+    parser.add_argument("--output-dir", default="batch_output")
+    parser.add_argument("--work-dir", default="./uploaded_files", help="Transcriptions and other intermediate files")
+    parser.add_argument("--report", help="JSON report path (default: <output-dir>/report.json)")
+    parser.add_argument("--jobs", type=int, default=1, help="Videos processed at the same time")
+    parser.add_argument("--profile", default="final", choices=["final", "proxy"])
+    parser.add_argument("--render-mode", default="full", choices=["full", "smart", "parallel", "distributed"])
+    parser.add_argument("--backend", default="opencv", choices=["opencv", "ffmpeg"])
+    parser.add_argument("--decoder", default="opencv", choices=["opencv", "ffmpeg"])
+    parser.add_argument("--container", default="mp4", choices=["mp4", "fmp4", "hls"])
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv, find_dotenv
+    load_dotenv(find_dotenv())
+    logging.basicConfig(level=logging.INFO)
+
+    entries = read_inputs(args.inputs)
+    report = run_batch(entries, args.output_dir, args.work_dir, args.jobs, profile=args.profile,
+                       render_mode=args.render_mode, backend=args.backend, decoder=args.decoder,
+                       container=args.container)
+    report_path = args.report or os.path.join(args.output_dir, "report.json")
+    os.makedirs(os.path.dirname(report_path) or ".", exist_ok=True)
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    logging.info("%d of %d videos done, report in %s", report["succeeded"], len(entries), report_path)
+    sys.exit(1 if report["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Compare the "warp" and "roi" transform backends of apply_zoom.
+
+    python benchmarks/bench_apply_zoom.py --repeats 50
+
+Prints one JSON object per (resolution, scale, quality) with ms/frame for both backends
+and the mean/max absolute pixel difference of the roi output against the warp output.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from zoom_effect import QUALITY_INTERPOLATION, apply_zoom
+
+RESOLUTIONS = {"720p": (1280, 720), "1080p": (1920, 1080), "4k": (3840, 2160)}
+
+
+def synthetic_frame(width: int, height: int) -> np.ndarray:
+    # Smooth gradients with a drawn "face", closer to camera footage than pure noise
+    x = np.linspace(0, 8 * np.pi, width, dtype=np.float32)
+    y = np.linspace(0, 6 * np.pi, height, dtype=np.float32)[:, None]
+    base = (np.sin(x) * np.cos(y) + 1) * 127
+    frame = np.stack([base, np.roll(base, width // 3, axis=1), np.roll(base, height // 3, axis=0)], axis=2)
+    frame = cv2.GaussianBlur(frame.astype(np.uint8), (5, 5), 0)
+    cv2.circle(frame, (width // 2, height // 4), height // 8, (40, 160, 220), -1)
+    return frame
+
+
+def time_backend(frame, scale, backend, quality, repeats):
+    dst = np.empty_like(frame)
+    apply_zoom(frame, scale, backend=backend, quality=quality, dst=dst)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        apply_zoom(frame, scale, backend=backend, quality=quality, dst=dst)
+    return (time.perf_counter() - start) / repeats * 1000, dst
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeats", type=int, default=30)
+    parser.add_argument("--scales", type=float, nargs="+", default=[1.1, 1.3, 1.6])
+    parser.add_argument("--tolerance", type=float, default=2.0, help="Max acceptable mean abs diff against warp")
+    parser.add_argument("--resolutions", nargs="+", default=list(RESOLUTIONS), choices=list(RESOLUTIONS))
+    args = parser.parse_args()
+
+    for name in args.resolutions:
+        frame = synthetic_frame(*RESOLUTIONS[name])
+        for scale in args.scales:
+            warp_ms, warp_out = time_backend(frame, scale, "warp", "balanced", args.repeats)
+            for quality in QUALITY_INTERPOLATION:
+                roi_ms, roi_out = time_backend(frame, scale, "roi", quality, args.repeats)
+                diff = cv2.absdiff(warp_out, roi_out)
+                print(json.dumps({
+                    "resolution": name,
+                    "scale": scale,
+                    "quality": quality,
+                    "warp_ms": round(warp_ms, 3),
+                    "roi_ms": round(roi_ms, 3),
+                    "speedup": round(warp_ms / roi_ms, 2),
+                    "mean_abs_diff": round(float(diff.mean()), 3),
+                    "max_abs_diff": int(diff.max()),
+                    "within_tolerance": bool(diff.mean() <= args.tolerance),
+                }))
+
+
+if __name__ == "__main__":
+    main()
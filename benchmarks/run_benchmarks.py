@@ -0,0 +1,197 @@
+"""
+Benchmark process_video and its alternative backends on synthetic videos.
+
+    python benchmarks/run_benchmarks.py --resolutions 720p 1080p --durations 30 --output bench.json
+
+Every (video, zoom set, case) runs in a fresh subprocess inside its own work directory, so peak RSS
+and temp-disk usage are measured per run. Face detection uses benchmarks/stub_detector.py, which makes
+results deterministic and independent of the real detector. Results are printed (or written) as JSON.
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+RESOLUTIONS = {"360p": (640, 360), "720p": (1280, 720), "1080p": (1920, 1080), "4k": (3840, 2160)}
+FPS = 30
+
+# process_video keyword arguments of each case
+CASES = {
+    "pipeline": {},
+    "opencv_encoder": {"encoder": "opencv"},
+    "smart": {"render_mode": "smart"},
+    "parallel": {"render_mode": "parallel"},
+    "ffmpeg": {"backend": "ffmpeg"},
+    "proxy": {"profile": "proxy"},
+    "ffmpeg_decoder": {"decoder": "ffmpeg"},
+}
+
+# Seconds between the starts of consecutive generated zoom effects
+ZOOM_SETS = {
+    "sparse": 60.0,
+    "dense": 10.0,
+}
+
+
+def make_synthetic_video(path: str, width: int, height: int, duration: float):
+    """testsrc2 background with a solid "face" box drifting slowly across the upper half, plus a sine tone."""
+    face_w, face_h = width // 6, height // 4
+    face_color = "0xF0C828"  # RGB of stub_detector.FACE_COLOR
+    # overlay evaluates its position per frame (drawbox would fix it at the first frame)
+    face = (f"color=c={face_color}:s={face_w}x{face_h}:r={FPS}[face];"
+            f"[0:v][face]overlay=x='{width // 2 - face_w // 2}+{width // 20}*sin(t/3)':y={height // 6}:"
+            f"eval=frame:shortest=1[v]")
+    command = [
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size={width}x{height}:rate={FPS}:duration={duration}',
+        '-f', 'lavfi', '-i', f'sine=frequency=220:duration={duration}',
+        '-filter_complex', face, '-map', '[v]', '-map', '1:a', '-c:v', 'libx264', '-preset', 'veryfast', '-g', str(2 * FPS), '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac', '-shortest', path
+    ]
+    subprocess.run(command, check=True)
+
+
+def make_zoom_effects(duration: float, spacing: float):
+    from zoom_effect import ZoomEffect
+    effects = []
+    start = min(5.0, duration / 4)
+    while start + 4.0 < duration:
+        effects.append(ZoomEffect(start, start + 3.5, 1, 1.3, 0))
+        start += spacing
+    return effects
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def run_case(spec: dict) -> dict:
+    """Runs in the benchmark subprocess: one process_video call, measured."""
+    sys.path.insert(0, REPO_DIR)
+    sys.path.insert(0, BENCHMARKS_DIR)
+    import stub_detector
+    stub_detector.install()
+    import cv2
+    from render_profiler import RenderProfiler
+    from zoom_effect import process_video
+
+    cap = cv2.VideoCapture(spec["video"])
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    effects = make_zoom_effects(spec["duration"], ZOOM_SETS[spec["zoom_set"]])
+
+    peak_disk = [0]
+    done = threading.Event()
+
+    def watch_disk():
+        while not done.wait(0.2):
+            peak_disk[0] = max(peak_disk[0], directory_size("temp_output"))
+
+    watcher = threading.Thread(target=watch_disk, daemon=True)
+    watcher.start()
+    profiler = RenderProfiler()
+    start = time.perf_counter()
+    output_path = process_video(spec["video"], effects, profiler=profiler, **CASES[spec["case"]])
+    wall_time = time.perf_counter() - start
+    done.set()
+    watcher.join()
+    peak_disk[0] = max(peak_disk[0], directory_size("temp_output"))
+
+    # ru_maxrss is in KiB on Linux; children covers ffmpeg and the parallel render processes
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    return {
+        "case": spec["case"],
+        "resolution": spec["resolution"],
+        "duration": spec["duration"],
+        "zoom_set": spec["zoom_set"],
+        "zoom_effects": len(effects),
+        "frames": total_frames,
+        "wall_time_s": round(wall_time, 3),
+        "fps": round(total_frames / wall_time, 2) if wall_time else None,
+        "peak_rss_bytes": self_rss,
+        "peak_child_rss_bytes": children_rss,
+        "peak_temp_disk_bytes": peak_disk[0],
+        "output": os.path.abspath(output_path),
+        "profile": profiler.summary(),
+    }
+
+
+def run_in_subprocess(spec: dict, work_dir: str) -> dict:
+    os.makedirs(work_dir, exist_ok=True)
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-case", json.dumps(spec)],
+                            cwd=work_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        return {**spec, "error": result.stderr.decode(errors="replace")[-2000:]}
+    return json.loads(result.stdout.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resolutions", nargs="+", default=["720p", "1080p"], choices=list(RESOLUTIONS))
+    parser.add_argument("--durations", nargs="+", type=float, default=[30.0])
+    parser.add_argument("--zoom-sets", nargs="+", default=list(ZOOM_SETS), choices=list(ZOOM_SETS))
+    parser.add_argument("--cases", nargs="+", default=list(CASES), choices=list(CASES))
+    parser.add_argument("--compare", action="store_true", help="Add PSNR of every case against the pipeline case")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated videos and outputs")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case(json.loads(args.run_case))))
+        return
+
+    sys.path.insert(0, REPO_DIR)
+    root = tempfile.mkdtemp(prefix="zoom_bench_")
+    results = []
+    try:
+        for resolution in args.resolutions:
+            for duration in args.durations:
+                video = os.path.join(root, f"synthetic_{resolution}_{int(duration)}s.mp4")
+                make_synthetic_video(video, *RESOLUTIONS[resolution], duration)
+                for zoom_set in args.zoom_sets:
+                    reference = None
+                    for case in args.cases:
+                        spec = {"video": video, "resolution": resolution, "duration": duration,
+                                "zoom_set": zoom_set, "case": case}
+                        work_dir = os.path.join(root, f"{resolution}_{int(duration)}s_{zoom_set}_{case}")
+                        result = run_in_subprocess(spec, work_dir)
+                        if args.compare and "output" in result:
+                            if case == "pipeline":
+                                reference = result["output"]
+                            elif reference is not None and case != "proxy":
+                                from ffmpeg_render import compare_renders
+                                result["psnr_vs_pipeline"] = compare_renders(reference, result["output"])
+                        results.append(result)
+                        print(json.dumps(result), file=sys.stderr)
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    report = json.dumps({"results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
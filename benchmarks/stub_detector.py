@@ -0,0 +1,44 @@
+"""
+Deterministic stand-in for face_bounding_box_detection.get_bounding_box.
+
+It finds the solid "face" box that make_synthetic_video draws (pure FACE_COLOR) and derives
+the refined scale from its size, so benchmark runs do not depend on the real detector or a GPU.
+"""
+import sys
+import types
+
+import cv2
+import numpy as np
+
+# BGR colour of the box drawn by the synthetic videos, and the tolerance used to find it after encoding
+FACE_COLOR = (40, 200, 240)
+COLOR_TOLERANCE = 30
+# The refined scale makes the face fill this fraction of the frame height
+TARGET_FACE_HEIGHT = 0.45
+
+
+def get_bounding_box(frame: np.ndarray):
+    lower = np.clip(np.array(FACE_COLOR) - COLOR_TOLERANCE, 0, 255).astype(np.uint8)
+    upper = np.clip(np.array(FACE_COLOR) + COLOR_TOLERANCE, 0, 255).astype(np.uint8)
+    mask = cv2.inRange(frame, lower, upper)
+    # testsrc2 has a few similarly coloured pixels; the face is the largest matching blob
+    count, _, blobs, _ = cv2.connectedComponentsWithStats(mask)
+    if count < 2:
+        return None, None, None
+    x, y, w, h, _ = blobs[1 + int(np.argmax(blobs[1:, cv2.CC_STAT_AREA]))].tolist()
+    refined_scale = max(1.0, TARGET_FACE_HEIGHT * frame.shape[0] / h)
+    return refined_scale, (x, y, w, h), None
+
+
+def install():
+    """Make face_analysis use the stub, importing it without the real detector package if needed."""
+    if "face_bounding_box_detection" not in sys.modules:
+        try:
+            import face_bounding_box_detection  # noqa: F401
+        except ImportError:
+            module = types.ModuleType("face_bounding_box_detection")
+            module.get_bounding_box = get_bounding_box
+            sys.modules["face_bounding_box_detection"] = module
+
+    import face_analysis
+    face_analysis.get_bounding_box = get_bounding_box
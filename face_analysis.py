@@ -0,0 +1,217 @@
+import math
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from face_bounding_box_detection import get_bounding_box
+
+from ffmpeg_io import FFmpegReader
+from render_profiler import RenderProfiler
+
+# Gaps between zoom windows shorter than this are crossed with grab() instead of a seek,
+# since a seek has to decode forward from the previous keyframe anyway.
+SEEK_THRESHOLD_FRAMES = 48
+
+
+class SamplingPolicy:
+    """
+    Decides on which frames of a zoom window the face detector runs.
+
+    :param every_n_frames: int: Detect on every n-th frame of the video (aligned to frame 0, not to the window)
+    :param motion_threshold: float: Also detect when the mean absolute difference to the last detected frame,
+        measured on a small grayscale thumbnail, exceeds this value (0-255). None disables motion gating.
+    :param motion_width: int: Width of the thumbnail used for the motion measurement
+    """
+    def __init__(self, every_n_frames: int = 15, motion_threshold: Optional[float] = 12.0, motion_width: int = 64):
+        self.every_n_frames = max(1, every_n_frames)
+        self.motion_threshold = motion_threshold
+        self.motion_width = motion_width
+
+    def signature(self) -> str:
+        return f"n{self.every_n_frames}_m{self.motion_threshold}_w{self.motion_width}"
+
+    @classmethod
+    def dense(cls):
+        return cls(every_n_frames=1, motion_threshold=None)
+
+    def thumbnail(self, frame: np.ndarray) -> np.ndarray:
+        height, width = frame.shape[:2]
+        size = (self.motion_width, max(1, round(height * self.motion_width / width)))
+        small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    def should_detect(self, frame_num: int, is_window_edge: bool, motion: Optional[float]) -> bool:
+        if is_window_edge or frame_num % self.every_n_frames == 0:
+            return True
+        return self.motion_threshold is not None and motion is not None and motion > self.motion_threshold
+
+
+class AnalysisStats:
+    def __init__(self):
+        self.frames_analyzed = 0
+        self.detector_calls = 0
+        self.motion_triggered = 0
+        self.frames_from_cache = 0
+
+    @property
+    def calls_saved(self) -> int:
+        return self.frames_analyzed - self.detector_calls
+
+    def as_dict(self) -> Dict[str, int]:
+        return {
+            "frames_analyzed": self.frames_analyzed,
+            "detector_calls": self.detector_calls,
+            "motion_triggered": self.motion_triggered,
+            "calls_saved": self.calls_saved,
+            "frames_from_cache": self.frames_from_cache,
+        }
+
+
+def round_refined_scale(refined_scale: float) -> float:
+    return math.ceil(refined_scale * 10) / 10
+
+
+def merge_windows(windows: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    merged = []
+    for start, end in sorted(w for w in windows if w[1] > w[0]):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def interpolate_samples(samples: Dict[int, Optional[float]], start: int, end: int) -> Dict[int, Optional[float]]:
+    """
+    Fill every frame of [start, end) from the sparse detector samples by linear interpolation.
+    Samples without a face are ignored; if none of the window's samples found a face, all frames get None.
+    """
+    found = sorted((frame_num, scale) for frame_num, scale in samples.items() if scale is not None)
+    if not found:
+        return {frame_num: None for frame_num in range(start, end)}
+    frames = np.arange(start, end)
+    sample_frames, sample_scales = zip(*found)
+    interpolated = np.interp(frames, sample_frames, sample_scales)
+    return {int(frame_num): round_refined_scale(float(scale)) for frame_num, scale in zip(frames, interpolated)}
+
+
+def detect_face(frame: np.ndarray) -> Tuple[Optional[float], Optional[Tuple[float, float, float, float]]]:
+    """
+    Run the face detector on one frame.
+
+    :return: tuple: Refined scale and face box (x, y, w, h) in frame pixels, both None when no face was found
+    """
+    refined_scale, box, _ = get_bounding_box(frame)
+    if refined_scale is None:
+        return None, None
+    return refined_scale, tuple(float(v) for v in box) if box is not None else None
+
+
+def analyze_window(cap, start: int, end: int, policy: SamplingPolicy, stats: AnalysisStats,
+                   profiler: Optional[RenderProfiler] = None) -> Tuple[Dict[int, tuple], int]:
+    """
+    Read frames [start, end) from an already positioned capture and detect on the frames the policy picks.
+    Frame reads and detector calls are recorded as the "analysis_decode" and "face_detection" stages.
+
+    :return: tuple: Frame number -> (refined scale, box) for every detector call, and the end of the scanned range
+    """
+    profiler = profiler or RenderProfiler()
+    read, detect = profiler.stage("analysis_decode"), profiler.stage("face_detection")
+    samples = {}
+    last_thumbnail = None
+    for frame_num in range(start, end):
+        read_start = time.perf_counter()
+        ret, frame = cap.read()
+        read.record(time.perf_counter() - read_start)
+        if not ret:
+            return samples, frame_num
+        stats.frames_analyzed += 1
+
+        motion = None
+        thumbnail = None
+        if policy.motion_threshold is not None:
+            thumbnail = policy.thumbnail(frame)
+            if last_thumbnail is not None:
+                motion = float(cv2.absdiff(thumbnail, last_thumbnail).mean())
+
+        is_window_edge = frame_num in (start, end - 1)
+        if not policy.should_detect(frame_num, is_window_edge, motion):
+            continue
+        if motion is not None and motion > policy.motion_threshold:
+            stats.motion_triggered += 1
+
+        stats.detector_calls += 1
+        detect_start = time.perf_counter()
+        samples[frame_num] = detect_face(frame)
+        detect.record(time.perf_counter() - detect_start)
+        last_thumbnail = thumbnail
+
+    return samples, end
+
+
+def analyze_zoom_windows(video_path: str, zoom_effects: List, fps: float, total_frames: int,
+                         policy: Optional[SamplingPolicy] = None, cache=None, decoder: str = "opencv",
+                         frame_size: Optional[Tuple[int, int]] = None,
+                         profiler: Optional[RenderProfiler] = None) -> Tuple[Dict[int, Optional[float]], Dict[int, tuple], AnalysisStats]:
+    """
+    Run the face detector only inside the hold window of each zoom effect.
+
+    The capture seeks straight to each window (or grab()s across short gaps), so frames
+    outside the windows are never retrieved. Inside a window the detector runs on the frames
+    picked by the sampling policy and the refined scale is interpolated in between.
+    With a FaceAnalysisCache, frame ranges scanned by earlier calls are not decoded again.
+    With decoder="ffmpeg" each range is decoded by its own FFmpegReader, which needs the `frame_size`.
+    Frame reads and detector calls are timed into the `profiler` (see analyze_window).
+
+    :return: tuple: Frame number -> refined scale (None when no face was found), the sparse face boxes
+        (frame number -> (x, y, w, h)) detected inside the windows, and the analysis stats
+    """
+    policy = policy or SamplingPolicy()
+    stats = AnalysisStats()
+    windows = merge_windows([effect.hold_frames(fps, total_frames) for effect in zoom_effects])
+    samples = dict(cache.samples) if cache is not None else {}
+    to_scan = []
+    for start, end in windows:
+        to_scan += cache.uncovered(start, end) if cache is not None else [(start, end)]
+
+    cap = cv2.VideoCapture(video_path) if to_scan and decoder != "ffmpeg" else None
+    position = 0
+    try:
+        for start, end in to_scan:
+            if decoder == "ffmpeg":
+                # ffmpeg seeks frame-accurately itself and decodes exactly the range
+                cap = FFmpegReader(video_path, frame_size, fps, start, end)
+            elif start < position or start - position > SEEK_THRESHOLD_FRAMES:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+            else:
+                while position < start and cap.grab():
+                    position += 1
+
+            window_samples, position = analyze_window(cap, start, end, policy, stats, profiler)
+            if decoder == "ffmpeg":
+                cap.release()
+                cap = None
+            samples.update(window_samples)
+            if cache is not None:
+                cache.add(window_samples, start, position)
+    finally:
+        if cap is not None:
+            cap.release()
+    if cache is not None and to_scan:
+        cache.save()
+
+    refined_scales = {}
+    face_boxes = {}
+    for start, end in windows:
+        window_samples = {frame_num: sample for frame_num, sample in samples.items() if start <= frame_num < end}
+        refined_scales.update(interpolate_samples({frame_num: scale for frame_num, (scale, _) in window_samples.items()},
+                                                  start, end))
+        face_boxes.update({frame_num: box for frame_num, (_, box) in window_samples.items() if box is not None})
+    stats.frames_from_cache = sum(end - start for start, end in windows) - sum(end - start for start, end in to_scan)
+
+    logging.info("Analyzed %d of %d frames in %d zoom windows with %d detector calls (%d saved, %d motion-triggered, "
+                 "%d frames from cache)", stats.frames_analyzed, total_frames, len(windows), stats.detector_calls,
+                 stats.calls_saved, stats.motion_triggered, stats.frames_from_cache)
+    return refined_scales, face_boxes, stats
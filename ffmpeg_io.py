@@ -0,0 +1,269 @@
+import json
+import logging
+import os
+import subprocess
+import tempfile
+from typing import List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+# Audio codecs the MP4 muxer accepts as they are; any other audio track is transcoded to AAC
+MP4_AUDIO_CODECS = {"aac", "mp3", "ac3", "eac3", "opus", "alac", "flac"}
+
+# Length of one HLS segment, and the longest stretch of an fMP4 output the player has to wait for
+SEGMENT_SECONDS = 2
+
+
+def container_args(container: str, output_path: str, fps: float) -> List[str]:
+    """
+    Muxer arguments of each output container:
+    - "mp4": one file with the index up front, playable once the render finished
+    - "fmp4": fragmented MP4, every fragment is playable as soon as it is written
+    - "hls": an event playlist of fMP4 segments next to `output_path` (the .m3u8), growing while rendering
+    """
+    if container == "mp4":
+        return ['-movflags', '+faststart']
+    if container == "fmp4":
+        return ['-movflags', '+frag_keyframe+empty_moov+default_base_moof',
+                '-frag_duration', str(SEGMENT_SECONDS * 1000000)]
+    if container == "hls":
+        # HLS only cuts on keyframes, so a fixed GOP keeps the segments SEGMENT_SECONDS long
+        segment_dir = os.path.dirname(output_path)
+        return ['-g', str(max(1, int(round(fps * SEGMENT_SECONDS)))), '-f', 'hls', '-hls_time', str(SEGMENT_SECONDS),
+                '-hls_playlist_type', 'event', '-hls_segment_type', 'fmp4', '-hls_flags', 'independent_segments',
+                '-hls_fmp4_init_filename', 'init.mp4',
+                '-hls_segment_filename', os.path.join(segment_dir, 'segment_%05d.m4s')]
+    raise ValueError(f"Unknown container {container}")
+
+
+def probe_audio_codec(video_path: str) -> Optional[str]:
+    """Codec name of the first audio stream, None when there is none (or ffprobe failed)."""
+    command = ['ffprobe', '-v', 'error', '-select_streams', 'a:0', '-show_entries', 'stream=codec_name',
+               '-of', 'default=nw=1:nk=1', video_path]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        logging.warning("Failed to probe the audio of %s: %s", video_path, result.stderr.decode(errors="replace"))
+        return None
+    return result.stdout.decode().strip() or None
+
+
+def audio_codec_args(audio_source: str) -> List[str]:
+    """Stream-copy the audio of `audio_source` when MP4 can hold it (see MP4_AUDIO_CODECS), else transcode to AAC."""
+    codec = probe_audio_codec(audio_source)
+    if codec is None or codec in MP4_AUDIO_CODECS:
+        return ['-c:a', 'copy']
+    logging.info("Transcoding %s audio of %s to AAC", codec, audio_source)
+    return ['-c:a', 'aac', '-b:a', '192k']
+
+
+def probe_start_offset(video_path: str) -> float:
+    """
+    Seconds between the container start and the first decoded video frame, which is not 0 e.g. in AVI files
+    with B-frames. Seeking to frame n by time has to add it; 0 when ffprobe failed.
+    """
+    # A second of packets decodes the first frame even behind an edit list pre-roll
+    command = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-read_intervals', '%+1',
+               '-show_entries', 'frame=best_effort_timestamp_time:format=start_time', '-of', 'json', video_path]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        logging.warning("Failed to probe the first frame of %s: %s", video_path, result.stderr.decode(errors="replace"))
+        return 0.0
+    info = json.loads(result.stdout.decode())
+    times = [float(frame["best_effort_timestamp_time"]) for frame in info.get("frames", [])
+             if frame.get("best_effort_timestamp_time", "N/A") != "N/A"]
+    start_time = info.get("format", {}).get("start_time", "N/A")
+    if not times or start_time == "N/A":
+        return 0.0
+    return max(0.0, min(times) - float(start_time))
+
+
+def is_constant_frame_rate(video_path: str, fps: float) -> bool:
+    """
+    Whether every frame of the video is where `fps` puts it, within a quarter frame. Only then do frame numbers
+    map to timestamps, so a capture seeked to frame n (by OpenCV or FFmpegReader) starts at the frame a
+    sequential read would reach. False when ffprobe failed.
+    """
+    command = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'packet=pts_time,dts_time',
+               '-of', 'csv=p=0', video_path]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        logging.warning("Failed to probe the packets of %s: %s", video_path, result.stderr.decode(errors="replace"))
+        return False
+    rows = [line.split(',') for line in result.stdout.decode().splitlines() if line]
+    if not rows:
+        return False
+    # Some containers (AVI with B-frames) leave the pts of reordered packets unset; their dts are evenly spaced
+    column = 0 if all(row[0] not in ('', 'N/A') for row in rows) else 1
+    times = np.sort([float(row[column]) for row in rows if len(row) > column and row[column] not in ('', 'N/A')])
+    if len(times) < len(rows):
+        return False
+    frames = (times - times[0]) * fps
+    return bool(np.all(np.abs(frames - np.arange(len(frames))) < 0.25))
+
+
+def keyframe_args(keyframe_times: Optional[Sequence[float]]) -> List[str]:
+    """Force IDR frames at `keyframe_times` (seconds), so seeking to any of them needs no decoding from earlier frames."""
+    if not keyframe_times:
+        return []
+    times = ",".join(f"{time:.3f}" for time in sorted(set(keyframe_times)))
+    return ['-force_key_frames', times, '-forced-idr', '1']
+
+
+class FFmpegWriter:
+    """
+    Drop-in replacement for cv2.VideoWriter that streams raw BGR frames to a single ffmpeg
+    process over stdin and encodes them with libx264 straight into the final container.
+
+    When `audio_source` is given, the same process maps the first audio stream of that file
+    (stream-copied when MP4 can hold it, see audio_codec_args), so no separate audio extraction or mux step is needed. `audio_offset` (seconds)
+    starts the audio later in the source, for outputs that start mid-video.
+
+    `container` picks the output format (see container_args); "fmp4" and "hls" can be played while
+    frames are still being written. `keyframe_times` are forced to IDR frames. `encode_args` replace the
+    default yuv420p pixel format, e.g. to match the stream a segment is spliced into (see splice_encode_args).
+    """
+    def __init__(self, output_path: str, fps: float, frame_size: Tuple[int, int], audio_source: Optional[str] = None,
+                 preset: str = "medium", crf: int = 23, output_args: Optional[List[str]] = None,
+                 container: str = "mp4", keyframe_times: Optional[Sequence[float]] = None, audio_offset: float = 0.0,
+                 encode_args: Optional[List[str]] = None):
+        self.output_path = output_path
+        self.frame_size = frame_size
+        width, height = frame_size
+
+        command = [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', f'{fps}', '-i', '-',
+        ]
+        if audio_source is not None:
+            if audio_offset > 0:
+                command += ['-ss', f'{audio_offset:.6f}']
+            command += ['-i', audio_source, '-map', '0:v:0', '-map', '1:a:0?', *audio_codec_args(audio_source),
+                        '-shortest']
+        command += ['-c:v', 'libx264', '-preset', preset, '-crf', str(crf)]
+        command += encode_args if encode_args is not None else ['-pix_fmt', 'yuv420p']
+        command += keyframe_args(keyframe_times)
+        command += output_args if output_args is not None else container_args(container, output_path, fps)
+        command.append(output_path)
+
+        # stderr goes to a file: a pipe nobody reads would fill up and stall the encoder
+        self._stderr = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=self._stderr)
+
+    def isOpened(self) -> bool:
+        return self.process.poll() is None
+
+    def write(self, frame: np.ndarray):
+        try:
+            self.process.stdin.write(memoryview(np.ascontiguousarray(frame)))
+        except (BrokenPipeError, ValueError):
+            self.release()
+            raise RuntimeError(f"ffmpeg exited while encoding {self.output_path}")
+
+    def release(self):
+        if not self.process.stdin.closed:
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+        returncode = self.process.wait()
+        if not self._stderr.closed:
+            self._stderr.seek(0)
+            self._error_output = self._stderr.read().decode(errors="replace")
+            self._stderr.close()
+            if returncode != 0:
+                logging.error("FFmpeg error during encoding: %s", self._error_output)
+        if returncode != 0:
+            raise RuntimeError(f"Failed to encode {self.output_path}")
+
+
+class FFmpegReader:
+    """
+    Frame source with the cv2.VideoCapture read interface, decoding in a separate ffmpeg process
+    (with its own decoder threads) and reading raw BGR frames from its stdout.
+
+    Frames [start_frame, end_frame) are decoded; ffmpeg seeks to the start itself, which lands on the frame a
+    sequential read would reach for constant frame rate sources (see is_constant_frame_rate). With `output_size`
+    (width, height) ffmpeg also downscales, so Python never sees the full resolution frames.
+    read(image=buffer) fills the given buffer in place, like cv2.VideoCapture.read.
+    """
+    def __init__(self, video_path: str, frame_size: Tuple[int, int], fps: float, start_frame: int = 0,
+                 end_frame: Optional[int] = None, output_size: Optional[Tuple[int, int]] = None, threads: int = 0):
+        self.video_path = video_path
+        self.width, self.height = output_size or frame_size
+        self.frame_bytes = self.width * self.height * 3
+
+        command = ['ffmpeg', '-loglevel', 'error', '-nostdin', '-threads', str(threads)]
+        if start_frame > 0:
+            # Half a frame early, so rounding never skips the start frame; accurate seek drops the frames before it.
+            # Timestamps count from the first frame, like OpenCV's frame numbers (see probe_start_offset)
+            start_time = probe_start_offset(video_path) + (start_frame - 0.5) / fps
+            command += ['-ss', f'{start_time:.6f}']
+        # -vsync, deprecated by -fps_mode in ffmpeg 5.1 but still accepted, so ffmpeg 4.x (Ubuntu 22.04) works too
+        command += ['-i', video_path, '-map', '0:v:0', '-an', '-sn', '-vsync', 'passthrough']
+        if end_frame is not None:
+            command += ['-frames:v', str(max(0, end_frame - start_frame))]
+        if output_size is not None and tuple(output_size) != tuple(frame_size):
+            command += ['-vf', f'scale={self.width}:{self.height}:flags=area']
+        command += ['-f', 'rawvideo', '-pix_fmt', 'bgr24', '-']
+
+        self._stderr = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=self._stderr,
+                                        bufsize=self.frame_bytes)
+        self.finished = False
+
+    def isOpened(self) -> bool:
+        return not self.finished
+
+    def read(self, image: Optional[np.ndarray] = None) -> Tuple[bool, Optional[np.ndarray]]:
+        if self.finished:
+            return False, None
+        # Like cv2.VideoCapture.read, a buffer that does not fit is replaced by a new array; callers compare
+        # the returned array with their buffer
+        if (image is None or image.shape != (self.height, self.width, 3) or image.dtype != np.uint8
+                or not image.flags.c_contiguous or not image.flags.writeable):
+            image = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        view = memoryview(image).cast('B')
+        received = 0
+        while received < self.frame_bytes:
+            count = self.process.stdout.readinto(view[received:])
+            if not count:
+                self.finished = True
+                if received:
+                    logging.warning("Truncated frame at the end of %s", self.video_path)
+                return False, None
+            received += count
+        return True, image
+
+    def grab(self) -> bool:
+        ret, self._grabbed = self.read(getattr(self, "_grabbed", None))
+        return ret
+
+    def release(self):
+        self.finished = True
+        if self.process.poll() is None:
+            # Stopped before the end of the range
+            self.process.kill()
+        self.process.stdout.close()
+        returncode = self.process.wait()
+        if not self._stderr.closed:
+            self._stderr.seek(0)
+            error_output = self._stderr.read().decode(errors="replace")
+            self._stderr.close()
+            if returncode > 0:
+                logging.error("FFmpeg error during decoding: %s", error_output)
+
+
+def open_capture(video_path: str, decoder: str = "opencv", frame_size: Optional[Tuple[int, int]] = None,
+                 fps: Optional[float] = None, start_frame: int = 0, end_frame: Optional[int] = None,
+                 output_size: Optional[Tuple[int, int]] = None):
+    """
+    Capture positioned at `start_frame`: an FFmpegReader for decoder="ffmpeg" (which needs the source
+    `frame_size` and `fps`), otherwise a cv2.VideoCapture. Only FFmpegReader applies `output_size` and `end_frame`.
+    """
+    if decoder == "ffmpeg":
+        return FFmpegReader(video_path, frame_size, fps, start_frame, end_frame, output_size)
+    cap = cv2.VideoCapture(video_path)
+    if start_frame > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+    return cap
@@ -0,0 +1,154 @@
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from ffmpeg_io import audio_codec_args, keyframe_args, probe_start_offset
+from segments import probe_video_stream, run_ffmpeg, zoom_frame_ranges
+from zoom_timeline import ZoomTimeline
+
+
+def source_rects(timeline: ZoomTimeline) -> np.ndarray:
+    """
+    Per-frame crop rectangle (x, y, width, height) that maps onto the whole output frame: the ROI of
+    apply_zoom's "roi" backend, rounded the same way. Unzoomed frames get the whole frame.
+    """
+    width, height = timeline.width, timeline.height
+    scales = np.asarray(timeline.scales, dtype=np.float64)
+    left = np.round(timeline.center_x * (1 - 1 / scales))
+    top = np.round(timeline.center_y * (1 - 1 / scales))
+    rects = np.stack([left, top, np.round(width / scales), np.round(height / scales)], axis=1).astype(np.int64)
+    rects[scales == 1.0] = (0, 0, width, height)
+    return rects
+
+
+def zoom_commands(timeline: ZoomTimeline, spans: List[Tuple[int, int]], rects: np.ndarray,
+                  start_offset: float = 0.0) -> List[str]:
+    """
+    sendcmd commands that move the crop of each zoom span (crop@zoom<i>) to the rectangle of every frame
+    where it changes. A command is due half a frame before its frame, so timestamp jitter never applies it
+    a frame early or late; `start_offset` is the timestamp of the first frame (probe_start_offset).
+    """
+    commands = []
+    for index, (start, end) in enumerate(spans):
+        # The crop starts out at the rectangle of the span's first frame
+        changed = np.flatnonzero(np.any(np.diff(rects[start:end], axis=0) != 0, axis=1)) + start + 1
+        for frame in changed:
+            x, y, w, h = rects[frame].tolist()
+            due = start_offset + (frame - 0.5) / timeline.fps
+            commands.append(f"{due:.6f} crop@zoom{index} w {w}, crop@zoom{index} h {h}, "
+                            f"crop@zoom{index} x {x}, crop@zoom{index} y {y}")
+    return commands
+
+
+def build_zoom_filter(timeline: ZoomTimeline, start_offset: float = 0.0, sample_aspect_ratio: str = "1",
+                      pix_fmt: str = "yuv420p") -> str:
+    """
+    Compile the timeline into a filtergraph that only touches the zoom spans: the stream is split at the
+    span edges, frames outside them pass through unchanged, and each span is cropped to its per-frame zoom
+    rectangle and scaled back to the full frame with bilinear interpolation, like the frame pipeline's
+    "roi" backend. sendcmd sets the rectangles, so the graph grows with the spans, not with the frames.
+    concat does not pass the frame rate on, so encode the output with -vsync passthrough to keep every frame.
+    :param start_offset: Timestamp of the first frame, see probe_start_offset
+    :param sample_aspect_ratio: Pixel aspect ratio of the source, e.g. "16/15"; scaling the crops changes it
+    :param pix_fmt: Pixel format of the output, the one the encoder takes; concat needs it the same on all pieces
+    """
+    rects = source_rects(timeline)
+    spans = zoom_frame_ranges(timeline.scales)
+    if not spans:
+        return f"format={pix_fmt}"
+    # Spans and the stretches between them, in order
+    pieces, position = [], 0
+    for index, (start, end) in enumerate(spans):
+        if position < start:
+            pieces.append((position, start, None))
+        pieces.append((start, end, index))
+        position = end
+    if position < timeline.total_frames:
+        pieces.append((position, timeline.total_frames, None))
+
+    commands = zoom_commands(timeline, spans, rects, start_offset)
+    graph = [f"sendcmd=c='{'; '.join(commands)}'," if commands else ""]
+    graph.append(f"split={len(pieces)}" + "".join(f"[in{i}]" for i in range(len(pieces))) + ";")
+    for i, (start, end, span) in enumerate(pieces):
+        # The last piece runs to the end of the stream, whatever the frame count in the header says
+        trim = f"trim=start_frame={start}" + (f":end_frame={end}" if i < len(pieces) - 1 else "")
+        zoom = ""
+        if span is not None:
+            x, y, w, h = rects[start].tolist()
+            # Zoomed in RGB like the frame pipeline: cropping subsampled chroma is off by up to a pixel.
+            # The crop commands resize the crop's output link itself, so scale would not notice the new frame
+            # size and keep its old scaler; behind a null filter it sees the size change and reconfigures.
+            zoom = (f",format=rgb24,crop@zoom{span}=w={w}:h={h}:x={x}:y={y}:exact=1,null"
+                    f",scale={timeline.width}:{timeline.height}:flags=bilinear+accurate_rnd+full_chroma_int")
+        graph.append(f"[in{i}]{trim},setpts=PTS-STARTPTS{zoom},format={pix_fmt},setsar={sample_aspect_ratio}[out{i}];")
+    graph.append("".join(f"[out{i}]" for i in range(len(pieces))) + f"concat=n={len(pieces)}:v=1:a=0")
+    return "".join(graph)
+
+
+def source_aspect_ratio(video_path: str) -> str:
+    """Sample aspect ratio of the first video stream for setsar, "1" when unknown."""
+    ratio = probe_video_stream(video_path).get("sample_aspect_ratio", "0:1")
+    return "1" if ratio in ("0:1", "N/A") else ratio.replace(":", "/")
+
+
+def ffmpeg_render(video_path: str, timeline: ZoomTimeline, output_path: str, preset: str = "medium", crf: int = 23,
+                  keyframe_times: Optional[List[float]] = None):
+    """
+    Render the whole timeline inside ffmpeg, with no Python frame loop, and copy the source audio.
+    The crop commands are timed by frame number, so the source needs a constant frame rate.
+    """
+    filter_path = output_path + '.filter.txt'
+    with open(filter_path, 'w') as f:
+        f.write(build_zoom_filter(timeline, probe_start_offset(video_path), source_aspect_ratio(video_path)))
+    command = [
+        'ffmpeg', '-y', '-i', video_path, '-filter_script:v', filter_path, '-vsync', 'passthrough',
+        '-map', '0:v:0', '-map', '0:a:0?', '-c:v', 'libx264', '-preset', preset, '-crf', str(crf),
+        '-pix_fmt', 'yuv420p', *keyframe_args(keyframe_times), *audio_codec_args(video_path), '-movflags', '+faststart',
+        output_path
+    ]
+    try:
+        run_ffmpeg(command, "Failed to render with the ffmpeg filtergraph backend")
+    finally:
+        os.remove(filter_path)
+
+
+# Lowest PSNR (dB) of a frame of the zoom filter against apply_zoom on the same decoded frame, before encoding;
+# tests/test_ffmpeg_render.py holds the backend to it. After encoding, both backends differ by encoder noise too.
+MIN_FRAME_PSNR = 40.0
+
+
+def compare_renders(reference_path: str, candidate_path: str, max_frames: Optional[int] = None) -> Dict[str, float]:
+    """
+    Per-frame PSNR of `candidate_path` against `reference_path`, e.g. the ffmpeg backend against
+    the OpenCV backend. Identical frames count as 100 dB.
+    """
+    reference, candidate = cv2.VideoCapture(reference_path), cv2.VideoCapture(candidate_path)
+    psnrs: List[float] = []
+    identical = 0
+    try:
+        while max_frames is None or len(psnrs) < max_frames:
+            ret_ref, frame_ref = reference.read()
+            ret_cand, frame_cand = candidate.read()
+            if not ret_ref or not ret_cand:
+                break
+            psnr = cv2.PSNR(frame_ref, frame_cand)
+            identical += psnr >= 100
+            psnrs.append(min(psnr, 100.0))
+    finally:
+        reference.release()
+        candidate.release()
+
+    if not psnrs:
+        raise RuntimeError("No frames to compare")
+    result = {
+        "frames": len(psnrs),
+        "identical_frames": int(identical),
+        "mean_psnr": float(np.mean(psnrs)),
+        "min_psnr": float(np.min(psnrs)),
+        "worst_frame": int(np.argmin(psnrs)),
+    }
+    logging.info("Render comparison: %s", result)
+    return result
@@ -0,0 +1,354 @@
+import logging
+import os
+import threading
+import time
+from queue import Empty, Queue
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from render_profiler import RenderProfiler
+
+_SENTINEL = None
+
+# Frame buffer memory one render may hold, and the cap shared by all renders of this process
+# (streamlit runs every session's render as a thread of the same process).
+PIPELINE_MEMORY_BUDGET = int(os.environ.get("ZOOM_PIPELINE_MEMORY_MB", "512")) * 1024 * 1024
+PROCESS_MEMORY_BUDGET = int(os.environ.get("ZOOM_PROCESS_MEMORY_MB", "2048")) * 1024 * 1024
+# Fewer buffers than this stall the pipeline, so a budget that small is exceeded rather than honoured
+MIN_POOL_SIZE = 4
+
+
+class QueueStats:
+    """Queue depth seen by one pipeline stage, sampled every time it takes an item."""
+    def __init__(self, name: str):
+        self.name = name
+        self.samples = 0
+        self.total_depth = 0
+        self.max_depth = 0
+
+    def sample(self, depth: int):
+        self.samples += 1
+        self.total_depth += depth
+        self.max_depth = max(self.max_depth, depth)
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "max_depth": self.max_depth,
+            "mean_depth": self.total_depth / self.samples if self.samples else 0.0,
+        }
+
+
+class MemoryBudget:
+    """Byte counter that blocks reservations until enough memory was released by other renders."""
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_use = 0
+        self.peak = 0
+        self.condition = threading.Condition()
+
+    def reserve(self, nbytes: int):
+        with self.condition:
+            # A single reservation larger than the limit still runs, alone
+            while self.in_use > 0 and self.in_use + nbytes > self.limit:
+                logging.info("Waiting for %d MB of frame memory (%d MB of %d MB in use)", nbytes >> 20,
+                             self.in_use >> 20, self.limit >> 20)
+                self.condition.wait()
+            self.in_use += nbytes
+            self.peak = max(self.peak, self.in_use)
+
+    def release(self, nbytes: int):
+        with self.condition:
+            self.in_use -= nbytes
+            self.condition.notify_all()
+
+
+PROCESS_BUDGET = MemoryBudget(PROCESS_MEMORY_BUDGET)
+
+
+class FramePool:
+    """
+    Fixed set of preallocated frame buffers shared by the decode, transform and write stages.
+
+    The decoder reads into `frames[slot]` (cap.read(image=...)), a zoomed frame is rendered into
+    `output(slot)` (dst=...), and only the slot number travels through the queues. The slot goes back
+    to the pool once the writer consumed it, so memory use is fixed by the pool size, not the video length.
+
+    A slot can hold several outputs (one per render variant), `output_bytes` is their total size per slot.
+    With a `budget` the worst case size of the pool (every slot with all outputs) is reserved from it
+    before allocating, and handed back by dispose().
+    """
+    def __init__(self, size: int, shape: Tuple[int, ...], dtype=np.uint8, budget: Optional[MemoryBudget] = None,
+                 output_bytes: Optional[int] = None):
+        self.size = size
+        self.shape = shape
+        self.slot_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        self.output_bytes = self.slot_bytes if output_bytes is None else output_bytes
+        self.budget = budget
+        self.reserved = size * (self.slot_bytes + self.output_bytes) if budget is not None else 0
+        if budget is not None:
+            budget.reserve(self.reserved)
+        self.frames: List[np.ndarray] = [np.empty(shape, dtype=dtype) for _ in range(size)]
+        # Zoom destinations are allocated on first use, unzoomed frames never need one
+        self.outputs: List[Dict[int, np.ndarray]] = [{} for _ in range(size)]
+        self.free = Queue()
+        for slot in range(size):
+            self.free.put(slot)
+        self.closed = False
+        self.max_in_use = 0
+        self.lock = threading.Lock()
+        self.in_flight_bytes = 0
+        self.peak_in_flight_bytes = 0
+
+    @classmethod
+    def within_budget(cls, shape: Tuple[int, ...], max_size: int, budget_bytes: int = PIPELINE_MEMORY_BUDGET,
+                      process_budget: Optional[MemoryBudget] = PROCESS_BUDGET,
+                      output_bytes: Optional[int] = None) -> "FramePool":
+        """
+        Pool with as many slots as `budget_bytes` allows for frames of `shape` (counting each slot's output
+        buffers), at most `max_size` and at least MIN_POOL_SIZE.
+        """
+        frame_bytes = int(np.prod(shape))
+        slot_bytes = frame_bytes + (frame_bytes if output_bytes is None else output_bytes)
+        size = min(max_size, budget_bytes // slot_bytes)
+        if size < MIN_POOL_SIZE:
+            logging.warning("A %d MB frame budget holds %d frames of %s, using %d", budget_bytes >> 20, size, shape,
+                            MIN_POOL_SIZE)
+            size = MIN_POOL_SIZE
+        return cls(size, shape, budget=process_budget, output_bytes=output_bytes)
+
+    def slot_nbytes(self, slot: int) -> int:
+        return self.slot_bytes + sum(output.nbytes for output in self.outputs[slot].values())
+
+    def acquire(self) -> int:
+        """Block until a buffer is free and return its slot."""
+        slot = self.free.get()
+        if self.closed:
+            self.free.put(slot)
+            raise RuntimeError("Frame pool closed")
+        with self.lock:
+            self.max_in_use = max(self.max_in_use, self.size - self.free.qsize())
+            self.in_flight_bytes += self.slot_nbytes(slot)
+            self.peak_in_flight_bytes = max(self.peak_in_flight_bytes, self.in_flight_bytes)
+        return slot
+
+    def release(self, slot: int):
+        with self.lock:
+            self.in_flight_bytes -= self.slot_nbytes(slot)
+        self.free.put(slot)
+
+    def output(self, slot: int, index: int = 0, shape: Optional[Tuple[int, ...]] = None) -> np.ndarray:
+        """Output buffer `index` of a slot, of the frame shape unless `shape` is given."""
+        if index not in self.outputs[slot]:
+            with self.lock:
+                output = np.empty(shape or self.shape, dtype=self.frames[slot].dtype)
+                self.outputs[slot][index] = output
+                # The slot is in flight while it is being transformed
+                self.in_flight_bytes += output.nbytes
+                self.peak_in_flight_bytes = max(self.peak_in_flight_bytes, self.in_flight_bytes)
+        return self.outputs[slot][index]
+
+    def close(self):
+        """Wake up and fail any acquire() that is waiting, so a stopped pipeline can shut down."""
+        self.closed = True
+        self.free.put(-1)
+
+    def dispose(self):
+        """Close the pool, drop its buffers and return its reservation to the budget."""
+        self.close()
+        self.frames, self.outputs = [], []
+        if self.budget is not None and self.reserved:
+            self.budget.release(self.reserved)
+            self.reserved = 0
+
+    @property
+    def nbytes(self) -> int:
+        return (sum(frame.nbytes for frame in self.frames)
+                + sum(output.nbytes for outputs in self.outputs for output in outputs.values()))
+
+
+def read_into_pool(cap, pool: FramePool, start_frame: int = 0, resize: Optional[Tuple[int, int]] = None,
+                   profiler: Optional[RenderProfiler] = None):
+    """
+    Decode `cap` into pool buffers, yielding (frame_number, slot) for run_ordered_pipeline.
+    With `resize` (width, height) the frame is decoded into one scratch buffer and downscaled into the pool.
+    The time spent waiting for a free buffer and decoding is recorded as the "pool_wait" and "decode" stages.
+    """
+    profiler = profiler or RenderProfiler()
+    pool_wait, decode = profiler.stage("pool_wait"), profiler.stage("decode")
+    frame_count = start_frame
+    decoded = None
+    while cap.isOpened():
+        start = time.perf_counter()
+        slot = pool.acquire()
+        acquired = time.perf_counter()
+        pool_wait.record(acquired - start)
+        if resize is None:
+            ret, frame = cap.read(image=pool.frames[slot])
+            if ret and frame is not pool.frames[slot]:
+                # The decoder allocated a new array instead of filling the slot, e.g. for another frame size
+                if frame.shape != pool.frames[slot].shape or frame.dtype != pool.frames[slot].dtype:
+                    pool.release(slot)
+                    raise ValueError(f"Decoded frame {frame.shape} {frame.dtype} does not fit the frame pool "
+                                     f"{pool.frames[slot].shape} {pool.frames[slot].dtype}")
+                np.copyto(pool.frames[slot], frame)
+        else:
+            ret, decoded = cap.read(image=decoded)
+            if ret:
+                cv2.resize(decoded, resize, dst=pool.frames[slot], interpolation=cv2.INTER_AREA)
+        decode.record(time.perf_counter() - acquired)
+        if not ret:
+            pool.release(slot)
+            break
+        yield frame_count, slot
+        frame_count += 1
+
+
+def drain(queue: Queue):
+    try:
+        while True:
+            queue.get_nowait()
+    except Empty:
+        pass
+
+
+def default_workers() -> int:
+    # Leave one core to the decode thread and one to the writer / encoder
+    return max(1, (os.cpu_count() or 1) - 2)
+
+
+def default_pool_size(workers: int) -> int:
+    # One frame in every worker, plus room for the queues and for reordering behind a slow frame.
+    # FramePool.within_budget lowers this for large frames.
+    return 2 * workers + 8
+
+
+def run_ordered_pipeline(frames: Iterable[Tuple[int, np.ndarray]], transform: Callable[[int, np.ndarray], np.ndarray],
+                         write: Callable[[np.ndarray], None], workers: Optional[int] = None, queue_size: int = 64,
+                         first_frame: int = 0, progress: Optional[Callable[[int], None]] = None,
+                         pool: Optional[FramePool] = None,
+                         profiler: Optional[RenderProfiler] = None) -> Dict[str, Dict[str, float]]:
+    """
+    Decode thread -> N transform workers -> reorder buffer -> single ordered writer.
+
+    `frames` yields consecutive (frame_number, frame) pairs starting at `first_frame`, and is consumed on its own thread.
+    `transform` runs on the worker threads (cv2 releases the GIL, so they scale across cores).
+    `write` is called on the calling thread, strictly in frame order.
+
+    With a `pool`, `frames` yields (frame_number, slot) pairs instead (see read_into_pool), `transform`
+    gets the slot and returns the frame to write, and the slot is released once it was written.
+
+    The `profiler` records every transform and write call, and how long each stage waited on its input queue
+    (decode_queue_wait is the decode thread blocked on a full queue).
+
+    :return: dict: Queue depth stats of each stage
+    """
+    workers = workers or default_workers()
+    profiler = profiler or RenderProfiler()
+    decode_wait, transform_wait, write_wait = (profiler.stage("decode_queue_wait"), profiler.stage("transform_queue_wait"),
+                                               profiler.stage("write_queue_wait"))
+    transform = profiler.timed("transform", transform)
+    write = profiler.timed("write", write)
+    decoded = Queue(maxsize=queue_size)
+    transformed = Queue(maxsize=queue_size)
+    stats = {
+        "transform": QueueStats("transform"),
+        "write": QueueStats("write"),
+        "reorder": QueueStats("reorder"),
+    }
+    errors = []
+    stop = threading.Event()
+
+    def decode():
+        try:
+            for item in frames:
+                if stop.is_set():
+                    break
+                start = time.perf_counter()
+                decoded.put(item)
+                decode_wait.record(time.perf_counter() - start)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            for _ in range(workers):
+                decoded.put(_SENTINEL)
+
+    def work():
+        try:
+            while True:
+                stats["transform"].sample(decoded.qsize())
+                start = time.perf_counter()
+                item = decoded.get()
+                transform_wait.record(time.perf_counter() - start)
+                if item is _SENTINEL:
+                    break
+                frame_number, frame = item
+                transformed.put((frame_number, (frame, transform(frame_number, frame))))
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            transformed.put(_SENTINEL)
+
+    threads = [threading.Thread(target=decode, name="pipeline-decode", daemon=True)]
+    threads += [threading.Thread(target=work, name=f"pipeline-transform-{i}", daemon=True) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    def emit(entry):
+        slot, frame = entry
+        write(frame)
+        if pool is not None:
+            pool.release(slot)
+
+    pending = {}
+    next_frame = first_frame
+    finished_workers = 0
+    written = 0
+    try:
+        while finished_workers < workers:
+            stats["write"].sample(transformed.qsize())
+            start = time.perf_counter()
+            item = transformed.get()
+            write_wait.record(time.perf_counter() - start)
+            if item is _SENTINEL:
+                finished_workers += 1
+                continue
+            frame_number, frame = item
+            pending[frame_number] = frame
+            stats["reorder"].sample(len(pending))
+            while next_frame in pending:
+                emit(pending.pop(next_frame))
+                next_frame += 1
+                written += 1
+                if progress is not None:
+                    progress(written)
+            if stop.is_set():
+                break
+    finally:
+        stop.set()
+        # Unblock the decode thread and the workers if the writer stopped early
+        if pool is not None and any(thread.is_alive() for thread in threads):
+            pool.close()
+        while any(thread.is_alive() for thread in threads):
+            drain(decoded)
+            drain(transformed)
+            for thread in threads:
+                thread.join(timeout=0.05)
+
+    if errors:
+        raise errors[0]
+    for frame_number in sorted(pending):
+        emit(pending.pop(frame_number))
+        written += 1
+    profiler.count("frames", written)
+
+    result = {name: stage.as_dict() for name, stage in stats.items()}
+    if pool is not None:
+        result["pool"] = {"size": pool.size, "max_in_use": pool.max_in_use, "bytes": pool.nbytes,
+                          "peak_in_flight_bytes": pool.peak_in_flight_bytes}
+        if pool.budget is not None:
+            result["pool"]["process_peak_bytes"] = pool.budget.peak
+    logging.info("Pipeline wrote %d frames with %d transform workers, queue depths: %s", written, workers, result)
+    return result
@@ -5,78 +5,116 @@ import torchaudio as ta
 import numpy as np
 from typing import List, Tuple
 from tqdm import tqdm
-from glob import glob
 import streamlit.components.v1 as components
-import base64
 import os
 import hashlib
+import shutil
+import uuid
 from pathlib import Path
-from utils import save_audio_from_video, check_ffmpeg, split_sentences_by_seconds, get_word_indices, split_words_by_duration, add_silence_duration, split_and_save_audio, save_emphasis_predictions, construct_new_sentences, add_sentences_to_file   
-from asr import get_client_settings, transcribe_audio
-import json
+from utils import check_ffmpeg
+from asr import get_client_settings
 from predictor import ClaudeAdapter
-from zoom_effect import ZoomEffect, process_video
+from zoom_effect import process_video, render_output_path, render_zoom_clip
+from zoom_pipeline import CLAUDE_MODEL, get_zooms_claude, predict_zooms, transcribe_video, work_paths
+from media_server import finish_growing, media_url
+from render_manifest import DirectoryLock, remove_stale_dirs
 from dotenv import load_dotenv, find_dotenv
 
 _ = load_dotenv(find_dotenv())
 
-SPLIT_SENTENCE_BY_DURATION = 240 * 7
-
-# Set up logging configuration
-def  get_zooms(preds, sntnces_splitted_by_duration, splittedwords, slow=False, jumpcut=False):
-    zoom_effects = []
-    for i, pred in enumerate(preds):
-        prediction = pred["zoom_events"]
-        for p in prediction:
-            sentence_num = p['sentence_number']
-            text_applied = p['text_applied']
-            #reason = p['reason']
-            zoom_in_scale = p['zoom_in_scale']
-            zoom_out_duration = p['zoom_out_duration']
-            st_idx, end_idx = get_word_indices(sntnces_splitted_by_duration[i][sentence_num-1], text_applied)
-            if st_idx == -1 or end_idx == -1:
-                continue
-            start_time = splittedwords[i][sentence_num-1][st_idx][1]
-            end_time = splittedwords[i][sentence_num-1][end_idx][2]
-            if slow and not jumpcut:
-                zoom_effects.append(ZoomEffect(start_time, end_time, end_time-start_time, zoom_in_scale, zoom_out_duration=zoom_out_duration, lag_time=0))
-            elif not slow and not jumpcut:
-                zoom_effects.append(ZoomEffect(start_time, end_time, 1, zoom_in_scale, 1))   
-            elif slow and jumpcut:
-                zoom_effects.append(ZoomEffect(start_time, end_time, end_time-start_time, zoom_in_scale, 0, lag_time=0))
-
-    return zoom_effects
-
-
-def  get_zooms_claude(preds, sntnces_splitted_by_duration, splittedwords, slow=False, jumpcut=False, hold=False):
-    zoom_effects = []
-    for i, pred in enumerate(preds):
-        prediction = pred.get(list(pred.keys())[0], [])
-        for p in prediction:
-            sentence_num = p['sentence_number']
-            text_applied = p['zoom_in_phrase']
-            #reason = p['reason']
-            zoom_in_scale = 1.3
-            transition_sentence_num = p['transition_sentence_number']
-            transition_sentence_word = p['transition_sentence_word']
-
-            # zoom_out_duration = p['zoom_out_duration']
-            st_idx, end_idx = get_word_indices(sntnces_splitted_by_duration[i][sentence_num-1], text_applied)
-            st_idx_cut, end_idx_cut = get_word_indices(sntnces_splitted_by_duration[i][transition_sentence_num-1], transition_sentence_word)
-
-            if st_idx == -1 or end_idx == -1:
-                continue
-            if st_idx_cut == -1 or end_idx_cut == -1:
-                continue
-            start_time = splittedwords[i][sentence_num-1][st_idx][1]
-            end_time = splittedwords[i][transition_sentence_num-1][st_idx_cut][1]
-            
-            if not slow and jumpcut and hold:
-                zoom_effects.append(ZoomEffect(start_time, end_time, 1, zoom_in_scale, 0))   
-            elif not slow and jumpcut and not hold:
-                zoom_effects.append(ZoomEffect(start_time, end_time, 1, zoom_in_scale, 0, lag_time=0))
-
-    return zoom_effects
+RENDERS_DIR = Path("temp_output/renders")
+# Renders of sessions that ended are removed once nothing was written to them for this long
+RENDER_MAX_AGE_SECONDS = float(os.environ.get("ZOOM_RENDER_MAX_AGE_HOURS", "24")) * 3600
+
+
+def new_render_dir(kind: str) -> Path:
+    """
+    Directory for a new render of this session, temp_output/renders/<session id>/<kind>-<render id>, so no
+    render overwrites one of another session or the session's other kind (preview or final).
+    Hold its DirectoryLock while rendering into it.
+    """
+    # Renders are locked while being written, so only finished ones are removed
+    for session_dir in RENDERS_DIR.glob("*/"):
+        remove_stale_dirs(session_dir, RENDER_MAX_AGE_SECONDS)
+        try:
+            # Only succeeds once the session has no renders left
+            session_dir.rmdir()
+        except OSError:
+            pass
+    session_id = st.session_state.setdefault("session_id", uuid.uuid4().hex)
+    return RENDERS_DIR / session_id / f"{kind}-{uuid.uuid4().hex[:12]}"
+
+
+def remove_earlier_renders(render_dir: Path):
+    """Remove the session's earlier renders of the kind of `render_dir`, skipping those still being written."""
+    kind = render_dir.name.split("-")[0]
+    for earlier in render_dir.parent.glob(f"{kind}-*"):
+        lock = DirectoryLock(earlier)
+        if earlier != render_dir and lock.acquire(blocking=False):
+            shutil.rmtree(earlier, ignore_errors=True)
+            lock.release()
+
+
+def page_host() -> str:
+    """Host name the browser reached the app by; it reaches the media server the same way."""
+    host = st.context.headers.get("Host") or "localhost"
+    # Drop the app's port, keeping IPv6 addresses ([::1]) whole
+    return host if host.endswith("]") else host.rsplit(":", 1)[0]
+
+
+def show_video(path: str, start_seconds: float = None):
+    """
+    Player streaming `path` from the media server with range requests, starting at `start_seconds`.
+    Only when the media server is unavailable does Streamlit serve the file (st.video), holding it in memory.
+    """
+    video_url = media_url(path, page_host())
+    if video_url is None:
+        st.video(path, start_time=int(start_seconds or 0))
+    else:
+        if start_seconds is not None:
+            video_url += f"#t={start_seconds:.3f}"
+        components.html(video_player_html(video_url), height=400)
+
+
+def video_player_html(video_url: str) -> str:
+    return f"""
+        <div style="width: 100%; height: 100%;">
+            <video id="videoPlayer" width="100%" height="100%" controls preload="metadata">
+                <source src="{video_url}" type="video/mp4">
+                Your browser does not support the video tag.
+            </video>
+        </div>
+    """
+
+
+def streamlit_progress(live_path: str = None):
+    """
+    Progress callback for process_video that shows a status line and a progress bar. With the `live_path` of a
+    fragmented MP4 render (container="fmp4"), a player plays the rendered part while it is written; the caller
+    calls finish_growing(live_path) once the render ended.
+    """
+    status_text = st.empty()
+    progress_bar = st.progress(0)
+    player = st.empty()
+    playing = False
+
+    def report(fraction, message):
+        nonlocal playing
+        if fraction is not None:
+            progress_bar.progress(fraction)
+        status_text.text(message)
+        if live_path is None:
+            return
+        if fraction == 1.0:
+            # The player of the finished render below takes over
+            player.empty()
+        elif not playing and os.path.exists(live_path):
+            video_url = media_url(live_path, page_host(), growing=True)
+            if video_url is not None:
+                with player:
+                    components.html(video_player_html(video_url), height=400)
+                playing = True
+    return report
 
 
 def main():
@@ -109,7 +147,7 @@ def main():
         
         # Display original video
         st.subheader("Original Video")
-        st.video(video_path)
+        show_video(video_path)
 
         # Transcribe audio and save transcription in a file
         if uploaded_file or not st.session_state.get('data_uploaded', False):
@@ -120,64 +158,24 @@ def main():
                 f'{uploaded_file.name}'.encode('utf-8')
             ).hexdigest()
             
-            save_audio_from_video(video_path,
-                                  video_path.replace('.mp4', '.mp3'))
-
             # Clear output
             # st.write("Before clearing session state ", st.session_state)
             # clear_cache(st.session_state)
             # st.write("After clearing session state ", st.session_state)
 
-            st.session_state.audio_file = video_path.replace('.mp4', '.mp3')
+            st.session_state.audio_file = work_paths(video_path)["audio"]
             st.session_state.video_file = video_path
             st.subheader("Transcribe Audio")
 
             #transcribe audios
             if 'asr_client_settings' not in st.session_state:
                 st.session_state['asr_client_settings'] = get_client_settings()
-            
-            output_file_path_sentence = st.session_state.audio_file \
-                .replace('recordings', 'transcriptions') \
-                .replace('.mp3', '_trancriptions_with_align_sentence.txt')
-            os.makedirs(os.path.dirname(output_file_path_sentence), exist_ok=True)
-
-            output_file_path_words = st.session_state.audio_file \
-                .replace('recordings', 'transcriptions') \
-                .replace('.mp3', '_trancriptions_with_align_words.json')
-            st.session_state.interview_to_transcription_meta_sentence, st.session_state.interview_to_transcription_meta_words = transcribe_audio( 
-            st.session_state.audio_file,
-            output_file_path_sentence,
-            output_file_path_words,
-            st.session_state['asr_client_settings']
-        )
-            
-        #split audios by sentence to predict
-        splitted_audio_dir = f"./uploaded_files/recordings/splitted_audios/{video_path.split('/')[-1].split('.')[0]}"
-        os.makedirs(splitted_audio_dir, exist_ok=True)
-
-        split_and_save_audio(st.session_state.audio_file, output_file_path_sentence, splitted_audio_dir)
-
-        # Run emphasis model and change the sentence txt file
-        files = glob(f"{splitted_audio_dir}/*.mp3")
-        splitted_audio_txt_dir = f"./uploaded_files/emphasis_detection/{video_path.split('/')[-1].split('.')[0]}"
-
-        save_emphasis_predictions(files,
-                                  splitted_audio_txt_dir)
-        audio_basename = os.path.basename(st.session_state.audio_file)
-        # add silence duration to the words
-        #with open(st.session_state.interview_to_transcription_meta_words) as f:
-        word_data = st.session_state.interview_to_transcription_meta_words#json.load(f)
-        add_silence_duration(word_data)
-        
-        #Change the sentence capitalization
-        files = glob(f"{splitted_audio_txt_dir}/*.txt")
-        sentence_info_path_updated = output_file_path_sentence.replace('.txt', '_updated.txt')
 
-        new_sentences = construct_new_sentences(files, audio_basename, word_data, sentence_info_path_updated, output_file_path_sentence) 
-        numbered_txt_file = sentence_info_path_updated.replace('_updated.txt', '_updated_numbered.txt')
-        if not os.path.exists(numbered_txt_file):
-            for i, sent in enumerate(new_sentences):
-                add_sentences_to_file(f"{i}. {sent}", numbered_txt_file)
+        # Transcription, emphasis detection and sentence capitalization, shared with the batch CLI (zoom_pipeline.py)
+        sentences, word_data, new_sentences = transcribe_video(video_path,
+                                                               client_settings=st.session_state['asr_client_settings'])
+        st.session_state.interview_to_transcription_meta_sentence = sentences
+        st.session_state.interview_to_transcription_meta_words = word_data
 
 
         #ChatGPT predictions
@@ -258,32 +256,22 @@ def main():
 
         if st.button("Claude Predictions"):
             st.session_state.button_clicked = "claude_predictions"
-            predictor = ClaudeAdapter(model_name="claude-3-5-sonnet-20241022", 
-                                    api_key=os.getenv('ANTHROPIC_API_KEY'))
-
-            os.makedirs("claude_results", exist_ok=True)
-            st.session_state.sentences_splitted_by_duration = split_sentences_by_seconds(new_sentences, SPLIT_SENTENCE_BY_DURATION)
-            st.session_state.splitted_words = split_words_by_duration(word_data, [len(sen) for sen in st.session_state.sentences_splitted_by_duration])
-            splitted_sentences = [[f"{i}. {sentence}" for i, sentence in enumerate(sentences, start=1)] for sentences in st.session_state.sentences_splitted_by_duration]
-
-            # Construct the JSON file path
-            audio_file_name = st.session_state.audio_file.split('/')[-1].split('.')[0]
-            json_file_path = f"claude_results/{audio_file_name}.json"
-            if not os.path.exists(json_file_path):
-                st.session_state.predictions = predictor.get_predictions(splitted_sentences, num = len(splitted_sentences))
-                with open(json_file_path, "w") as f:
-                    json.dump(st.session_state.predictions, f)
-                st.success(f"Predictions saved to {json_file_path}")
-            else:
-                with open(json_file_path, "r") as f:
-                    st.session_state.predictions = json.load(f)                    
+            st.session_state.zoom_effects = None
+            json_file_path = work_paths(video_path)["predictions"]
+            existed = os.path.exists(json_file_path)
+            predictor = None if existed else ClaudeAdapter(model_name=CLAUDE_MODEL, api_key=os.getenv('ANTHROPIC_API_KEY'))
+            (st.session_state.predictions, st.session_state.sentences_splitted_by_duration,
+             st.session_state.splitted_words) = predict_zooms(video_path, new_sentences, word_data, predictor)
+            if existed:
                 st.info(f"Loaded existing predictions from {json_file_path}")
+            else:
+                st.success(f"Predictions saved to {json_file_path}")
             # st.session_state.predictions = predictions
 
         output_path = None
         if st.session_state.predictions:
 
-            [col1]= st.columns(1)
+            col1, col2 = st.columns(2)
 
             # with col1:
             #     if st.button("Fast Zoom In-Cut"):
@@ -291,6 +279,9 @@ def main():
             with col1:
                 if st.button("Fast Zoom In-Hold-Cut"):
                     st.session_state.button_clicked = "fast_zoom_hold_cut"
+            with col2:
+                if st.button("Fast Zoom In-Hold-Cut (Preview)"):
+                    st.session_state.button_clicked = "fast_zoom_hold_cut_preview"
             
         # Handle the action after the button click
         # if st.session_state.button_clicked == "fast_zoom_cut":
@@ -303,21 +294,73 @@ def main():
 
         #     except Exception as e:
         #         st.error(f"An error occurred during processing: {str(e)}")
-        if st.session_state.button_clicked == "fast_zoom_hold_cut":
-            st.write("Fast Zoom In-Hold-Cut clicked!")
+        if st.session_state.button_clicked in ("fast_zoom_hold_cut", "fast_zoom_hold_cut_preview"):
+            preview = st.session_state.button_clicked == "fast_zoom_hold_cut_preview"
+            st.write("Fast Zoom In-Hold-Cut (Preview) clicked!" if preview else "Fast Zoom In-Hold-Cut clicked!")
             try:
-                with st.spinner("Processing video..."):
-                    st.session_state.zoom_effects = get_zooms_claude(st.session_state.predictions, st.session_state.sentences_splitted_by_duration, st.session_state.splitted_words, slow=False, jumpcut=True, hold=True)
-                    st.session_state.output_path = process_video(video_path, st.session_state.zoom_effects)
+                with st.spinner("Rendering preview..." if preview else "Processing video..."):
+                    # Preview and final render share the same effects, so the preview shows exactly what will be rendered
+                    if st.session_state.zoom_effects is None:
+                        st.session_state.zoom_effects = get_zooms_claude(st.session_state.predictions, st.session_state.sentences_splitted_by_duration, st.session_state.splitted_words, slow=False, jumpcut=True, hold=True)
+                    render_dir = new_render_dir("preview" if preview else "final")
+                    if preview:
+                        # Fragmented MP4 the media server streams while it is written, so the preview plays right away
+                        profile, container = "proxy", "fmp4"
+                    else:
+                        profile, container = "final", "mp4"
+                    live_path = render_output_path(video_path, profile, container, str(render_dir)) if preview else None
+                    render_lock = DirectoryLock(render_dir)
+                    render_lock.acquire()
+                    try:
+                        output_path = process_video(video_path, st.session_state.zoom_effects, profile=profile,
+                                                    container=container, output_dir=str(render_dir),
+                                                    progress=streamlit_progress(live_path))
+                    except BaseException:
+                        shutil.rmtree(render_dir, ignore_errors=True)
+                        raise
+                    finally:
+                        if live_path:
+                            finish_growing(live_path)
+                        render_lock.release()
+                    st.session_state.output_path = output_path
+                    remove_earlier_renders(render_dir)
                     st.session_state.button_clicked = None
             except Exception as e:
                 st.error(f"An error occurred during processing: {str(e)}")
 
-        
+        # Review single zooms as short clips, without waiting for a full render
+        if st.session_state.predictions:
+            if st.session_state.zoom_effects is None:
+                st.session_state.zoom_effects = get_zooms_claude(st.session_state.predictions, st.session_state.sentences_splitted_by_duration, st.session_state.splitted_words, slow=False, jumpcut=True, hold=True)
+            if st.session_state.zoom_effects:
+                st.subheader("Review a Single Zoom")
+                clip_labels = [f"#{i + 1} at {int(effect.start_time//60)}m{int(effect.start_time%60)}s"
+                               for i, effect in enumerate(st.session_state.zoom_effects)]
+                clip_col1, clip_col2 = st.columns(2)
+                with clip_col1:
+                    clip_index = st.selectbox("Zoom to review:", options=list(range(len(clip_labels))),
+                                              format_func=lambda i: clip_labels[i])
+                with clip_col2:
+                    clip_padding = st.number_input("Seconds before and after the zoom", min_value=0.0,
+                                                   max_value=30.0, value=2.0, step=0.5)
+                if st.button("Render Zoom Clip"):
+                    try:
+                        with st.spinner("Rendering clip..."):
+                            st.session_state.clip_path = render_zoom_clip(video_path, st.session_state.zoom_effects,
+                                                                          clip_index, padding=clip_padding)
+                    except Exception as e:
+                        st.error(f"An error occurred during clip rendering: {str(e)}")
+                if st.session_state.get("clip_path"):
+                    show_video(st.session_state.clip_path)
+
         if st.session_state.zoom_effects:
             zoom_in_times = []
+            # Label -> exact start time; the render puts a keyframe there, so seeking to it is instant
+            zoom_start_seconds = {}
             for effect in st.session_state.zoom_effects:
-                zoom_in_times.append(f"{int(effect.start_time//60)}m{int(effect.start_time%60)}s")
+                label = f"{int(effect.start_time//60)}m{int(effect.start_time%60)}s"
+                zoom_in_times.append(label)
+                zoom_start_seconds.setdefault(label, effect.start_time)
         
         if st.session_state.output_path:
             # Your time selection logic
@@ -329,34 +372,11 @@ def main():
             # Convert selected time to seconds
             selected_seconds = None
             if selected_time != "Play as it is":
-                minutes, seconds = map(int, selected_time[:-1].split("m"))
-                selected_seconds = minutes * 60 + seconds
+                selected_seconds = zoom_start_seconds[selected_time]
+
+            # The player streams the file with range requests (see media_server), so the video is never
+            # loaded into memory or into the page
+            show_video(st.session_state.output_path, selected_seconds)
 
-            # Read video file as bytes
-            with open(st.session_state.output_path, 'rb') as video_file:
-                video_bytes = video_file.read()
-                
-            # Encode to base64
-            video_b64 = base64.b64encode(video_bytes).decode()
-            
-            # Create custom HTML component with seek functionality
-            html_code = f"""
-                <div style="width: 100%; height: 100%;">
-                    <video id="videoPlayer" width="100%" height="100%" controls>
-                        <source src="data:video/mp4;base64,{video_b64}" type="video/mp4">
-                        Your browser does not support the video tag.
-                    </video>
-                    <script>
-                        var video = document.getElementById('videoPlayer');
-                        video.addEventListener('loadedmetadata', function() {{
-                            {"video.currentTime = " + str(selected_seconds) + ";" if selected_seconds is not None else ""}
-                        }});
-                    </script>
-                </div>
-            """
-            
-            # Render the component
-            components.html(html_code, height=400)
-               
 if __name__ == "__main__":
     main()
@@ -0,0 +1,203 @@
+"""
+URLs for rendered videos, so players stream them with range requests instead of embedding them.
+
+The player loads the file by URL and the browser fetches only the byte ranges it plays or seeks to,
+so neither the Streamlit process nor the page holds the whole video. The media server of this module
+serves any file media_url() registered, of any size and with its video MIME type, HLS segments included.
+A file registered as growing (a fragmented MP4 still being rendered) is sent as one response that follows
+the writes until finish_growing(), so the browser plays it while it is written.
+
+It listens on ZOOM_MEDIA_HOST:ZOOM_MEDIA_PORT (default all interfaces, on a free port), and the browser
+reaches it under the host name it reached the app by. Behind HTTPS or a reverse proxy, set
+ZOOM_MEDIA_PUBLIC_URL to the URL under which the browser reaches the media server instead.
+
+Only when the server cannot start does media_url() return None; the caller then hands the file to
+Streamlit (st.video), which loads it whole into memory.
+"""
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Set, Tuple
+from urllib.parse import quote, unquote, urlsplit
+
+# Remote browsers reach the server on the app's host name, so it listens on every interface; the URL
+# tokens keep unregistered files out of reach
+MEDIA_HOST = os.environ.get("ZOOM_MEDIA_HOST", "0.0.0.0")
+MEDIA_PORT = int(os.environ.get("ZOOM_MEDIA_PORT", "0"))
+MEDIA_PUBLIC_URL = os.environ.get("ZOOM_MEDIA_PUBLIC_URL")
+CHUNK_BYTES = 256 * 1024
+GROWING_POLL_SECONDS = 0.2
+
+mimetypes.add_type("application/vnd.apple.mpegurl", ".m3u8")
+mimetypes.add_type("video/iso.segment", ".m4s")
+mimetypes.add_type("video/mp2t", ".ts")
+mimetypes.add_type("video/mp4", ".mp4")
+
+# URL token -> file path
+_files: Dict[str, str] = {}
+# Paths of files still being written
+_growing: Set[str] = set()
+_server: Optional[ThreadingHTTPServer] = None
+_lock = threading.Lock()
+# Mixed into the URL tokens, so knowing a file's path is not enough to fetch it
+_secret = os.urandom(16).hex()
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    First byte range of a Range header as (start, end), end inclusive; None for the whole file.
+
+    :raises ValueError: When the range lies outside the file
+    """
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", (header or "").split(",")[0].strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    else:
+        # "bytes=-n" is the last n bytes
+        start, end = max(0, size - int(last)), size - 1
+    if start >= size or start > end:
+        raise ValueError(f"Range {header} outside {size} bytes")
+    return start, end
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    def do_HEAD(self):
+        self.serve(send_body=False)
+
+    def do_GET(self):
+        self.serve(send_body=True)
+
+    def serve(self, send_body: bool):
+        # /<token>/<file name>, or /<token>/<segment name> for the segments next to an HLS playlist
+        parts = unquote(urlsplit(self.path).path).lstrip("/").split("/")
+        registered = _files.get(parts[0]) if len(parts) == 2 else None
+        path = None
+        if registered is not None and parts[1] == os.path.basename(registered):
+            path = registered
+        elif registered is not None and registered.endswith(".m3u8") and parts[1] not in ("", ".", ".."):
+            path = os.path.join(os.path.dirname(registered), parts[1])
+        if path is None or not os.path.isfile(path):
+            self.send_error(404)
+            return
+        if path in _growing:
+            self.serve_growing(path, send_body)
+            return
+        size = os.path.getsize(path)
+        try:
+            byte_range = parse_range(self.headers.get("Range"), size)
+        except ValueError:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.end_headers()
+            return
+        start, end = byte_range or (0, size - 1)
+
+        self.send_response(206 if byte_range else 200)
+        self.send_header("Content-Type", mimetypes.guess_type(path)[0] or "application/octet-stream")
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        if byte_range:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        # Players in the Streamlit component iframe load from another origin
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        if not send_body:
+            return
+        try:
+            with open(path, "rb") as f:
+                f.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    chunk = f.read(min(CHUNK_BYTES, remaining))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            # The browser drops requests whenever the user seeks
+            pass
+
+    def serve_growing(self, path: str, send_body: bool):
+        # The final size is unknown, so no Content-Length and no ranges: the body ends when the connection closes
+        self.send_response(200)
+        self.send_header("Content-Type", mimetypes.guess_type(path)[0] or "application/octet-stream")
+        self.send_header("Cache-Control", "no-store")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.close_connection = True
+        if not send_body:
+            return
+        try:
+            with open(path, "rb") as f:
+                while True:
+                    # Checked before reading, so whatever was written before finish_growing() is still sent
+                    finished = path not in _growing
+                    chunk = f.read(CHUNK_BYTES)
+                    if chunk:
+                        self.wfile.write(chunk)
+                    elif finished:
+                        return
+                    else:
+                        time.sleep(GROWING_POLL_SECONDS)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, format, *args):
+        logging.debug("Media server: " + format, *args)
+
+
+def start_server() -> ThreadingHTTPServer:
+    """Start the server on a daemon thread the first time it is needed; one server serves all sessions."""
+    global _server
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((MEDIA_HOST, MEDIA_PORT), MediaHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="media-server", daemon=True).start()
+            logging.info("Serving rendered media on http://%s:%d", *_server.server_address[:2])
+    return _server
+
+
+def file_token(path: str) -> str:
+    """
+    Unguessable token of the file at `path`. It changes whenever the file does, so browsers never
+    play a cached earlier render of the same name.
+    """
+    stat = os.stat(path)
+    return hashlib.sha256(f"{_secret}|{path}|{stat.st_size}|{stat.st_mtime_ns}".encode()).hexdigest()[:32]
+
+
+def media_url(path: str, host: str = "localhost", growing: bool = False) -> Optional[str]:
+    """
+    URL under which the browser streams the file at `path` from the media server: under ZOOM_MEDIA_PUBLIC_URL
+    when set, otherwise on `host`, the host name the browser reached the app by. None when the server could
+    not start.
+    :param growing: The file is still being written; it is streamed as it grows until finish_growing(path)
+    """
+    path = os.path.abspath(path)
+    try:
+        server = start_server()
+    except OSError as e:
+        logging.error("Media server could not listen on %s:%d: %s", MEDIA_HOST, MEDIA_PORT, e)
+        return None
+    token = file_token(path)
+    _files[token] = path
+    if growing:
+        _growing.add(path)
+    name = quote(os.path.basename(path))
+    if MEDIA_PUBLIC_URL:
+        return f"{MEDIA_PUBLIC_URL.rstrip('/')}/{token}/{name}"
+    return f"http://{host}:{server.server_address[1]}/{token}/{name}"
+
+
+def finish_growing(path: str):
+    """The file at `path` is complete; its growing streams end once they sent the rest of it."""
+    _growing.discard(os.path.abspath(path))
@@ -0,0 +1,269 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Sequence
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+from segments import Segment
+
+JOBS_DIR = Path("temp_output/jobs")
+# Job directories nothing was written to for this long belong to abandoned renders and are removed
+JOB_MAX_AGE_SECONDS = float(os.environ.get("ZOOM_JOB_MAX_AGE_HOURS", "24")) * 3600
+
+
+def job_key(*parts) -> str:
+    """Directory name of a render job: a hash of everything that determines its output."""
+    return hashlib.sha256("|".join(str(part) for part in parts).encode()).hexdigest()[:32]
+
+
+class DirectoryLock:
+    """
+    Exclusive lock on a directory, held through a lock file in it. Locks of processes that died are released
+    by the OS. A holder may remove the directory; whoever waited for the lock then recreates it.
+    """
+    def __init__(self, directory: Path):
+        self.path = directory / ".lock"
+        self.file = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        while True:
+            self.path.parent.mkdir(exist_ok=True, parents=True)
+            self.file = open(self.path, "a")
+            try:
+                lock_file(self.file, blocking)
+            except OSError:
+                self.file.close()
+                self.file = None
+                if not blocking:
+                    return False
+                continue
+            # The previous holder removed the directory while we waited: lock the new one instead
+            try:
+                if os.stat(self.path).st_ino == os.fstat(self.file.fileno()).st_ino:
+                    return True
+            except FileNotFoundError:
+                pass
+            self.release()
+
+    def release(self):
+        if self.file is not None:
+            # Closing the file releases the lock
+            self.file.close()
+            self.file = None
+
+
+def lock_file(f, blocking: bool):
+    """Exclusively lock the open file `f`; raises OSError when `blocking` is False and another process holds it."""
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return
+    while True:
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            return
+        except OSError:
+            if not blocking:
+                raise
+            time.sleep(0.1)
+
+
+def last_write_time(directory: Path) -> float:
+    """Latest modification time of `directory` and the files in it."""
+    times = [directory.stat().st_mtime]
+    for path in directory.rglob("*"):
+        try:
+            times.append(path.stat().st_mtime)
+        except FileNotFoundError:
+            pass
+    return max(times)
+
+
+def remove_stale_dirs(parent: Path, max_age_seconds: float):
+    """
+    Remove the subdirectories of `parent` nothing was written to for `max_age_seconds`, except those
+    locked by a running render (see DirectoryLock).
+    """
+    if not parent.is_dir():
+        return
+    now = time.time()
+    for directory in parent.iterdir():
+        try:
+            if not directory.is_dir() or now - last_write_time(directory) < max_age_seconds:
+                continue
+        except FileNotFoundError:
+            continue
+        lock = DirectoryLock(directory)
+        if lock.acquire(blocking=False):
+            logging.info("Removing %s, unused for %.0f hours", directory, (now - last_write_time(directory)) / 3600)
+            shutil.rmtree(directory, ignore_errors=True)
+            lock.release()
+
+
+class RenderManifest:
+    """
+    Durable record of the segments of one render job that are already on disk.
+
+    The job directory is named by job_key, so a restarted render with the same inputs finds the
+    segments of the previous attempt and only renders the rest. A segment counts as done once its
+    file was moved into place and its size recorded in manifest.json; partial files are ignored.
+
+    The manifest holds the lock of its job directory until it is released or removed (or its `with` block
+    ends), so a second render of the same job waits for the first instead of writing into its directory.
+    """
+    def __init__(self, job_dir: Path, segments: Sequence[Segment]):
+        self.job_dir = job_dir
+        self.segments = list(segments)
+        self.path = job_dir / "manifest.json"
+        self.done = {}
+        self.lock = DirectoryLock(job_dir)
+        if not self.lock.acquire(blocking=False):
+            logging.info("Waiting for another render of %s to finish", job_dir)
+            self.lock.acquire()
+        if self.path.exists():
+            self.load()
+
+    @classmethod
+    def for_job(cls, key: str, segments: Sequence[Segment], jobs_dir: Path = JOBS_DIR) -> "RenderManifest":
+        remove_stale_dirs(jobs_dir, JOB_MAX_AGE_SECONDS)
+        return cls(jobs_dir / key, segments)
+
+    def __enter__(self) -> "RenderManifest":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def plan(self) -> List[List]:
+        return [[segment.start_frame, segment.end_frame, segment.reencode] for segment in self.segments]
+
+    def load(self):
+        with open(self.path) as f:
+            data = json.load(f)
+        if data.get("segments") != self.plan():
+            logging.warning("Segment plan in %s changed, rendering every segment again", self.path)
+            return
+        self.done = {int(index): size for index, size in data.get("done", {}).items()}
+
+    def save(self):
+        with tempfile.NamedTemporaryFile("w", dir=self.job_dir, prefix="manifest.", suffix=".tmp",
+                                         delete=False) as f:
+            json.dump({"segments": self.plan(), "done": self.done}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f.name, self.path)
+
+    def segment_path(self, index: int, suffix: str = ".ts") -> str:
+        return str(self.job_dir / f"{index:05d}{suffix}")
+
+    def partial_path(self, index: int) -> str:
+        return self.segment_path(index, ".partial.ts")
+
+    def is_done(self, index: int) -> bool:
+        path = self.segment_path(index)
+        return index in self.done and os.path.exists(path) and os.path.getsize(path) == self.done[index]
+
+    def pending(self) -> List[int]:
+        return [index for index in range(len(self.segments)) if not self.is_done(index)]
+
+    def mark_done(self, index: int, partial_path: str = None):
+        """Move the finished partial file of a segment (default: partial_path(index)) into place and record it."""
+        path = self.segment_path(index)
+        os.replace(partial_path or self.partial_path(index), path)
+        self.done[index] = os.path.getsize(path)
+        self.save()
+
+    def segment_paths(self) -> List[str]:
+        return [self.segment_path(index) for index in range(len(self.segments))]
+
+    def release(self):
+        self.lock.release()
+
+    def remove(self):
+        """Remove the job directory of a finished render, then let the next render of the job start."""
+        shutil.rmtree(self.job_dir, ignore_errors=True)
+        self.release()
+
+
+def segment_key(video_hash: str, segment: Segment, timeline, *settings) -> str:
+    """
+    Cache key of one segment: stream-copied segments depend only on the source, re-encoded ones also on
+    the timeline over their frames and on the render `settings`.
+    """
+    if not segment.reencode:
+        return job_key("copy", video_hash, segment.start_frame, segment.end_frame)
+    return job_key("encode", video_hash, segment.start_frame, segment.end_frame,
+                   timeline.signature(segment.start_frame, segment.end_frame), *settings)
+
+
+SEGMENT_CACHE_DIR = Path("temp_output/segment_cache")
+SEGMENT_CACHE_MAX_BYTES = int(os.environ.get("ZOOM_SEGMENT_CACHE_MB", "4096")) * 1024 * 1024
+
+
+class SegmentCache:
+    """
+    Segment files of earlier renders, keyed by everything that determines their content (see segment_key),
+    so re-rendering an edited timeline only encodes the segments whose zooms changed.
+
+    Files are hard-linked in and out of job directories where the filesystem allows it; the least
+    recently used ones are dropped once the cache grows beyond `max_bytes`.
+    """
+    def __init__(self, cache_dir: Path = SEGMENT_CACHE_DIR, max_bytes: int = SEGMENT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        cache_dir.mkdir(exist_ok=True, parents=True)
+
+    def path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.ts"
+
+    def fetch(self, key: str, output_path: str) -> bool:
+        """Place the cached segment of `key` at `output_path`; False when it is not cached."""
+        path = self.path(key)
+        if not path.exists():
+            return False
+        link_or_copy(path, output_path)
+        os.utime(path)
+        self.hits += 1
+        return True
+
+    def store(self, key: str, segment_path: str):
+        # A temp file of its own, so renders caching the same segment at once never write into each other's
+        descriptor, temp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=f"{key}.", suffix=".tmp")
+        os.close(descriptor)
+        try:
+            link_or_copy(segment_path, temp_path)
+            os.replace(temp_path, self.path(key))
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self.prune()
+
+    def prune(self):
+        files = sorted(self.cache_dir.glob("*.ts"), key=lambda path: path.stat().st_mtime)
+        total = sum(path.stat().st_size for path in files)
+        for path in files:
+            if total <= self.max_bytes:
+                break
+            total -= path.stat().st_size
+            path.unlink()
+
+
+def link_or_copy(source, destination):
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
@@ -0,0 +1,121 @@
+"""
+Per-stage timing of renders.
+
+Each stage (decode, face detection, zoom, encode, mux, queue waits, ...) records the duration of every call.
+The summary holds the cumulative time, call count, calls per second and latency percentiles of each stage.
+Recording costs two perf_counter() calls and a short lock, so profiling stays on in production.
+"""
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+import numpy as np
+
+# Latencies kept per stage for the percentiles: a uniform sample of all calls, so memory does not grow with the video
+LATENCY_SAMPLES = 4096
+
+
+class StageStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.latencies = []
+        self.lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self.lock:
+            self.calls += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+            if len(self.latencies) < LATENCY_SAMPLES:
+                self.latencies.append(seconds)
+            else:
+                # Reservoir sampling: every call ends up in the sample with the same probability
+                index = random.randrange(self.calls)
+                if index < LATENCY_SAMPLES:
+                    self.latencies[index] = seconds
+
+    def as_dict(self) -> Dict[str, float]:
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            calls, total, longest = self.calls, self.total, self.max
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99]).tolist() if calls else (0.0, 0.0, 0.0)
+        return {
+            "calls": calls,
+            "total_s": round(total, 4),
+            "per_second": round(calls / total, 2) if total else None,
+            "mean_ms": round(total * 1000 / calls, 3) if calls else 0.0,
+            "p50_ms": round(p50, 3),
+            "p90_ms": round(p90, 3),
+            "p99_ms": round(p99, 3),
+            "max_ms": round(longest * 1000, 3),
+        }
+
+
+class RenderProfiler:
+    """
+    Stage timings and counters of one render; safe to record from the pipeline threads.
+    The wall time of the summary runs from the creation of the profiler.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, StageStats] = {}
+        self.counters: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def stage(self, name: str) -> StageStats:
+        stage = self.stages.get(name)
+        if stage is None:
+            with self.lock:
+                stage = self.stages.setdefault(name, StageStats(name))
+        return stage
+
+    def record(self, name: str, seconds: float):
+        self.stage(name).record(seconds)
+
+    @contextmanager
+    def measure(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage(name).record(time.perf_counter() - start)
+
+    def timed(self, name: str, function: Callable) -> Callable:
+        """`function` with every call recorded as stage `name`."""
+        stage = self.stage(name)
+
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stage.record(time.perf_counter() - start)
+        return wrapper
+
+    def count(self, name: str, value: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self) -> Dict:
+        wall_time = time.perf_counter() - self.started
+        summary = {
+            "wall_s": round(wall_time, 4),
+            "counters": dict(self.counters),
+            "stages": {name: stage.as_dict() for name, stage in list(self.stages.items())},
+        }
+        if "frames" in self.counters and wall_time:
+            summary["frames_per_second"] = round(self.counters["frames"] / wall_time, 2)
+        return summary
+
+    def report(self, label: str) -> Dict:
+        """Log the summary as one JSON line and return it."""
+        summary = self.summary()
+        logging.info("Render profile of %s: %s", label, json.dumps(summary))
+        return summary
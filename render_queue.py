@@ -0,0 +1,231 @@
+"""
+Work queue for distributed rendering.
+
+A coordinator (zoom_effect.distributed_render) splits a render into frame-range tasks and publishes
+them to a broker. Workers on any node claim tasks, render them into the shared job directory and
+report back; the coordinator concatenates the segments and muxes the audio. Start a worker with
+
+    python render_queue.py --broker sqlite:///shared/render_queue.db
+
+Brokers are pluggable: subclass Broker and register a URL scheme in BROKERS. SQLiteBroker serves
+tests and single-node use (SQLite locking is not reliable on network filesystems).
+"""
+import abc
+import argparse
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+# A claimed task whose worker sent no heartbeat for this long is handed to another worker
+LEASE_SECONDS = 60
+MAX_ATTEMPTS = 3
+
+
+class Broker(abc.ABC):
+    """
+    Queue of render tasks. A task is a JSON-serializable dict with "id" and "job_id"; its status moves
+    queued -> claimed -> done, or back to queued when its lease expires, or to failed after MAX_ATTEMPTS.
+    """
+    # Seconds a claimed task stays with its worker without a heartbeat; workers send one every third of it
+    lease_seconds: float = LEASE_SECONDS
+
+    @abc.abstractmethod
+    def publish(self, job_id: str, tasks: List[Dict]):
+        ...
+
+    @abc.abstractmethod
+    def claim(self, worker_id: str) -> Optional[Dict]:
+        """Atomically take the oldest queued (or expired) task, or None when there is none."""
+
+    @abc.abstractmethod
+    def heartbeat(self, task_id: str, worker_id: str):
+        ...
+
+    @abc.abstractmethod
+    def complete(self, task_id: str, worker_id: str):
+        ...
+
+    @abc.abstractmethod
+    def fail(self, task_id: str, worker_id: str, error: str):
+        ...
+
+    @abc.abstractmethod
+    def statuses(self, job_id: str) -> Dict[str, str]:
+        """Task id -> status of every task of a job."""
+
+    @abc.abstractmethod
+    def errors(self, job_id: str) -> Dict[str, str]:
+        ...
+
+    @abc.abstractmethod
+    def remove(self, job_id: str):
+        """Drop the tasks of a job; claimed ones stay until their workers report back."""
+
+
+class SQLiteBroker(Broker):
+    def __init__(self, path: str, lease_seconds: float = LEASE_SECONDS, max_attempts: int = MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.connect() as db:
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    id TEXT PRIMARY KEY,
+                    job_id TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    worker TEXT,
+                    heartbeat REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    created REAL NOT NULL
+                )""")
+            db.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, created)")
+
+    def connect(self) -> sqlite3.Connection:
+        # isolation_level=None: transactions are opened explicitly with BEGIN IMMEDIATE
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def publish(self, job_id: str, tasks: List[Dict]):
+        now = time.time()
+        with self.connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.executemany("INSERT OR IGNORE INTO tasks (id, job_id, payload, status, created) VALUES (?, ?, ?, 'queued', ?)",
+                           [(task["id"], job_id, json.dumps(task), now + i * 1e-6) for i, task in enumerate(tasks)])
+            db.execute("COMMIT")
+
+    def claim(self, worker_id: str) -> Optional[Dict]:
+        now = time.time()
+        db = self.connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            # Workers that died keep their tasks until the lease runs out
+            db.execute("UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, "
+                       "error = COALESCE(error, 'lease expired') WHERE status = 'claimed' AND heartbeat < ?",
+                       (self.max_attempts, now - self.lease_seconds))
+            row = db.execute("SELECT id, payload FROM tasks WHERE status = 'queued' ORDER BY created LIMIT 1").fetchone()
+            if row is not None:
+                db.execute("UPDATE tasks SET status = 'claimed', worker = ?, heartbeat = ?, attempts = attempts + 1 "
+                           "WHERE id = ?", (worker_id, now, row[0]))
+            db.execute("COMMIT")
+        finally:
+            db.close()
+        return json.loads(row[1]) if row is not None else None
+
+    def heartbeat(self, task_id: str, worker_id: str):
+        with self.connect() as db:
+            db.execute("UPDATE tasks SET heartbeat = ? WHERE id = ? AND worker = ? AND status = 'claimed'",
+                       (time.time(), task_id, worker_id))
+
+    def complete(self, task_id: str, worker_id: str):
+        with self.connect() as db:
+            db.execute("UPDATE tasks SET status = 'done' WHERE id = ? AND worker = ?", (task_id, worker_id))
+
+    def fail(self, task_id: str, worker_id: str, error: str):
+        with self.connect() as db:
+            db.execute("UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, error = ? "
+                       "WHERE id = ? AND worker = ?", (self.max_attempts, error, task_id, worker_id))
+
+    def statuses(self, job_id: str) -> Dict[str, str]:
+        with self.connect() as db:
+            return dict(db.execute("SELECT id, status FROM tasks WHERE job_id = ?", (job_id,)).fetchall())
+
+    def errors(self, job_id: str) -> Dict[str, str]:
+        with self.connect() as db:
+            return dict(db.execute("SELECT id, error FROM tasks WHERE job_id = ? AND error IS NOT NULL",
+                                   (job_id,)).fetchall())
+
+    def remove(self, job_id: str):
+        with self.connect() as db:
+            db.execute("DELETE FROM tasks WHERE job_id = ? AND status != 'claimed'", (job_id,))
+
+
+# URL scheme -> broker factory taking the rest of the URL
+BROKERS = {
+    "sqlite": lambda location: SQLiteBroker(location),
+}
+
+
+def get_broker(url: str) -> Broker:
+    """Broker for a URL such as sqlite:///shared/render_queue.db (absolute) or sqlite://render_queue.db (relative)."""
+    scheme, _, location = url.partition("://")
+    if scheme not in BROKERS:
+        raise ValueError(f"Unknown broker {url}, expected one of {list(BROKERS)}")
+    return BROKERS[scheme](location)
+
+
+def run_task(task: Dict):
+    """Render one frame-range task into its partial segment file."""
+    # Imported here: zoom_effect imports this module for the coordinator side
+    from segments import Segment
+    from zoom_effect import render_chunk
+    from zoom_timeline import ZoomTimeline
+
+    timeline = ZoomTimeline.load(task["timeline_path"])
+    segment = Segment(task["start_frame"], task["end_frame"], reencode=True)
+    render_chunk(task["video_path"], segment, timeline, task["output_path"], timeline.fps,
+                 (timeline.width, timeline.height), task["encoder_threads"], task["backend"], task["quality"],
+                 task["decoder"])
+
+
+def run_worker(broker: Broker, worker_id: Optional[str] = None, poll_seconds: float = 1.0,
+               exit_when_idle: bool = False, max_tasks: Optional[int] = None) -> int:
+    """
+    Claim and render tasks until stopped (or, with `exit_when_idle`, until the queue is empty).
+
+    :return: int: Number of tasks rendered
+    """
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    rendered = 0
+    while max_tasks is None or rendered < max_tasks:
+        task = broker.claim(worker_id)
+        if task is None:
+            if exit_when_idle:
+                break
+            time.sleep(poll_seconds)
+            continue
+
+        logging.info("Worker %s rendering task %s (frames %d-%d)", worker_id, task["id"], task["start_frame"],
+                     task["end_frame"])
+        stop = threading.Event()
+
+        def keep_alive():
+            while not stop.wait(broker.lease_seconds / 3):
+                broker.heartbeat(task["id"], worker_id)
+
+        heartbeat = threading.Thread(target=keep_alive, daemon=True)
+        heartbeat.start()
+        try:
+            run_task(task)
+        except Exception as e:
+            logging.exception("Task %s failed", task["id"])
+            broker.fail(task["id"], worker_id, repr(e))
+        else:
+            broker.complete(task["id"], worker_id)
+            rendered += 1
+        finally:
+            stop.set()
+            heartbeat.join()
+    return rendered
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render worker for distributed zoom rendering")
+    parser.add_argument("--broker", default=os.environ.get("ZOOM_BROKER_URL", "sqlite://temp_output/render_queue.db"))
+    parser.add_argument("--exit-when-idle", action="store_true")
+    parser.add_argument("--poll-seconds", type=float, default=1.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    run_worker(get_broker(args.broker), poll_seconds=args.poll_seconds, exit_when_idle=args.exit_when_idle)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import json
+import logging
+import os
+import subprocess
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from ffmpeg_io import audio_codec_args, probe_start_offset
+
+# ffprobe names of the h264 profiles libx264 can encode -> its -profile:v values
+H264_PROFILES = {
+    "Constrained Baseline": "baseline",
+    "Baseline": "baseline",
+    "Main": "main",
+    "High": "high",
+    "High 4:2:2": "high422",
+    "High 4:4:4 Predictive": "high444",
+}
+# 8-bit pixel formats the frame pipeline's BGR frames can be encoded to; yuvj* are the full range ones
+SPLICE_PIX_FMTS = {"yuv420p", "yuvj420p", "yuv422p", "yuvj422p", "yuv444p", "yuvj444p"}
+# ffprobe stream field -> ffmpeg output option of the color tags
+COLOR_OPTIONS = {
+    "color_range": "-color_range",
+    "color_space": "-colorspace",
+    "color_primaries": "-color_primaries",
+    "color_transfer": "-color_trc",
+}
+
+
+class Segment:
+    """Frame range [start_frame, end_frame) of the output that is either re-encoded or stream-copied."""
+    def __init__(self, start_frame: int, end_frame: int, reencode: bool):
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        self.reencode = reencode
+
+    @property
+    def num_frames(self) -> int:
+        return self.end_frame - self.start_frame
+
+    def __repr__(self):
+        return f"Segment({self.start_frame}, {self.end_frame}, reencode={self.reencode})"
+
+
+def run_ffmpeg(command: List[str], error_message: str) -> subprocess.CompletedProcess:
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        logging.error("%s: %s", error_message, result.stderr.decode(errors="replace"))
+        raise RuntimeError(error_message)
+    return result
+
+
+def probe_video_stream(video_path: str) -> Dict[str, str]:
+    """Codec, profile, level, pixel format, scan order, pixel aspect ratio and color tags of the first video stream."""
+    command = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries',
+               'stream=codec_name,profile,level,pix_fmt,field_order,sample_aspect_ratio,' + ','.join(COLOR_OPTIONS), '-of', 'json',
+               video_path]
+    streams = json.loads(run_ffmpeg(command, "Failed to probe video stream").stdout.decode()).get("streams")
+    return streams[0] if streams else {}
+
+
+def splice_encode_args(stream: Dict[str, str]) -> Optional[List[str]]:
+    """
+    libx264 arguments that make re-encoded segments match the stream-copied segments of `stream` (see
+    probe_video_stream): same profile, level, pixel format and color tags. Players, browsers especially,
+    stop or show wrong colors when these change in the middle of a file.
+
+    :return: list: Encoder arguments, or None when the frame pipeline cannot produce a matching stream
+    """
+    profile = H264_PROFILES.get(stream.get("profile"))
+    pix_fmt = stream.get("pix_fmt")
+    if stream.get("codec_name") != "h264" or profile is None or pix_fmt not in SPLICE_PIX_FMTS:
+        return None
+    if stream.get("field_order", "progressive") not in ("progressive", "unknown"):
+        return None
+    # Full range needs the yuvj formats, which make the BGR -> YUV conversion full range as well
+    if stream.get("color_range") == "pc" and not pix_fmt.startswith("yuvj"):
+        return None
+
+    args = ['-profile:v', profile, '-pix_fmt', pix_fmt]
+    level = int(stream.get("level") or -99)
+    if level > 0:
+        # level_idc is ten times the level; 9 is level 1b
+        args += ['-level:v', "1b" if level == 9 else f"{level // 10}.{level % 10}"]
+    for field, option in COLOR_OPTIONS.items():
+        if stream.get(field) not in (None, "", "unknown"):
+            args += [option, stream[field]]
+    return args
+
+
+def probe_keyframes(video_path: str, fps: float) -> List[int]:
+    """Frame numbers of the video keyframes, read from the packet flags without decoding."""
+    command = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'packet=pts_time,flags',
+               '-of', 'csv=p=0', video_path]
+    lines = run_ffmpeg(command, "Failed to probe keyframes").stdout.decode().splitlines()
+
+    packets = []
+    for line in lines:
+        pts_time, _, flags = line.partition(',')
+        if pts_time and pts_time != 'N/A':
+            packets.append((float(pts_time), 'K' in flags))
+    if not packets:
+        return [0]
+    first_pts = min(pts for pts, _ in packets)
+    return sorted({int(round((pts - first_pts) * fps)) for pts, is_key in packets if is_key} | {0})
+
+
+def zoom_frame_ranges(zoom_scales: Sequence[float]) -> List[Tuple[int, int]]:
+    """Contiguous [start, end) frame ranges where the zoom scale differs from 1.0."""
+    zoomed = np.concatenate(([False], np.asarray(zoom_scales) != 1.0, [False]))
+    edges = np.flatnonzero(np.diff(zoomed.astype(np.int8)))
+    return [(int(start), int(end)) for start, end in zip(edges[::2], edges[1::2])]
+
+
+def plan_segments(zoom_ranges: List[Tuple[int, int]], keyframes: List[int], total_frames: int) -> List[Segment]:
+    """
+    Widen every zoom range out to the surrounding keyframes and cover the rest of the timeline
+    with stream-copy segments, so every segment starts on a keyframe.
+    """
+    keyframes = np.asarray(sorted(k for k in keyframes if k < total_frames) or [0])
+    reencode_ranges = []
+    for start, end in sorted(zoom_ranges):
+        gop_start = int(keyframes[np.searchsorted(keyframes, start, side='right') - 1])
+        next_keys = keyframes[keyframes >= end]
+        gop_end = int(next_keys[0]) if len(next_keys) else total_frames
+        if reencode_ranges and gop_start <= reencode_ranges[-1][1]:
+            reencode_ranges[-1] = (reencode_ranges[-1][0], max(reencode_ranges[-1][1], gop_end))
+        else:
+            reencode_ranges.append((gop_start, gop_end))
+
+    segments = []
+    position = 0
+    for start, end in reencode_ranges:
+        if start > position:
+            segments.append(Segment(position, start, reencode=False))
+        segments.append(Segment(start, end, reencode=True))
+        position = end
+    if position < total_frames:
+        segments.append(Segment(position, total_frames, reencode=False))
+    return segments
+
+
+def copy_segment(video_path: str, segment: Segment, fps: float, output_path: str, start_offset: float = None):
+    """
+    Stream-copy the packets of a keyframe-aligned segment into an MPEG-TS file.
+    :param start_offset: probe_start_offset of the video, probed when not given
+    """
+    if start_offset is None:
+        start_offset = probe_start_offset(video_path)
+    # Frame numbers count from the first frame, seek times from the container start; half a frame past the
+    # keyframe, rounding never lands on the previous GOP
+    start_time = start_offset + (segment.start_frame + 0.5) / fps
+    command = [
+        'ffmpeg', '-y', '-ss', f'{start_time:.6f}', '-i', video_path, '-map', '0:v:0', '-c', 'copy',
+        '-frames:v', str(segment.num_frames), '-bsf:v', 'h264_mp4toannexb', '-avoid_negative_ts', 'make_zero',
+        '-f', 'mpegts', output_path
+    ]
+    run_ffmpeg(command, f"Failed to copy segment {segment}")
+
+
+def concat_segments(segment_paths: List[str], output_path: str, audio_source: Optional[str] = None):
+    """Losslessly join MPEG-TS segments and add the audio of `audio_source` (copied when MP4 can hold it)."""
+    list_path = output_path + '.segments.txt'
+    with open(list_path, 'w') as f:
+        for path in segment_paths:
+            f.write(f"file '{os.path.abspath(path)}'\n")
+
+    command = ['ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', list_path]
+    if audio_source is not None:
+        command += ['-i', audio_source, '-map', '0:v:0', '-map', '1:a:0?', '-shortest']
+    command += ['-c', 'copy']
+    if audio_source is not None:
+        command += audio_codec_args(audio_source)
+    command += ['-movflags', '+faststart', output_path]
+    try:
+        run_ffmpeg(command, "Failed to concatenate segments")
+    finally:
+        os.remove(list_path)
@@ -0,0 +1,12 @@
+import os
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "benchmarks"))
+
+# The tests never run the real face detector; the stub also stands in when its package is not installed
+import stub_detector  # noqa: E402
+
+stub_detector.install()
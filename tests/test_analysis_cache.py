@@ -0,0 +1,15 @@
+import analysis_cache
+from analysis_cache import detector_version
+
+
+def test_detector_version_follows_the_weights(tmp_path, monkeypatch):
+    weights = tmp_path / "detector.onnx"
+    weights.write_bytes(b"weights v1")
+    monkeypatch.setattr(analysis_cache, "DETECTOR_WEIGHTS", str(weights))
+    detector_version.cache_clear()
+    first = detector_version()
+
+    weights.write_bytes(b"weights v2")
+    detector_version.cache_clear()
+    assert detector_version() != first
+    detector_version.cache_clear()
@@ -0,0 +1,54 @@
+"""
+The ffmpeg backend against the frame pipeline: the zoom filter must produce the frames apply_zoom does,
+face-following centers included. Frames are compared before encoding, so encoder noise does not hide
+(or stand in for) differences in the zoom itself.
+"""
+import shutil
+import subprocess
+
+import cv2
+import numpy as np
+import pytest
+
+from ffmpeg_render import MIN_FRAME_PSNR, build_zoom_filter
+from run_benchmarks import make_synthetic_video
+from zoom_effect import ZoomEffect, apply_zoom
+from zoom_timeline import ZoomTimeline
+
+pytestmark = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="needs ffmpeg")
+
+WIDTH, HEIGHT, FPS, DURATION = 320, 180, 30, 6
+
+
+def render_filter(video_path: str, timeline: ZoomTimeline, filter_path: str) -> np.ndarray:
+    with open(filter_path, "w") as f:
+        f.write(build_zoom_filter(timeline, pix_fmt="bgr24"))
+    result = subprocess.run(['ffmpeg', '-loglevel', 'error', '-i', video_path, '-filter_script:v', filter_path,
+                             '-vsync', 'passthrough', '-f', 'rawvideo', '-'], stdout=subprocess.PIPE, check=True)
+    return np.frombuffer(result.stdout, dtype=np.uint8).reshape(-1, HEIGHT, WIDTH, 3)
+
+
+@pytest.mark.parametrize("follow_face", [False, True])
+def test_zoom_filter_matches_frame_pipeline(tmp_path, follow_face):
+    video_path = str(tmp_path / "synthetic.mp4")
+    make_synthetic_video(video_path, WIDTH, HEIGHT, DURATION)
+    effects = [ZoomEffect(0.5, 2.5, 1, 1.3, 0.5), ZoomEffect(3.0, 5.5, 0.7, 1.45, 0)]
+    timeline = ZoomTimeline(effects, FPS, FPS * DURATION, WIDTH, HEIGHT, easing="ease_in_out")
+    if follow_face:
+        # Sparse detections of a face moving diagonally, as analyze_zoom_windows returns them
+        timeline.follow_faces({frame: (100 + frame * 0.7, 30 + frame * 0.3, 50, 45) for frame in range(0, 180, 7)})
+    frames = render_filter(video_path, timeline, str(tmp_path / "filter.txt"))
+
+    cap = cv2.VideoCapture(video_path)
+    psnrs = []
+    for frame_num, rendered in enumerate(frames):
+        ret, frame = cap.read()
+        assert ret
+        expected = apply_zoom(frame, timeline.scales[frame_num], timeline.center_x[frame_num],
+                              timeline.center_y[frame_num], backend="roi")
+        psnrs.append(min(cv2.PSNR(expected, rendered), 100.0))
+    cap.release()
+
+    assert len(frames) == timeline.total_frames
+    assert timeline.zoomed_frames() > 0
+    assert min(psnrs) >= MIN_FRAME_PSNR, f"worst frame {int(np.argmin(psnrs))}: {min(psnrs):.1f} dB"
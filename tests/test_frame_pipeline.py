@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from frame_pipeline import FramePool, read_into_pool
+
+
+class AllocatingCapture:
+    """Capture that ignores the buffer it is given and returns a new array, as cv2 may do."""
+    def __init__(self, frames):
+        self.frames = list(frames)
+
+    def isOpened(self):
+        return bool(self.frames)
+
+    def read(self, image=None):
+        if not self.frames:
+            return False, None
+        return True, self.frames.pop(0).copy()
+
+
+def test_read_into_pool_copies_frames_the_decoder_allocated():
+    frames = [np.full((4, 6, 3), value, dtype=np.uint8) for value in (10, 20, 30)]
+    pool = FramePool(2, (4, 6, 3))
+    for frame_num, slot in read_into_pool(AllocatingCapture(frames), pool):
+        assert np.array_equal(pool.frames[slot], frames[frame_num])
+        pool.release(slot)
+
+
+def test_read_into_pool_rejects_frames_that_do_not_fit():
+    pool = FramePool(2, (4, 6, 3))
+    with pytest.raises(ValueError):
+        list(read_into_pool(AllocatingCapture([np.zeros((8, 6, 3), dtype=np.uint8)]), pool))
+    assert pool.free.qsize() == 2
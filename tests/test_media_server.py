@@ -0,0 +1,58 @@
+import threading
+import time
+import urllib.request
+
+from media_server import finish_growing, media_url
+
+
+def fetch(url, headers=None):
+    with urllib.request.urlopen(urllib.request.Request(url, headers=headers or {})) as response:
+        return response.status, response.headers, response.read()
+
+
+def test_media_is_served_with_ranges_and_video_types(tmp_path):
+    video = tmp_path / "output.mp4"
+    video.write_bytes(bytes(range(256)) * 4)
+    url = media_url(str(video), "127.0.0.1")
+    assert url.startswith("http://127.0.0.1:")
+
+    status, headers, body = fetch(url, {"Range": "bytes=10-19"})
+    assert status == 206
+    assert headers["Content-Type"] == "video/mp4"
+    assert headers["Content-Range"] == "bytes 10-19/1024"
+    assert body == bytes(range(10, 20))
+
+
+def test_hls_segments_are_served_next_to_their_playlist(tmp_path):
+    (tmp_path / "index.m3u8").write_text("#EXTM3U\n")
+    (tmp_path / "segment_00000.m4s").write_bytes(b"segment")
+    url = media_url(str(tmp_path / "index.m3u8"), "127.0.0.1")
+
+    status, headers, _ = fetch(url)
+    assert status == 200
+    assert headers["Content-Type"] == "application/vnd.apple.mpegurl"
+    status, headers, body = fetch(url.replace("index.m3u8", "segment_00000.m4s"))
+    assert (headers["Content-Type"], body) == ("video/iso.segment", b"segment")
+
+
+def test_growing_file_is_streamed_until_finished(tmp_path):
+    video = tmp_path / "proxy.mp4"
+    video.write_bytes(b"head")
+    url = media_url(str(video), "127.0.0.1", growing=True)
+
+    def write_rest():
+        time.sleep(0.5)
+        with open(video, "ab") as f:
+            f.write(b"tail")
+        finish_growing(str(video))
+    writer = threading.Thread(target=write_rest)
+    writer.start()
+    status, headers, body = fetch(url)
+    writer.join()
+    assert status == 200
+    assert "Content-Length" not in headers
+    assert body == b"headtail"
+
+    # Once finished, the file is served with ranges again
+    status, _, body = fetch(media_url(str(video), "127.0.0.1"), {"Range": "bytes=4-"})
+    assert (status, body) == (206, b"tail")
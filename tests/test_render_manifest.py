@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+
+from render_manifest import DirectoryLock, RenderManifest, SegmentCache, remove_stale_dirs
+from segments import Segment
+
+SEGMENTS = [Segment(0, 10, True), Segment(10, 20, False)]
+
+
+def test_second_render_of_a_job_waits_for_the_first(tmp_path):
+    first = RenderManifest.for_job("job", SEGMENTS, tmp_path)
+    events = []
+
+    def second_render():
+        with RenderManifest.for_job("job", SEGMENTS, tmp_path) as manifest:
+            events.append("second started")
+            events.append(manifest.pending())
+
+    thread = threading.Thread(target=second_render)
+    thread.start()
+    time.sleep(0.2)
+    assert events == []
+
+    with open(first.partial_path(0), "w") as f:
+        f.write("segment")
+    first.mark_done(0)
+    events.append("first removed")
+    first.remove()
+    thread.join(timeout=5)
+    # The second render started after the first removed its directory, in a fresh one
+    assert events == ["first removed", "second started", [0, 1]]
+
+
+def test_manifest_leaves_no_temp_files(tmp_path):
+    with RenderManifest.for_job("job", SEGMENTS, tmp_path) as manifest:
+        for i in range(len(SEGMENTS)):
+            with open(manifest.partial_path(i), "w") as f:
+                f.write("segment")
+            manifest.mark_done(i)
+        assert sorted(os.listdir(manifest.job_dir)) == [".lock", "00000.ts", "00001.ts", "manifest.json"]
+    with RenderManifest.for_job("job", SEGMENTS, tmp_path) as manifest:
+        assert manifest.pending() == []
+
+
+def test_stale_dirs_are_removed_unless_locked(tmp_path):
+    for name in ("stale", "locked", "fresh"):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "00000.ts").write_text("segment")
+    day_ago = time.time() - 24 * 3600
+    for name in ("stale", "locked"):
+        for path in (tmp_path / name / "00000.ts", tmp_path / name):
+            os.utime(path, (day_ago, day_ago))
+    lock = DirectoryLock(tmp_path / "locked")
+    assert lock.acquire()
+    for path in (lock.path, tmp_path / "locked"):
+        os.utime(path, (day_ago, day_ago))
+
+    remove_stale_dirs(tmp_path, 3600)
+    lock.release()
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["fresh", "locked"]
+
+
+def test_concurrent_stores_of_a_segment_do_not_collide(tmp_path):
+    cache = SegmentCache(tmp_path / "cache")
+    sources = []
+    for i in range(8):
+        source = tmp_path / f"segment{i}.ts"
+        source.write_bytes(b"segment" * 1000)
+        sources.append(str(source))
+    errors = []
+
+    def store(source):
+        try:
+            cache.store("key", source)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=store, args=(source,)) for source in sources]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert sorted(path.name for path in (tmp_path / "cache").iterdir()) == ["key.ts"]
+    assert cache.fetch("key", str(tmp_path / "fetched.ts"))
+    assert (tmp_path / "fetched.ts").read_bytes() == b"segment" * 1000
@@ -0,0 +1,144 @@
+import threading
+
+import pytest
+
+import render_queue
+import zoom_effect
+from render_queue import Broker, SQLiteBroker, run_worker
+from zoom_timeline import ZoomTimeline
+
+LEASE_SECONDS = 60
+
+
+class Clock:
+    """Stands in for the time module of render_queue, so leases expire without waiting."""
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(render_queue, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def broker(tmp_path, clock):
+    return SQLiteBroker(str(tmp_path / "queue.db"), lease_seconds=LEASE_SECONDS, max_attempts=2)
+
+
+def tasks(job_id, count):
+    return [{"id": f"{job_id}-{i}", "job_id": job_id, "index": i, "start_frame": i * 30, "end_frame": (i + 1) * 30}
+            for i in range(count)]
+
+
+def test_broker_is_abstract():
+    with pytest.raises(TypeError):
+        Broker()
+
+
+def test_claim_hands_out_each_task_once_in_publish_order(broker):
+    broker.publish("job", tasks("job", 3))
+    claimed = [broker.claim("worker-a")["id"], broker.claim("worker-b")["id"], broker.claim("worker-a")["id"]]
+    assert claimed == ["job-0", "job-1", "job-2"]
+    assert broker.claim("worker-b") is None
+    assert set(broker.statuses("job").values()) == {"claimed"}
+
+
+def test_expired_lease_goes_to_another_worker(broker, clock):
+    broker.publish("job", tasks("job", 1))
+    assert broker.claim("worker-a")["id"] == "job-0"
+    clock.now += LEASE_SECONDS * 0.8
+    broker.heartbeat("job-0", "worker-a")
+    clock.now += LEASE_SECONDS * 0.8
+    # The heartbeat renewed the lease
+    assert broker.claim("worker-b") is None
+
+    clock.now += LEASE_SECONDS + 1
+    assert broker.claim("worker-b")["id"] == "job-0"
+    # The first worker lost the task; its late report is ignored
+    broker.complete("job-0", "worker-a")
+    assert broker.statuses("job") == {"job-0": "claimed"}
+    broker.complete("job-0", "worker-b")
+    assert broker.statuses("job") == {"job-0": "done"}
+
+
+def test_failed_task_is_retried_until_max_attempts(broker):
+    broker.publish("job", tasks("job", 1))
+    broker.claim("worker-a")
+    broker.fail("job-0", "worker-a", "first error")
+    assert broker.statuses("job") == {"job-0": "queued"}
+
+    assert broker.claim("worker-b")["id"] == "job-0"
+    broker.fail("job-0", "worker-b", "second error")
+    assert broker.statuses("job") == {"job-0": "failed"}
+    assert broker.errors("job") == {"job-0": "second error"}
+    assert broker.claim("worker-c") is None
+
+
+def test_expired_leases_count_as_attempts(broker, clock):
+    broker.publish("job", tasks("job", 1))
+    for worker in ("worker-a", "worker-b"):
+        assert broker.claim(worker)["id"] == "job-0"
+        clock.now += LEASE_SECONDS + 1
+    assert broker.claim("worker-c") is None
+    assert broker.statuses("job") == {"job-0": "failed"}
+    assert broker.errors("job") == {"job-0": "lease expired"}
+
+
+def test_run_worker_reports_failures_and_completions(broker, monkeypatch):
+    def run_task(task):
+        if task["index"] == 1:
+            raise ValueError("bad chunk")
+    monkeypatch.setattr(render_queue, "run_task", run_task)
+    broker.publish("job", tasks("job", 2))
+
+    assert run_worker(broker, worker_id="worker-a", exit_when_idle=True) == 1
+    assert broker.statuses("job") == {"job-0": "done", "job-1": "failed"}
+    assert "bad chunk" in broker.errors("job")["job-1"]
+
+
+def test_run_worker_heartbeats_within_the_broker_lease(tmp_path, monkeypatch):
+    heartbeats = []
+
+    class RecordingBroker(SQLiteBroker):
+        def heartbeat(self, task_id, worker_id):
+            heartbeats.append(task_id)
+            super().heartbeat(task_id, worker_id)
+
+    # A lease far shorter than LEASE_SECONDS: the task outlives it and must keep it renewed
+    broker = RecordingBroker(str(tmp_path / "queue.db"), lease_seconds=0.15)
+    monkeypatch.setattr(render_queue, "run_task", lambda task: threading.Event().wait(0.4))
+    broker.publish("job", tasks("job", 1))
+
+    assert run_worker(broker, worker_id="worker-a", exit_when_idle=True) == 1
+    assert len(heartbeats) >= 3
+
+
+def test_distributed_render_raises_when_a_task_failed(tmp_path, monkeypatch, clock):
+    class InlineBroker(SQLiteBroker):
+        """Renders what it is given right away, with a worker whose every task fails."""
+        def publish(self, job_id, tasks):
+            super().publish(job_id, tasks)
+            run_worker(self, worker_id="worker-a", exit_when_idle=True)
+
+    def run_task(task):
+        raise RuntimeError("decoder crashed")
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(render_queue, "run_task", run_task)
+    monkeypatch.setattr(zoom_effect, "get_broker", lambda url: InlineBroker(str(tmp_path / "queue.db")))
+    video_path = tmp_path / "video.mp4"
+    video_path.write_bytes(b"not decoded by the failing worker")
+    timeline = ZoomTimeline([], 30, 600, 64, 36)
+
+    with pytest.raises(RuntimeError, match="decoder crashed"):
+        zoom_effect.distributed_render(str(video_path), timeline, 30, (64, 36), 600, str(tmp_path / "out.mp4"),
+                                       "job", broker_url="inline://", chunks=2, poll_seconds=0)
@@ -0,0 +1,65 @@
+import shutil
+import subprocess
+
+import cv2
+import numpy as np
+import pytest
+
+from ffmpeg_io import probe_start_offset
+from segments import Segment, copy_segment, probe_keyframes, splice_encode_args
+
+
+def read_frames(path):
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def test_splice_encode_args_match_source_stream():
+    stream = {"codec_name": "h264", "profile": "Main", "level": 40, "pix_fmt": "yuv420p",
+              "field_order": "progressive", "color_range": "tv", "color_space": "bt709",
+              "color_primaries": "bt709", "color_transfer": "bt709"}
+    assert splice_encode_args(stream) == ['-profile:v', 'main', '-pix_fmt', 'yuv420p', '-level:v', '4.0',
+                                          '-color_range', 'tv', '-colorspace', 'bt709',
+                                          '-color_primaries', 'bt709', '-color_trc', 'bt709']
+
+
+def test_splice_encode_args_leave_out_unknown_tags():
+    stream = {"codec_name": "h264", "profile": "Constrained Baseline", "level": 9, "pix_fmt": "yuv420p",
+              "color_space": "unknown"}
+    assert splice_encode_args(stream) == ['-profile:v', 'baseline', '-pix_fmt', 'yuv420p', '-level:v', '1b']
+
+
+def test_splice_encode_args_refuse_streams_the_pipeline_cannot_match():
+    base = {"codec_name": "h264", "profile": "High", "level": 41, "pix_fmt": "yuv420p"}
+    assert splice_encode_args(base) is not None
+    assert splice_encode_args({**base, "codec_name": "hevc"}) is None
+    assert splice_encode_args({**base, "profile": "High 10", "pix_fmt": "yuv420p10le"}) is None
+    assert splice_encode_args({**base, "field_order": "tt"}) is None
+    assert splice_encode_args({**base, "color_range": "pc"}) is None
+    assert splice_encode_args({**base, "pix_fmt": "yuvj420p", "color_range": "pc"}) is not None
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="needs ffmpeg")
+def test_copy_segment_starts_on_its_frame_when_video_starts_late(tmp_path):
+    # The audio starts at 0 and the video 0.4 s later, so frame 0 is not at the container start
+    video_path = str(tmp_path / "delayed.mp4")
+    fps = 25
+    subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'lavfi', '-i', 'anullsrc=r=44100:cl=mono',
+                    '-f', 'lavfi', '-i', f'testsrc2=size=160x120:rate={fps}', '-map', '0:a', '-map', '1:v',
+                    '-vf', 'setpts=PTS+0.4/TB', '-frames:v', '100', '-t', '4.4', '-c:v', 'libx264', '-g', '25',
+                    '-pix_fmt', 'yuv420p', '-c:a', 'aac', video_path], check=True)
+    assert probe_start_offset(video_path) == pytest.approx(0.4, abs=0.01)
+    assert probe_keyframes(video_path, fps) == [0, 25, 50, 75]
+
+    segment_path = str(tmp_path / "segment.ts")
+    copy_segment(video_path, Segment(50, 75, reencode=False), fps, segment_path)
+    source, copied = read_frames(video_path), read_frames(segment_path)
+    assert len(copied) == 25
+    assert all(np.array_equal(a, b) for a, b in zip(copied, source[50:75]))
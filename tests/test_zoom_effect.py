@@ -0,0 +1,95 @@
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+
+import zoom_effect
+from ffmpeg_io import is_constant_frame_rate
+from frame_pipeline import PROCESS_BUDGET
+from run_benchmarks import make_synthetic_video
+from zoom_effect import RenderVariant, ZoomEffect, process_variants, process_video, render_frame_range
+from zoom_timeline import ZoomTimeline
+
+pytestmark = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="needs ffmpeg")
+
+
+@pytest.fixture
+def video_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / "synthetic.mp4")
+    make_synthetic_video(path, 320, 180, 2)
+    return path
+
+
+@pytest.fixture
+def failing_capture(monkeypatch):
+    def open_capture(*args, **kwargs):
+        raise RuntimeError("capture failed")
+    monkeypatch.setattr(zoom_effect, "open_capture", open_capture)
+
+
+def test_process_video_releases_pool_budget_on_failure(video_path, failing_capture):
+    in_use = PROCESS_BUDGET.in_use
+    with pytest.raises(RuntimeError, match="capture failed"):
+        process_video(video_path, [ZoomEffect(0.5, 1.5, 0.5, 1.3, 0)], use_analysis_cache=False)
+    assert PROCESS_BUDGET.in_use == in_use
+
+
+def test_process_variants_releases_pool_budget_on_failure(video_path, failing_capture):
+    in_use = PROCESS_BUDGET.in_use
+    variants = [RenderVariant("wide", [ZoomEffect(0.5, 1.5, 0.5, 1.3, 0)]),
+                RenderVariant("square", [ZoomEffect(0.5, 1.5, 0.5, 1.3, 0)], crop=(70, 0, 180, 180))]
+    with pytest.raises(RuntimeError, match="capture failed"):
+        process_variants(video_path, variants, use_analysis_cache=False)
+    assert PROCESS_BUDGET.in_use == in_use
+
+
+class FrameCollector:
+    """Writer that keeps copies of the frames instead of encoding them."""
+    def __init__(self):
+        self.frames = []
+
+    def write(self, frame):
+        self.frames.append(frame.copy())
+
+
+def make_test_video(path: str, fps: int, frame_count: int, args):
+    subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'lavfi',
+                    '-i', f'testsrc2=size=160x120:rate={fps}', '-frames:v', str(frame_count), *args, path], check=True)
+
+
+@pytest.mark.parametrize("decoder", ["opencv", "ffmpeg"])
+@pytest.mark.parametrize("source", [
+    ("h264.mp4", ['-c:v', 'libx264', '-bf', '3', '-g', '48', '-pix_fmt', 'yuv420p']),
+    # MPEG-4 with B-frames in AVI: the first frame is stamped one frame after the container start
+    ("mpeg4.avi", ['-c:v', 'mpeg4', '-bf', '2', '-g', '50']),
+])
+def test_chunks_match_single_pass_render(tmp_path, decoder, source):
+    name, args = source
+    video_path = str(tmp_path / name)
+    fps, total_frames = 25, 200
+    make_test_video(video_path, fps, total_frames, args)
+    assert is_constant_frame_rate(video_path, fps)
+    timeline = ZoomTimeline([ZoomEffect(1.0, 5.0, 1, 1.3, 1)], fps, total_frames, 160, 120)
+    timeline.compile()
+
+    single_pass = FrameCollector()
+    render_frame_range(video_path, 0, total_frames, timeline, single_pass, decoder=decoder)
+    chunked = FrameCollector()
+    # Chunk starts on and between keyframes, as parallel_render splits the timeline
+    bounds = [0, 37, 50, 113, 161, total_frames]
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        render_frame_range(video_path, start, end, timeline, chunked, decoder=decoder)
+
+    assert len(chunked.frames) == len(single_pass.frames) == total_frames
+    mismatches = [i for i, (a, b) in enumerate(zip(chunked.frames, single_pass.frames)) if not np.array_equal(a, b)]
+    assert not mismatches, f"chunked frames differ from the single pass render at {mismatches[:5]}"
+
+
+def test_variable_frame_rate_is_detected(tmp_path):
+    video_path = str(tmp_path / "vfr.mp4")
+    # Half a second gap after frame 50
+    make_test_video(video_path, 30, 150, ['-vf', "setpts='PTS+gt(N,50)*0.5/TB'", '-vsync', 'passthrough',
+                                          '-c:v', 'libx264'])
+    assert not is_constant_frame_rate(video_path, 30)
@@ -122,19 +122,40 @@
 #         raise e
 import os
 from pathlib import Path
+import shutil
 import subprocess
-from typing import List
+import sys
+import tempfile
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
 import cv2
 import numpy as np
-import math
-import streamlit as st
-from concurrent.futures import ThreadPoolExecutor
-from queue import Queue
-from face_bounding_box_detection import get_bounding_box
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from face_analysis import SamplingPolicy, analyze_zoom_windows
+from analysis_cache import FaceAnalysisCache, video_content_hash
+from ffmpeg_io import FFmpegWriter, is_constant_frame_rate, open_capture, probe_start_offset
+from ffmpeg_render import ffmpeg_render
+from frame_pipeline import PIPELINE_MEMORY_BUDGET, FramePool, default_pool_size, default_workers, read_into_pool, run_ordered_pipeline
+from zoom_timeline import EASING, ZoomTimeline
+from render_manifest import JOBS_DIR, RenderManifest, SegmentCache, job_key, link_or_copy, segment_key
+from render_profiler import RenderProfiler
+from render_queue import get_broker
+from segments import Segment, concat_segments, copy_segment, plan_segments, probe_keyframes, probe_video_stream, splice_encode_args, zoom_frame_ranges
 import logging
 
 logging.basicConfig(level=logging.INFO)
 
+# Encoder settings and output height of each render profile; None keeps the source resolution
+RENDER_PROFILES = {
+    "final": {"height": None, "preset": "medium", "crf": 23},
+    "proxy": {"height": 360, "preset": "ultrafast", "crf": 30},
+    "clip": {"height": 720, "preset": "veryfast", "crf": 23},
+}
+
+# Chunks shorter than this are not worth a process and an encoder start-up of their own
+MIN_CHUNK_FRAMES = 250
+
 class ZoomEffect:
     def __init__(self, start_time: float, end_time: float, zoom_in_duration: float,  scale: float, zoom_out_duration: float = 0, lag_time=None):
         self.start_time = start_time
@@ -174,17 +195,73 @@ class ZoomEffect:
             return scale - (scale - 1.0) * progress
         return 1.0
 
-def apply_zoom(frame: np.ndarray, scale: float, center_x: int = None, center_y: int=None) -> np.ndarray:
-    if scale == 1.0:
-        return frame
+    def scale_at(self, times: np.ndarray, scale=None, easing: str = "linear") -> np.ndarray:
+        """Vectorized get_scale_at_time_with_lag over an array of times, with an optional easing curve."""
+        if scale is None:
+            scale = self.scale
+        ease = EASING[easing]
+        time_in_effect = np.asarray(times, dtype=np.float64) - self.start_time
+        time_in_zoom_out = time_in_effect - self.zoom_in_duration - self.lag_time
+        zoom_in_progress = np.clip(time_in_effect / self.zoom_in_duration, 0, 1) if self.zoom_in_duration > 0 else np.ones_like(time_in_effect)
+        zoom_out_progress = np.clip(time_in_zoom_out / self.zoom_out_duration, 0, 1) if self.zoom_out_duration > 0 else np.ones_like(time_in_effect)
+        conditions = [
+            (0 <= time_in_effect) & (time_in_effect <= self.zoom_in_duration),
+            (self.zoom_in_duration <= time_in_effect) & (time_in_effect <= self.lag_time + self.zoom_in_duration),
+            (0 <= time_in_zoom_out) & (time_in_zoom_out <= self.zoom_out_duration),
+        ]
+        choices = [
+            1.0 + (scale - 1.0) * ease(zoom_in_progress),
+            np.full_like(time_in_effect, scale),
+            scale - (scale - 1.0) * ease(zoom_out_progress),
+        ]
+        return np.select(conditions, choices, default=1.0)
+
+    def hold_frames(self, fps: float, total_frames: int):
+        start_frame = int(self.start_time * fps) + int(self.zoom_in_duration * fps)
+        end_frame = min(total_frames, start_frame + int((self.total_duration - self.zoom_in_duration) * fps))
+        return start_frame, end_frame
+
+# Interpolation used by the "roi" transform backend for each quality profile.
+QUALITY_INTERPOLATION = {
+    "draft": cv2.INTER_NEAREST,
+    "balanced": cv2.INTER_LINEAR,
+    "high": cv2.INTER_CUBIC,
+}
+
+def zoom_roi(width: int, height: int, scale: float, center_x: float, center_y: float):
+    """Source rectangle (x, y, w, h) that a zoom by `scale` around (center_x, center_y) maps onto the full frame."""
+    return center_x * (1 - 1 / scale), center_y * (1 - 1 / scale), width / scale, height / scale
+
+def apply_zoom(frame: np.ndarray, scale: float, center_x: int = None, center_y: int=None,
+               backend: str = "warp", quality: str = "balanced", dst: np.ndarray = None,
+               output_size=None) -> np.ndarray:
+    """Zoom `frame` by `scale` around the center; with `output_size` (width, height) the result is resized in the same step."""
     height, width = frame.shape[:2]
+    output_size = tuple(output_size) if output_size is not None else (width, height)
+    if scale == 1.0:
+        if output_size == (width, height):
+            return frame
+        return cv2.resize(frame, output_size, dst=dst, interpolation=cv2.INTER_AREA)
     if center_x is None and center_y is None:
         center_x, center_y = width / 2, height / 2 -  (height / 4)
+
+    # "roi" rounds the source rectangle to whole pixels, so ramps and face-following wobble by up to half a
+    # pixel per frame; it is faster, but "warp" samples exactly and stays the default
+    if backend == "roi" and scale > 1.0:
+        x, y, roi_width, roi_height = zoom_roi(width, height, scale, center_x, center_y)
+        left, top = int(round(x)), int(round(y))
+        right, bottom = left + int(round(roi_width)), top + int(round(roi_height))
+        # A ROI reaching outside the frame needs the black border of the warp path
+        if left >= 0 and top >= 0 and right <= width and bottom <= height:
+            return cv2.resize(frame[top:bottom, left:right], output_size, dst=dst,
+                              interpolation=QUALITY_INTERPOLATION[quality])
+
+    scale_x, scale_y = output_size[0] / width, output_size[1] / height
     M = np.float32([
-        [scale, 0, center_x * (1 - scale)],
-        [0, scale, center_y * (1 - scale)]
+        [scale * scale_x, 0, scale_x * center_x * (1 - scale)],
+        [0, scale * scale_y, scale_y * center_y * (1 - scale)]
     ])
-    return cv2.warpAffine(frame, M, (width, height), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
+    return cv2.warpAffine(frame, M, output_size, dst=dst, flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
 
 def extract_audio(input_video: str, output_audio: str):
     command = ['ffmpeg', '-i', input_video, '-vn', '-acodec', 'aac', '-y', output_audio]
@@ -193,55 +270,247 @@ def extract_audio(input_video: str, output_audio: str):
         logging.error("Audio extraction failed: %s", result.stderr.decode())
         raise RuntimeError("Failed to extract audio")
 
-def process_frames_worker(frame_queue, out, zoom_scales):
-    while True:
-        try:
-            frame_data = frame_queue.get()
-            if frame_data is None:
-                frame_queue.task_done()
-                break  # Exit loop when sentinel is received
-
-            frame_count, frame = frame_data
-            current_scale = zoom_scales[frame_count]
-            
-            if current_scale != 1.0:
-                frame = apply_zoom(frame, current_scale)
+def combine_video_audio(video_path: str, audio_path: str, output_path: str):
+    ffmpeg_command = [
+        'ffmpeg', '-i', video_path, '-i', audio_path, '-c:v', 'libx264',
+        '-c:a', 'copy', '-shortest', '-movflags', '+faststart', '-y', output_path
+    ]
+    result = subprocess.run(ffmpeg_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
-            out.write(frame)
-            frame_queue.task_done()
-
-        except Exception as e:
-            logging.error(f"Error processing frame: {e}")
-            frame_queue.task_done()  # Ensure task_done is called even in case of error
-
-def process_bounding_boxes(frame_queue, output_queue, zoom_scales):
-    while True:
-        try:
-            frame_data = frame_queue.get()
-            if frame_data is None:
-                frame_queue.task_done()
-                break  # Exit loop when sentinel is received
-
-            frame_count, frame = frame_data
-            current_scale = zoom_scales[frame_count]
-            refined_scale, _, _ = get_bounding_box(frame)
-            if current_scale != 1.0:
-                   
-                if refined_scale is not None:
-                    output_queue.put((frame_count, math.ceil(refined_scale * 10) / 10))
-                    print("refined_scale ", round(math.ceil(refined_scale * 10) / 10), 1)
-                else:
-                    output_queue.put((frame_count, current_scale))
+    if result.returncode != 0:
+        logging.error("FFmpeg error during combination: %s", result.stderr.decode())
+        raise RuntimeError("Failed to combine video and audio")
+
+def render_frame_range(video_path: str, start_frame: int, end_frame: int, timeline: ZoomTimeline, out,
+                       backend: str = "warp", quality: str = "balanced", decoder: str = "opencv", output_size=None):
+    cap = open_capture(video_path, decoder, (timeline.width, timeline.height), timeline.fps, start_frame, end_frame)
+    # The writer consumes each frame before the next read, so one decode and one zoom buffer are reused throughout
+    frame, zoom_buffer = None, None
+    try:
+        for frame_num in range(start_frame, end_frame):
+            ret, frame = cap.read(image=frame)
+            if not ret:
+                break
+            current_scale = timeline.scales[frame_num]
+            if current_scale != 1.0 or output_size is not None:
+                if zoom_buffer is None:
+                    width, height = output_size or (frame.shape[1], frame.shape[0])
+                    zoom_buffer = np.empty((height, width, 3), dtype=frame.dtype)
+                out.write(apply_zoom(frame, current_scale, timeline.center_x[frame_num], timeline.center_y[frame_num],
+                                     backend=backend, quality=quality, dst=zoom_buffer, output_size=output_size))
             else:
-                output_queue.put((frame_count, current_scale))
-            frame_queue.task_done()
-
-        except Exception as e:
-            logging.error(f"Error processing frame: {e}")
-            frame_queue.task_done()  # Ensure task_done is called even in case of error
-            
-
+                out.write(frame)
+    finally:
+        cap.release()
 
+def smart_render(video_path: str, timeline: ZoomTimeline, fps: float, frame_size, total_frames: int, output_path: str,
+                 key: str, backend: str = "warp", quality: str = "balanced", decoder: str = "opencv",
+                 segment_cache: SegmentCache = None, video_hash: str = None, encode_args: List[str] = None):
+    """
+    Re-encode only the GOPs that overlap a zoom and stream-copy everything else,
+    then join the segments losslessly and copy the source audio in. `encode_args` make the re-encoded
+    segments match the source stream (see splice_encode_args).
+    Segments are checkpointed in the RenderManifest of `key`, so a restarted render resumes.
+    With a `segment_cache`, segments whose source frames and zooms did not change since an earlier
+    render are taken from the cache instead of being encoded again.
+    """
+    keyframes = probe_keyframes(video_path, fps)
+    start_offset = probe_start_offset(video_path)
+    segments = plan_segments(zoom_frame_ranges(timeline.scales), keyframes, total_frames)
+    with RenderManifest.for_job(key, segments) as manifest:
+        pending = manifest.pending()
+        reencoded = sum(segments[i].num_frames for i in pending if segments[i].reencode)
+        logging.info("Smart render: re-encoding %d of %d frames in %d segments, %d of them already done",
+                     reencoded, total_frames, len(segments), len(segments) - len(pending))
+
+        for i in pending:
+            segment = segments[i]
+            cache_key = segment_key(video_hash, segment, timeline, backend, quality) if segment_cache else None
+            if cache_key and segment_cache.fetch(cache_key, manifest.partial_path(i)):
+                manifest.mark_done(i)
+                continue
+            if segment.reencode:
+                out = FFmpegWriter(manifest.partial_path(i), fps, frame_size, output_args=['-f', 'mpegts'],
+                                   encode_args=encode_args)
+                try:
+                    render_frame_range(video_path, segment.start_frame, segment.end_frame, timeline, out,
+                                       backend, quality, decoder)
+                finally:
+                    out.release()
+            else:
+                copy_segment(video_path, segment, fps, manifest.partial_path(i), start_offset)
+            if cache_key:
+                segment_cache.store(cache_key, manifest.partial_path(i))
+            manifest.mark_done(i)
+        if segment_cache:
+            logging.info("Smart render: %d segments from the segment cache", segment_cache.hits)
+        concat_segments(manifest.segment_paths(), output_path, audio_source=video_path)
+        manifest.remove()
+
+def render_chunk(video_path: str, segment: Segment, timeline: ZoomTimeline, output_path: str, fps: float, frame_size,
+                 encoder_threads: int, backend: str = "warp", quality: str = "balanced", decoder: str = "opencv") -> str:
+    out = FFmpegWriter(output_path, fps, frame_size, output_args=['-threads', str(encoder_threads), '-f', 'mpegts'])
+    try:
+        render_frame_range(video_path, segment.start_frame, segment.end_frame, timeline, out, backend, quality, decoder)
+    finally:
+        out.release()
+    return output_path
+
+def plan_chunks(timeline: ZoomTimeline, total_frames: int, key: str, chunks: int, backend: str, quality: str,
+                segment_cache: SegmentCache = None, video_hash: str = None, jobs_dir: Path = JOBS_DIR):
+    """
+    Split the timeline into at most `chunks` equal frame ranges of at least MIN_CHUNK_FRAMES and open the
+    RenderManifest of `key` for them. Chunks that are unchanged since an earlier render are taken from the
+    `segment_cache` and marked done.
+
+    :return: tuple: Segments, manifest (locked; use it in a `with` block), indexes of the chunks left to render,
+        segment cache key of each of them
+    """
+    chunks = max(1, min(chunks, total_frames // MIN_CHUNK_FRAMES))
+    bounds = np.linspace(0, total_frames, chunks + 1).astype(int)
+    segments = [Segment(int(start), int(end), reencode=True) for start, end in zip(bounds[:-1], bounds[1:])]
+    manifest = RenderManifest.for_job(key, segments, jobs_dir)
+    try:
+        pending = manifest.pending()
+        cache_keys = {}
+        if segment_cache:
+            cache_keys = {i: segment_key(video_hash, segments[i], timeline, backend, quality) for i in pending}
+            for i in list(pending):
+                if segment_cache.fetch(cache_keys[i], manifest.partial_path(i)):
+                    manifest.mark_done(i)
+                    pending.remove(i)
+    except BaseException:
+        manifest.release()
+        raise
+    return segments, manifest, pending, cache_keys
+
+def parallel_render(video_path: str, timeline: ZoomTimeline, fps: float, frame_size, total_frames: int, output_path: str,
+                    key: str, chunks: int = None, backend: str = "warp", quality: str = "balanced",
+                    decoder: str = "opencv", segment_cache: SegmentCache = None, video_hash: str = None):
+    """
+    Split the timeline into equal chunks, render each one in its own process
+    (own capture, zoom and encode) and concatenate the results with the source audio.
+    Finished chunks are checkpointed in the RenderManifest of `key`, so a restarted render resumes,
+    and unchanged chunks of earlier renders are taken from the `segment_cache`.
+    Chunks are frame-exact with either decoder for constant frame rate sources only (see is_constant_frame_rate).
+    """
+    workers = os.cpu_count() or 1
+    segments, manifest, pending, cache_keys = plan_chunks(timeline, total_frames, key, chunks or workers, backend,
+                                                          quality, segment_cache, video_hash)
+    chunks = len(segments)
+    encoder_threads = max(1, workers // chunks)
+    with manifest:
+        logging.info("Parallel render: %d chunks on %d cores, %d of them already done", chunks, workers,
+                     chunks - len(pending))
+
+        if pending:
+            with ProcessPoolExecutor(max_workers=min(len(pending), workers)) as executor:
+                futures = {
+                    executor.submit(render_chunk, video_path, segments[i], timeline, manifest.partial_path(i), fps,
+                                    frame_size, encoder_threads, backend, quality, decoder): i
+                    for i in pending
+                }
+                # Record every chunk as soon as it is done, so a crash keeps the finished ones
+                for future in as_completed(futures):
+                    future.result()
+                    if segment_cache:
+                        segment_cache.store(cache_keys[futures[future]], manifest.partial_path(futures[future]))
+                    manifest.mark_done(futures[future])
+        concat_segments(manifest.segment_paths(), output_path, audio_source=video_path)
+        manifest.remove()
+
+# Job directories, source copies and segments of distributed renders; must be mounted at the same path on every worker
+SHARED_DIR = Path(os.environ.get("ZOOM_SHARED_DIR", "temp_output"))
+BROKER_URL = os.environ.get("ZOOM_BROKER_URL", f"sqlite://{SHARED_DIR / 'render_queue.db'}")
+
+
+def distributed_render(video_path: str, timeline: ZoomTimeline, fps: float, frame_size, total_frames: int,
+                       output_path: str, key: str, broker_url: str = BROKER_URL, chunks: int = None,
+                       backend: str = "warp", quality: str = "balanced", decoder: str = "opencv",
+                       local_workers: int = 0, segment_cache: SegmentCache = None, video_hash: str = None,
+                       poll_seconds: float = 1.0):
+    """
+    Like parallel_render, but the chunks are published as tasks to the broker at `broker_url` and rendered by
+    workers (python render_queue.py) on any node sharing SHARED_DIR. This process only waits, records finished
+    chunks in the RenderManifest of `key` and concatenates them with the source audio.
+    `local_workers` worker processes are started here as well, e.g. for single-node use.
+    """
+    broker = get_broker(broker_url)
+    segments, manifest, pending, cache_keys = plan_chunks(timeline, total_frames, key, chunks or os.cpu_count() or 1,
+                                                          backend, quality, segment_cache, video_hash,
+                                                          SHARED_DIR / "jobs")
+    chunks = len(segments)
+
+    with manifest:
+        # Workers read the source and timeline from the job directory, never from this machine's paths
+        shared_video = str((manifest.job_dir / f"source{Path(video_path).suffix}").resolve())
+        if not os.path.exists(shared_video):
+            link_or_copy(video_path, shared_video)
+        timeline_path = str((manifest.job_dir / "timeline.npz").resolve())
+        timeline.save(timeline_path)
+        # Tasks of an interrupted earlier attempt are dropped; this attempt's partial files get names of their own,
+        # so a worker still busy with an old task cannot overwrite them
+        broker.remove(key)
+        attempt = uuid.uuid4().hex[:8]
+        tasks = {
+            f"{key}-{attempt}-{i}": {
+                "id": f"{key}-{attempt}-{i}", "job_id": key, "index": i,
+                "start_frame": segments[i].start_frame, "end_frame": segments[i].end_frame,
+                "video_path": shared_video, "timeline_path": timeline_path,
+                "output_path": str(Path(manifest.segment_path(i, f".{attempt}.partial.ts")).resolve()),
+                "encoder_threads": max(1, (os.cpu_count() or 1) // chunks),
+                "backend": backend, "quality": quality, "decoder": decoder,
+            }
+            for i in pending
+        }
+        broker.publish(key, list(tasks.values()))
+        logging.info("Distributed render: %d chunks published to %s, %d of %d already done", len(tasks), broker_url,
+                     chunks - len(pending), chunks)
+
+        worker_command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "render_queue.py"),
+                          "--broker", broker_url, "--exit-when-idle", "--poll-seconds", str(poll_seconds)]
+        workers = [subprocess.Popen(worker_command) for _ in range(min(local_workers, len(tasks)))]
+        try:
+            while tasks:
+                statuses = broker.statuses(key)
+                for task_id, task in list(tasks.items()):
+                    if statuses.get(task_id) == "done":
+                        if segment_cache:
+                            segment_cache.store(cache_keys[task["index"]], task["output_path"])
+                        manifest.mark_done(task["index"], task["output_path"])
+                        del tasks[task_id]
+                    elif statuses.get(task_id) == "failed":
+                        raise RuntimeError(f"Distributed render of frames {task['start_frame']}-{task['end_frame']} "
+                                           f"failed: {broker.errors(key).get(task_id)}")
+                if not tasks:
+                    break
+                if workers and all(worker.poll() is not None for worker in workers) and "queued" in statuses.values():
+                    # Idle local workers exit; tasks given back by an expired lease need new ones
+                    workers = [subprocess.Popen(worker_command) for _ in workers]
+                time.sleep(poll_seconds)
+        finally:
+            for worker in workers:
+                if worker.poll() is None:
+                    worker.terminate()
+                    worker.wait()
+        broker.remove(key)
+        concat_segments(manifest.segment_paths(), output_path, audio_source=video_path)
+        manifest.remove()
+
+def zoom_transform(timeline: ZoomTimeline, backend: str = "warp", quality: str = "balanced", pool: FramePool = None):
+    """
+    Frame transform for run_ordered_pipeline. Zoomed frames get a fresh array since they wait in the reorder buffer;
+    with a `pool` the transform takes a slot and renders into that slot's output buffer instead.
+    """
+    def transform(frame_count, frame):
+        if pool is not None:
+            slot, frame = frame, pool.frames[frame]
+        current_scale = timeline.scales[frame_count]
+        if current_scale == 1.0:
+            return frame
+        return apply_zoom(frame, current_scale, timeline.center_x[frame_count], timeline.center_y[frame_count],
+                          backend=backend, quality=quality, dst=pool.output(slot) if pool is not None else None)
+    return transform
 
 # class ZoomEffectJumpCut(ZoomEffect):
 #     def __init__(self, start_time: float, zoom_in_duration: float, scale: float):
@@ -345,136 +614,403 @@ def process_bounding_boxes(frame_queue, output_queue, zoom_scales):
 #         return final_output
     
 
-def process_video(video_path: str, zoom_effects: List[ZoomEffect]) -> str:
+class RenderVariant:
+    """
+    One output of process_variants.
+
+    :param name: str: Name of the output, used in its file name; unique within one call
+    :param zoom_effects: List[ZoomEffect]: Zooms of this output, with times of the source video
+    :param crop: tuple: Source rectangle (x, y, w, h) to reframe to, e.g. a 9:16 cut of a 16:9 video; None keeps the full frame
+    :param output_size: tuple: Encoded (width, height); None keeps the crop size
+    :param easing: str: Easing curve of the zooms, see zoom_timeline.EASING
+    """
+    def __init__(self, name: str, zoom_effects: List[ZoomEffect], crop=None, output_size=None, easing: str = "linear"):
+        self.name = name
+        self.zoom_effects = zoom_effects
+        self.crop = crop
+        self.output_size = output_size
+        self.easing = easing
+
+def centered_crop(width: int, height: int, aspect_width: int, aspect_height: int):
+    """Largest centered (x, y, w, h) rectangle of the given aspect ratio, with even sides, e.g. (9, 16) for a vertical reframe."""
+    crop_width = min(width, int(height * aspect_width / aspect_height)) // 2 * 2
+    crop_height = min(height, int(width * aspect_height / aspect_width)) // 2 * 2
+    return (width - crop_width) // 2, (height - crop_height) // 2, crop_width, crop_height
+
+def video_info(video_path: str):
+    """:return: tuple: fps, width, height and frame count of the video"""
     cap = cv2.VideoCapture(video_path)
     fps = cap.get(cv2.CAP_PROP_FPS)
     width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    return fps, width, height, total_frames
+
+def refine_effect_scales(zoom_effects: List[ZoomEffect], refined_scales, fps: float, total_frames: int):
+    """Lower each effect's scale to the smallest refined scale seen in its hold window."""
+    for effect in zoom_effects:
+        start_frame, end_frame = effect.hold_frames(fps, total_frames)
+        values = [refined_scales.get(key) or effect.scale for key in range(start_frame, end_frame)]
+        if values:
+            effect.scale = min(values)
+
+def log_progress(fraction: Optional[float], message: str):
+    """Default progress callback of the renders: called with the done fraction (None when unchanged) and a status."""
+    if fraction is None:
+        logging.info(message)
+    else:
+        logging.info("%s (%d%%)", message, round(fraction * 100))
+
+
+def render_output_path(video_path: str, profile: str = "final", container: str = "mp4",
+                       output_dir: str = "temp_output") -> str:
+    """
+    Path process_video writes its output to, e.g. to play a progressive render while it is written.
+    :param container: "mp4" and "fmp4" write one .mp4 file, "hls" an index.m3u8 in a directory of its own
+    """
+    output_prefix = "output" if profile == "final" else profile
+    if container == "hls":
+        return os.path.join(output_dir, f"{output_prefix}_{Path(video_path).stem}_hls", "index.m3u8")
+    return os.path.join(output_dir, f"{output_prefix}_{Path(video_path).stem}.mp4")
+
+
+def process_video(video_path: str, zoom_effects: List[ZoomEffect], sampling_policy: SamplingPolicy = None,
+                  transform_backend: str = "warp", quality: str = "balanced", encoder: str = "ffmpeg",
+                  render_mode: str = "full", chunks: int = None, easing: str = "linear", backend: str = "opencv",
+                  workers: int = None, use_analysis_cache: bool = True, profile: str = "final",
+                  memory_budget: int = PIPELINE_MEMORY_BUDGET, container: str = "mp4", decoder: str = "opencv",
+                  use_segment_cache: bool = True, follow_face: bool = True, broker_url: str = None,
+                  profiler: RenderProfiler = None,
+                  progress: Callable[[Optional[float], str], None] = None, output_dir: str = "temp_output") -> str:
+    # Stage timings are logged at the end; pass a profiler to read them with profiler.summary()
+    # The output goes to render_output_path(video_path, profile, container, output_dir)
+    profiler = profiler or RenderProfiler()
+    progress = progress or log_progress
+    fps, width, height, total_frames = video_info(video_path)
 
     temp_dir = Path("temp_output")
     temp_dir.mkdir(exist_ok=True, parents=True)
-    temp_video = str(temp_dir / "temp_video.mp4")
-    temp_audio = str(temp_dir / "temp_audio.aac")
-    final_output = str(temp_dir / f"output_{Path(video_path).stem}.mp4")
-
-    status_text = st.empty()
-    status_text.text("Extracting audio...")
-
-    try:
-        extract_audio(video_path, temp_audio)
-    except RuntimeError as e:
-        logging.error("An error occurred during audio extraction: %s", e)
-        return
-
-    out = cv2.VideoWriter(temp_video, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
-    if not out.isOpened():
-        raise RuntimeError("Failed to initialize video writer")
-
-    zoom_scales = [1.0] * total_frames
-    for effect in zoom_effects:
-        start_frame = int(effect.start_time * fps)
-        end_frame = min(total_frames, start_frame + int(effect.total_duration * fps))
-        for frame_num in range(start_frame, end_frame):
-            current_time = frame_num / fps
-            zoom_scales[frame_num] = effect.get_scale_at_time_with_lag(current_time)
-
-    progress_bar = st.progress(0)
-    print("Total frames: ", total_frames)
-    output_queue = Queue(maxsize = total_frames)
-    frame_queue = Queue(maxsize=400)
-
-    with ThreadPoolExecutor(max_workers=16) as executor:
-        executor.submit(process_bounding_boxes, frame_queue, output_queue, zoom_scales)
-        frame_count = 0
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
+    render_profile = RENDER_PROFILES[profile]
+    final_output = render_output_path(video_path, profile, container, output_dir)
+    if container == "hls":
+        # The playlist and its segments get a directory of their own, emptied so no stale segments remain
+        shutil.rmtree(os.path.dirname(final_output), ignore_errors=True)
+    os.makedirs(os.path.dirname(final_output), exist_ok=True)
+
+    timeline = ZoomTimeline(zoom_effects, fps, total_frames, width, height, easing=easing)
+
+    progress(0.0, "Analyzing faces in zoom windows...")
+    sampling_policy = sampling_policy or SamplingPolicy()
+    analysis_cache = FaceAnalysisCache.for_video(video_path, sampling_policy) if use_analysis_cache else None
+    with profiler.measure("face_analysis"):
+        refined_scales, face_boxes, analysis_stats = analyze_zoom_windows(video_path, zoom_effects, fps, total_frames,
+                                                                          sampling_policy, analysis_cache, decoder,
+                                                                          (width, height), profiler)
+    progress(None, f"Face analysis done: {analysis_stats.detector_calls} detector calls, "
+                   f"{analysis_stats.calls_saved} saved")
+
+    refine_effect_scales(zoom_effects, refined_scales, fps, total_frames)
+    if follow_face:
+        timeline.follow_faces(face_boxes)
+    else:
+        timeline.compile()
+
+    output_width, output_height = width, height
+    if render_profile["height"] is not None and render_profile["height"] < height:
+        # Proxy renders always take the frame pipeline so frames are downscaled right after decode
+        output_height = render_profile["height"]
+        output_width = int(round(width * output_height / height / 2)) * 2
+        timeline = timeline.resized(output_width, output_height)
+        backend, render_mode, encoder = "opencv", "full", "ffmpeg"
+    if container != "mp4":
+        # Progressive output is written by the frame pipeline while it renders
+        backend, render_mode, encoder = "opencv", "full", "ffmpeg"
+
+    if backend == "ffmpeg" and not is_constant_frame_rate(video_path, fps):
+        # The ffmpeg backend times its per-frame crop commands by frame number times the frame duration
+        logging.info("The ffmpeg backend needs a constant frame rate source; rendering with OpenCV")
+        backend = "opencv"
+
+    if backend == "ffmpeg":
+        progress(None, "Rendering with ffmpeg...")
+        with profiler.measure("ffmpeg_render"):
+            ffmpeg_render(video_path, timeline, final_output, preset=render_profile["preset"],
+                          crf=render_profile["crf"], keyframe_times=timeline.start_times())
+        profiler.report(final_output)
+        progress(1.0, "Processing complete!")
+        return final_output
 
-            frame_queue.put((frame_count, frame))
-            frame_count += 1
+    if render_mode == "smart":
+        stream = probe_video_stream(video_path)
+        encode_args = splice_encode_args(stream)
+        if encode_args is not None:
+            progress(None, "Rendering zoom segments...")
+            video_hash = video_content_hash(video_path)
+            key = job_key(video_hash, timeline.signature(), "smart", transform_backend, quality)
+            # Segments whose zooms did not change since the last render are spliced in from the segment cache
+            with profiler.measure("smart_render"):
+                smart_render(video_path, timeline, fps, (width, height), total_frames, final_output, key,
+                             transform_backend, quality, decoder, SegmentCache() if use_segment_cache else None,
+                             video_hash, encode_args)
+            profiler.report(final_output)
+            progress(1.0, "Processing complete!")
+            return final_output
+        logging.info("Smart rendering needs an 8-bit progressive h264 source it can re-encode to match, got %s; "
+                     "rendering every frame", stream)
+
+    if render_mode in ("parallel", "distributed") and not is_constant_frame_rate(video_path, fps):
+        # Chunks seek to their first frame by timestamp, which only hits the right frame at a constant frame rate
+        logging.info("Chunked rendering needs a constant frame rate source; rendering every frame in one pass")
+        render_mode = "full"
+
+    if render_mode == "distributed":
+        progress(None, "Rendering chunks on the render workers...")
+        video_hash = video_content_hash(video_path)
+        key = job_key(video_hash, timeline.signature(), "distributed", chunks, transform_backend, quality)
+        # Without a broker of its own the render runs on local workers around a local SQLite queue
+        local_workers = 0 if broker_url or "ZOOM_BROKER_URL" in os.environ else (workers or default_workers())
+        with profiler.measure("distributed_render"):
+            distributed_render(video_path, timeline, fps, (width, height), total_frames, final_output, key,
+                               broker_url or BROKER_URL, chunks, transform_backend, quality, decoder, local_workers,
+                               SegmentCache() if use_segment_cache else None, video_hash)
+        profiler.report(final_output)
+        progress(1.0, "Processing complete!")
+        return final_output
 
-            if frame_count % (total_frames // 20) == 0:
-                progress_bar.progress(frame_count / total_frames)
-                status_text.text(f"Processing frame {frame_count}/{total_frames}")
+    if render_mode == "parallel":
+        progress(None, "Rendering chunks in parallel...")
+        video_hash = video_content_hash(video_path)
+        key = job_key(video_hash, timeline.signature(), "parallel", chunks, transform_backend, quality)
+        with profiler.measure("parallel_render"):
+            parallel_render(video_path, timeline, fps, (width, height), total_frames, final_output, key,
+                            chunks, transform_backend, quality, decoder, SegmentCache() if use_segment_cache else None,
+                            video_hash)
+        profiler.report(final_output)
+        progress(1.0, "Processing complete!")
+        return final_output
 
-        cap.release()
-        # Signal that no more frames will be added
-        frame_queue.put(None)
-        # Wait for the processing to complete
-        frame_queue.join()
-    
-    processed_scales = {}
-    while not output_queue.empty():
-        frame_count, processed_scale = output_queue.get()
-        processed_scales[frame_count] = processed_scale
-    
-    
-    for effect in zoom_effects:
-        start_frame = int(effect.start_time * fps) + int(effect.zoom_in_duration*fps)
-        end_frame = min(total_frames, start_frame + int((effect.total_duration - effect.zoom_in_duration) * fps))
-        values = [processed_scales[key] for key in range(start_frame, end_frame)]
-        min_zoom_scale = min(values)
-        for frame_num in range(start_frame, end_frame):
-            zoom_scales[frame_num] = min_zoom_scale
-        effect.scale = min_zoom_scale
-        
-    
-    for effect in zoom_effects:
-        start_frame = int(effect.start_time * fps) 
-        end_frame = min(total_frames, start_frame + int(effect.zoom_in_duration * fps))
-        for frame_num in range(start_frame, end_frame):
-            current_time = frame_num / fps
-            zoom_scales[frame_num] = effect.get_scale_at_time_with_lag(current_time)
-    
-    
-    cap = cv2.VideoCapture(video_path)
-    frame_queue = Queue(maxsize=400)
-    with ThreadPoolExecutor(max_workers=16) as executor:
-        executor.submit(process_frames_worker, frame_queue, out, zoom_scales)
+    if encoder == "ffmpeg":
+        # Frames are piped into the final libx264 encode and the source audio is stream-copied
+        # An IDR frame at every zoom start makes seeking to a zoom instant
+        out = FFmpegWriter(final_output, fps, (output_width, output_height), audio_source=video_path,
+                           preset=render_profile["preset"], crf=render_profile["crf"], container=container,
+                           keyframe_times=timeline.start_times())
+    else:
+        # Unique names, so concurrent or later renders never overwrite each other's intermediates
+        job_dir = tempfile.mkdtemp(prefix="job_", dir=temp_dir)
+        temp_video = os.path.join(job_dir, "temp_video.mp4")
+        temp_audio = os.path.join(job_dir, "temp_audio.aac")
+        progress(None, "Extracting audio...")
+        try:
+            with profiler.measure("extract_audio"):
+                extract_audio(video_path, temp_audio)
+        except RuntimeError as e:
+            logging.error("An error occurred during audio extraction: %s", e)
+            return
+        out = cv2.VideoWriter(temp_video, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+
+
+    def report_progress(frame_count):
+        if frame_count % max(1, total_frames // 20) == 0:
+            progress(min(1.0, frame_count / total_frames), f"Processing frame {frame_count}/{total_frames}")
+
+    workers = workers or default_workers()
+    pool, cap = None, None
+    # Everything after the writer is created happens inside the try, so a failure never leaks the encoder,
+    # the capture or the pool's share of PROCESS_BUDGET
+    try:
+        if not out.isOpened():
+            raise RuntimeError("Failed to initialize video writer")
+        # Frames in flight are bounded by bytes, and all renders in this process share PROCESS_BUDGET
+        pool = FramePool.within_budget((output_height, output_width, 3), default_pool_size(workers), memory_budget)
+        resize = (output_width, output_height) if (output_width, output_height) != (width, height) else None
+        # FFmpegReader downscales inside ffmpeg, the OpenCV capture is downscaled after decode
+        cap = open_capture(video_path, decoder, (width, height), fps, output_size=resize)
+        if decoder == "ffmpeg":
+            resize = None
+        run_ordered_pipeline(read_into_pool(cap, pool, resize=resize, profiler=profiler),
+                             zoom_transform(timeline, transform_backend, quality, pool), out.write, workers=workers,
+                             progress=report_progress, pool=pool, profiler=profiler)
+    finally:
+        try:
+            if cap is not None:
+                cap.release()
+            # The ffmpeg writer waits here for the encoder to flush and mux the audio
+            with profiler.measure("finalize"):
+                out.release()
+        finally:
+            if pool is not None:
+                pool.dispose()
+
+    if encoder != "ffmpeg":
+        logging.info("Beginning audio-video combination.")
+        progress(None, "Combining video with audio...")
+        with profiler.measure("mux"):
+            combine_video_audio(temp_video, temp_audio, final_output)
 
-        frame_count = 0
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
+        logging.info("Combination completed successfully. Cleaning up temporary files.")
+        shutil.rmtree(job_dir, ignore_errors=True)
+
+    profiler.report(final_output)
+    progress(1.0, "Processing complete!")
+    return final_output
+
+def process_variants(video_path: str, variants: List[RenderVariant], sampling_policy: SamplingPolicy = None,
+                     transform_backend: str = "warp", quality: str = "balanced", workers: int = None,
+                     use_analysis_cache: bool = True, profile: str = "final",
+                     memory_budget: int = PIPELINE_MEMORY_BUDGET, decoder: str = "opencv",
+                     follow_face: bool = True, profiler: RenderProfiler = None,
+                     progress: Callable[[Optional[float], str], None] = None) -> Dict[str, str]:
+    """
+    Render several variants of one video (other zooms, sizes or crops) with a single decode and a single face
+    analysis. Each decoded frame is cropped, zoomed and resized once per variant, and piped to that variant's encoder.
+
+    :return: dict: Variant name -> output path
+    """
+    profiler = profiler or RenderProfiler()
+    progress = progress or log_progress
+    names = [variant.name for variant in variants]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Variant names must be unique, got {names}")
+    fps, width, height, total_frames = video_info(video_path)
 
-            frame_queue.put((frame_count, frame))
-            frame_count += 1
+    temp_dir = Path("temp_output")
+    temp_dir.mkdir(exist_ok=True, parents=True)
+    render_profile = RENDER_PROFILES[profile]
+    output_prefix = "" if profile == "final" else f"{profile}_"
+
+    progress(0.0, "Analyzing faces in zoom windows...")
+    sampling_policy = sampling_policy or SamplingPolicy()
+    analysis_cache = FaceAnalysisCache.for_video(video_path, sampling_policy) if use_analysis_cache else None
+    all_effects = [effect for variant in variants for effect in variant.zoom_effects]
+    with profiler.measure("face_analysis"):
+        refined_scales, face_boxes, analysis_stats = analyze_zoom_windows(video_path, all_effects, fps, total_frames,
+                                                                          sampling_policy, analysis_cache, decoder,
+                                                                          (width, height), profiler)
+    progress(None, f"Face analysis done: {analysis_stats.detector_calls} detector calls, "
+                   f"{analysis_stats.calls_saved} saved")
+
+    outputs, plans = {}, []
+    for variant in variants:
+        crop_x, crop_y, crop_width, crop_height = variant.crop or (0, 0, width, height)
+        if crop_x < 0 or crop_y < 0 or crop_x + crop_width > width or crop_y + crop_height > height:
+            raise ValueError(f"Crop {variant.crop} of variant {variant.name} is outside the {width}x{height} frame")
+        output_width, output_height = variant.output_size or (crop_width, crop_height)
+        if render_profile["height"] is not None and render_profile["height"] < output_height:
+            output_width = int(round(output_width * render_profile["height"] / output_height / 2)) * 2
+            output_height = render_profile["height"]
+        if output_width % 2 or output_height % 2:
+            raise ValueError(f"Output size of variant {variant.name} must be even for yuv420p, got "
+                             f"{output_width}x{output_height}")
+
+        refine_effect_scales(variant.zoom_effects, refined_scales, fps, total_frames)
+        # Zoom centers are in crop coordinates
+        timeline = ZoomTimeline(variant.zoom_effects, fps, total_frames, crop_width, crop_height, easing=variant.easing)
+        if follow_face:
+            timeline.follow_faces({frame_num: (x - crop_x, y - crop_y, w, h)
+                                   for frame_num, (x, y, w, h) in face_boxes.items()})
+        outputs[variant.name] = str(temp_dir / f"{output_prefix}{variant.name}_{Path(video_path).stem}.mp4")
+        plans.append((timeline, (crop_x, crop_y, crop_width, crop_height), (output_width, output_height)))
+
+    workers = workers or default_workers()
+    output_bytes = sum(output_width * output_height * 3 for _, _, (output_width, output_height) in plans)
+    writers, pool, cap = [], None, None
+
+    def transform(frame_count, slot):
+        source = pool.frames[slot]
+        frames = []
+        for index, (timeline, (x, y, w, h), (output_width, output_height)) in enumerate(plans):
+            frames.append(apply_zoom(source[y:y + h, x:x + w], timeline.scales[frame_count],
+                                     timeline.center_x[frame_count], timeline.center_y[frame_count],
+                                     backend=transform_backend, quality=quality,
+                                     dst=pool.output(slot, index, (output_height, output_width, 3)),
+                                     output_size=(output_width, output_height)))
+        return frames
+
+    def write(frames):
+        for out, frame in zip(writers, frames):
+            out.write(frame)
 
-            if frame_count % (total_frames // 20) == 0:
-                progress_bar.progress(frame_count / total_frames)
-                status_text.text(f"Processing frame {frame_count}/{total_frames}")
+    def report_progress(frame_count):
+        if frame_count % max(1, total_frames // 20) == 0:
+            progress(min(1.0, frame_count / total_frames),
+                     f"Processing frame {frame_count}/{total_frames} of {len(variants)} variants")
 
-        cap.release()
+    # Writers, pool and capture are created inside the try, so a failure never leaks an encoder, the capture
+    # or the pool's share of PROCESS_BUDGET
+    try:
+        for variant, (timeline, _, output_size) in zip(variants, plans):
+            writers.append(FFmpegWriter(outputs[variant.name], fps, output_size, audio_source=video_path,
+                                        preset=render_profile["preset"], crf=render_profile["crf"],
+                                        keyframe_times=timeline.start_times()))
+        if not all(out.isOpened() for out in writers):
+            raise RuntimeError("Failed to initialize video writer")
+        pool = FramePool.within_budget((height, width, 3), default_pool_size(workers), memory_budget,
+                                       output_bytes=output_bytes)
+        cap = open_capture(video_path, decoder, (width, height), fps)
+        run_ordered_pipeline(read_into_pool(cap, pool, profiler=profiler), transform, write, workers=workers,
+                             progress=report_progress, pool=pool, profiler=profiler)
+    finally:
+        try:
+            if cap is not None:
+                cap.release()
+            with profiler.measure("finalize"):
+                for out in writers:
+                    out.release()
+        finally:
+            if pool is not None:
+                pool.dispose()
+
+    profiler.report(", ".join(outputs.values()))
+    progress(1.0, "Processing complete!")
+    return outputs
+
+def render_zoom_clip(video_path: str, zoom_effects: List[ZoomEffect], index: int, padding: float = 2.0,
+                     sampling_policy: SamplingPolicy = None, transform_backend: str = "warp", quality: str = "balanced",
+                     easing: str = "linear", use_analysis_cache: bool = True, profile: str = "clip",
+                     decoder: str = "opencv", follow_face: bool = True) -> str:
+    """
+    Render only `padding` seconds before and after zoom_effects[index], with the matching span of the audio,
+    so a single zoom can be reviewed without a full render. Zooms of other effects inside the window are rendered too.
+
+    :return: str: Path of the clip
+    """
+    fps, width, height, total_frames = video_info(video_path)
+    effect = zoom_effects[index]
+    start_frame = max(0, int((effect.start_time - padding) * fps))
+    end_frame = min(total_frames, int((effect.start_time + effect.total_duration + padding) * fps))
+    if start_frame >= end_frame:
+        raise ValueError(f"Zoom at {effect.start_time:.2f}s is outside the {total_frames / fps:.2f}s video")
+
+    timeline = ZoomTimeline(zoom_effects, fps, total_frames, width, height, easing=easing)
+    window_effects = [e for e, start, end in timeline.ranges if start < end_frame and end > start_frame]
+    sampling_policy = sampling_policy or SamplingPolicy()
+    analysis_cache = FaceAnalysisCache.for_video(video_path, sampling_policy) if use_analysis_cache else None
+    refined_scales, face_boxes, _ = analyze_zoom_windows(video_path, window_effects, fps, total_frames, sampling_policy,
+                                                         analysis_cache, decoder, (width, height))
+    refine_effect_scales(window_effects, refined_scales, fps, total_frames)
+    if follow_face:
+        timeline.follow_faces(face_boxes)
+    else:
+        timeline.compile()
+
+    render_profile = RENDER_PROFILES[profile]
+    output_size = None
+    if render_profile["height"] is not None and render_profile["height"] < height:
+        output_size = (int(round(width * render_profile["height"] / height / 2)) * 2, render_profile["height"])
 
-        # Signal that no more frames will be added
-        frame_queue.put(None)
-        
-        # Wait for the processing to complete
-        frame_queue.join()
+    temp_dir = Path("temp_output")
+    temp_dir.mkdir(exist_ok=True, parents=True)
+    clip_path = str(temp_dir / f"clip_{Path(video_path).stem}_{index}.mp4")
+    clip_start = start_frame / fps
+    keyframe_times = [time - clip_start for time in timeline.start_times() if start_frame <= time * fps < end_frame]
+    out = FFmpegWriter(clip_path, fps, output_size or (width, height), audio_source=video_path, audio_offset=clip_start,
+                       preset=render_profile["preset"], crf=render_profile["crf"], keyframe_times=keyframe_times)
+    try:
+        render_frame_range(video_path, start_frame, end_frame, timeline, out, transform_backend, quality, decoder,
+                           output_size)
+    finally:
         out.release()
-
-        logging.info("Beginning audio-video combination.")
-        status_text.text("Combining video with audio...")
-
-        ffmpeg_command = [
-            'ffmpeg', '-i', temp_video, '-i', temp_audio, '-c:v', 'libx264',
-            '-c:a', 'copy', '-shortest', '-movflags', '+faststart', '-y', final_output
-        ]
-        result = subprocess.run(ffmpeg_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-        if result.returncode != 0:
-            logging.error("FFmpeg error during combination: %s", result.stderr.decode())
-            raise RuntimeError("Failed to combine video and audio")
-
-        logging.info("Combination completed successfully. Cleaning up temporary files.")
-        if os.path.exists(temp_video):
-            os.remove(temp_video)
-        if os.path.exists(temp_audio):
-            os.remove(temp_audio)
-
-        status_text.text("Processing complete!")
-        return final_output
-    
+    logging.info("Rendered zoom %d clip of frames %d-%d to %s", index, start_frame, end_frame, clip_path)
+    return clip_path
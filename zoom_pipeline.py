@@ -0,0 +1,211 @@
+"""
+The zoom pipeline without the UI: audio extraction, transcription, emphasis detection, Claude zoom predictions
+and the render. main.py runs these steps interactively, batch.py runs them over many videos.
+
+All intermediate files go under `work_dir`, in the layout main.py always used, so the app and batch runs
+reuse each other's transcriptions, emphasis predictions and Claude results.
+"""
+import json
+import logging
+import os
+import shutil
+import time
+from glob import glob
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from asr import get_client_settings, transcribe_audio
+from predictor import ClaudeAdapter
+from render_profiler import RenderProfiler
+from utils import (add_sentences_to_file, add_silence_duration, construct_new_sentences, get_word_indices,
+                   save_audio_from_video, save_emphasis_predictions, split_and_save_audio, split_sentences_by_seconds,
+                   split_words_by_duration)
+from zoom_effect import ZoomEffect, process_video
+
+SPLIT_SENTENCE_BY_DURATION = 240 * 7
+WORK_DIR = "./uploaded_files"
+PREDICTIONS_DIR = "claude_results"
+CLAUDE_MODEL = "claude-3-5-sonnet-20241022"
+
+
+def  get_zooms(preds, sntnces_splitted_by_duration, splittedwords, slow=False, jumpcut=False):
+    zoom_effects = []
+    for i, pred in enumerate(preds):
+        prediction = pred["zoom_events"]
+        for p in prediction:
+            sentence_num = p['sentence_number']
+            text_applied = p['text_applied']
+            #reason = p['reason']
+            zoom_in_scale = p['zoom_in_scale']
+            zoom_out_duration = p['zoom_out_duration']
+            st_idx, end_idx = get_word_indices(sntnces_splitted_by_duration[i][sentence_num-1], text_applied)
+            if st_idx == -1 or end_idx == -1:
+                continue
+            start_time = splittedwords[i][sentence_num-1][st_idx][1]
+            end_time = splittedwords[i][sentence_num-1][end_idx][2]
+            if slow and not jumpcut:
+                zoom_effects.append(ZoomEffect(start_time, end_time, end_time-start_time, zoom_in_scale, zoom_out_duration=zoom_out_duration, lag_time=0))
+            elif not slow and not jumpcut:
+                zoom_effects.append(ZoomEffect(start_time, end_time, 1, zoom_in_scale, 1))
+            elif slow and jumpcut:
+                zoom_effects.append(ZoomEffect(start_time, end_time, end_time-start_time, zoom_in_scale, 0, lag_time=0))
+
+    return zoom_effects
+
+
+def  get_zooms_claude(preds, sntnces_splitted_by_duration, splittedwords, slow=False, jumpcut=False, hold=False):
+    zoom_effects = []
+    for i, pred in enumerate(preds):
+        prediction = pred.get(list(pred.keys())[0], [])
+        for p in prediction:
+            sentence_num = p['sentence_number']
+            text_applied = p['zoom_in_phrase']
+            #reason = p['reason']
+            zoom_in_scale = 1.3
+            transition_sentence_num = p['transition_sentence_number']
+            transition_sentence_word = p['transition_sentence_word']
+
+            # zoom_out_duration = p['zoom_out_duration']
+            st_idx, end_idx = get_word_indices(sntnces_splitted_by_duration[i][sentence_num-1], text_applied)
+            st_idx_cut, end_idx_cut = get_word_indices(sntnces_splitted_by_duration[i][transition_sentence_num-1], transition_sentence_word)
+
+            if st_idx == -1 or end_idx == -1:
+                continue
+            if st_idx_cut == -1 or end_idx_cut == -1:
+                continue
+            start_time = splittedwords[i][sentence_num-1][st_idx][1]
+            end_time = splittedwords[i][transition_sentence_num-1][st_idx_cut][1]
+
+            if not slow and jumpcut and hold:
+                zoom_effects.append(ZoomEffect(start_time, end_time, 1, zoom_in_scale, 0))
+            elif not slow and jumpcut and not hold:
+                zoom_effects.append(ZoomEffect(start_time, end_time, 1, zoom_in_scale, 0, lag_time=0))
+
+    return zoom_effects
+
+
+def work_paths(video_path: str, work_dir: str = WORK_DIR) -> Dict[str, str]:
+    """
+    Paths of the intermediate files of a video; they are named after the video file, without its directory.
+
+    :param video_path: str: Video path
+    :param work_dir: str: Directory of the intermediate files
+    :return: dict: Step name -> path
+    """
+    stem = Path(video_path).stem
+    sentences = f"{work_dir}/transcriptions/video_recordings/{stem}_trancriptions_with_align_sentence.txt"
+    return {
+        "audio": f"{work_dir}/recordings/video_recordings/{stem}.mp3",
+        "sentences": sentences,
+        "words": f"{work_dir}/transcriptions/video_recordings/{stem}_trancriptions_with_align_words.json",
+        "sentences_updated": sentences.replace('.txt', '_updated.txt'),
+        "sentences_numbered": sentences.replace('.txt', '_updated_numbered.txt'),
+        "splitted_audio": f"{work_dir}/recordings/splitted_audios/{stem}",
+        "emphasis": f"{work_dir}/emphasis_detection/{stem}",
+        "predictions": f"{PREDICTIONS_DIR}/{stem}.json",
+    }
+
+
+def transcribe_video(video_path: str, work_dir: str = WORK_DIR, client_settings=None):
+    """
+    Extract the audio, transcribe it, detect emphasis and mark the emphasized words of the transcript.
+    Every step reuses the files of earlier runs.
+
+    :param video_path: str: Video path
+    :param work_dir: str: Directory of the intermediate files
+    :param client_settings: ConnectionSettings: SpeechMatics client settings, from the environment by default
+    :return: tuple: Sentences with durations, word timings with silences, and the sentences with emphasis marked
+    """
+    paths = work_paths(video_path, work_dir)
+    for key in ("audio", "sentences"):
+        os.makedirs(os.path.dirname(paths[key]), exist_ok=True)
+    os.makedirs(paths["splitted_audio"], exist_ok=True)
+
+    save_audio_from_video(video_path, paths["audio"])
+    sentences, word_data = transcribe_audio(paths["audio"], paths["sentences"], paths["words"],
+                                            client_settings or get_client_settings())
+
+    split_and_save_audio(paths["audio"], paths["sentences"], paths["splitted_audio"])
+    save_emphasis_predictions(glob(f"{paths['splitted_audio']}/*.mp3"), paths["emphasis"])
+    add_silence_duration(word_data)
+    new_sentences = construct_new_sentences(glob(f"{paths['emphasis']}/*.txt"), os.path.basename(paths["audio"]),
+                                            word_data, paths["sentences_updated"], paths["sentences"])
+    if not os.path.exists(paths["sentences_numbered"]):
+        for i, sent in enumerate(new_sentences):
+            add_sentences_to_file(f"{i}. {sent}", paths["sentences_numbered"])
+    return sentences, word_data, new_sentences
+
+
+def predict_zooms(video_path: str, new_sentences: List[str], word_data: List, predictor=None,
+                  work_dir: str = WORK_DIR):
+    """
+    Ask Claude for zoom moments in the transcript, or load its earlier answer for this video.
+
+    :param predictor: ClaudeAdapter: Predictor to use, one for CLAUDE_MODEL and ANTHROPIC_API_KEY by default
+    :param work_dir: str: Directory of the intermediate files, where the predictions are kept
+    :return: tuple: Predictions, the sentences and the words split into the chunks the predictions refer to
+    """
+    sentences_splitted_by_duration = split_sentences_by_seconds(new_sentences, SPLIT_SENTENCE_BY_DURATION)
+    splitted_words = split_words_by_duration(word_data, [len(sen) for sen in sentences_splitted_by_duration])
+    json_file_path = work_paths(video_path, work_dir)["predictions"]
+    if os.path.exists(json_file_path):
+        with open(json_file_path, "r") as f:
+            predictions = json.load(f)
+        logging.info("Loaded existing predictions from %s", json_file_path)
+    else:
+        predictor = predictor or ClaudeAdapter(model_name=CLAUDE_MODEL, api_key=os.getenv('ANTHROPIC_API_KEY'))
+        splitted_sentences = [[f"{i}. {sentence}" for i, sentence in enumerate(sentences, start=1)]
+                              for sentences in sentences_splitted_by_duration]
+        predictions = predictor.get_predictions(splitted_sentences, len(splitted_sentences))
+        os.makedirs(os.path.dirname(json_file_path), exist_ok=True)
+        with open(json_file_path, "w") as f:
+            json.dump(predictions, f)
+        logging.info("Predictions saved to %s", json_file_path)
+    return predictions, sentences_splitted_by_duration, splitted_words
+
+
+def zoom_video(video_path: str, output_dir: Optional[str] = None, work_dir: str = WORK_DIR, client_settings=None,
+               predictor=None, progress: Callable[[Optional[float], str], None] = None, **render_options) -> Dict:
+    """
+    Run the whole pipeline on one video, as the "Fast Zoom In-Hold-Cut" button of the app does.
+
+    :param output_dir: str: Move the rendered video here; it stays in temp_output otherwise
+    :param render_options: Keyword arguments of process_video (profile, render_mode, ...)
+    :return: dict: Report with the output path, the zooms and the stage timings
+    """
+    start = time.perf_counter()
+    _, word_data, new_sentences = transcribe_video(video_path, work_dir, client_settings)
+    transcribed = time.perf_counter()
+    predictions, sentences_splitted_by_duration, splitted_words = predict_zooms(video_path, new_sentences, word_data,
+                                                                                predictor, work_dir)
+    zoom_effects = get_zooms_claude(predictions, sentences_splitted_by_duration, splitted_words,
+                                    slow=False, jumpcut=True, hold=True)
+    predicted = time.perf_counter()
+
+    profiler = RenderProfiler()
+    output_path = process_video(video_path, zoom_effects, profiler=profiler, progress=progress, **render_options)
+    if output_dir is not None and output_path is not None:
+        os.makedirs(output_dir, exist_ok=True)
+        destination = os.path.join(output_dir, os.path.basename(output_path))
+        if output_path.endswith(".m3u8"):
+            # HLS output is a directory of playlist and segments
+            destination = os.path.join(output_dir, os.path.basename(os.path.dirname(output_path)))
+            shutil.rmtree(destination, ignore_errors=True)
+            shutil.move(os.path.dirname(output_path), destination)
+            destination = os.path.join(destination, os.path.basename(output_path))
+        else:
+            shutil.move(output_path, destination)
+        output_path = destination
+
+    return {
+        "video": video_path,
+        "output": output_path,
+        "zoom_effects": [{"start_time": effect.start_time, "end_time": effect.end_time, "scale": effect.scale}
+                         for effect in zoom_effects],
+        "seconds": {
+            "transcription": round(transcribed - start, 3),
+            "prediction": round(predicted - transcribed, 3),
+            "render": round(time.perf_counter() - predicted, 3),
+        },
+        "profile": profiler.summary(),
+    }
@@ -0,0 +1,140 @@
+import hashlib
+import logging
+from typing import Callable, Dict, List
+
+import numpy as np
+
+EASING: Dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    "linear": lambda progress: progress,
+    "ease_in": lambda progress: progress ** 2,
+    "ease_out": lambda progress: 1 - (1 - progress) ** 2,
+    "ease_in_out": lambda progress: progress * progress * (3 - 2 * progress),
+}
+
+
+def moving_average(values: np.ndarray, window: int) -> np.ndarray:
+    """Centered moving average of the same length, repeating the edge values."""
+    if window <= 1 or len(values) < 2:
+        return values
+    padded = np.pad(values, (window // 2, window - 1 - window // 2), mode="edge")
+    return np.convolve(padded, np.ones(window) / window, mode="valid")
+
+
+class ZoomTimeline:
+    """
+    Per-frame zoom scale and zoom center arrays compiled from a list of ZoomEffects.
+
+    Effects are sorted by start time. When one effect runs into the next, it is cut at the
+    next effect's first frame, so the later effect always wins, as in the old per-frame loop.
+    The render loop reads `scales[frame]`, `center_x[frame]` and `center_y[frame]` directly.
+
+    By default every zoom targets a fixed point a quarter of the height above the center. After
+    follow_faces() the center of each zoom follows a smoothed track of the detected face instead.
+    """
+    def __init__(self, zoom_effects: List, fps: float, total_frames: int, width: int, height: int,
+                 easing: str = "linear"):
+        self.zoom_effects = sorted(zoom_effects, key=lambda effect: effect.start_time)
+        self.fps = fps
+        self.total_frames = total_frames
+        self.width = width
+        self.height = height
+        self.easing = easing
+        self.face_boxes = None
+        self.smoothing_seconds = 0.0
+        self.ranges = self.resolve_overlaps()
+        self.compile()
+
+    def effect_frames(self, effect):
+        start_frame = int(effect.start_time * self.fps)
+        end_frame = min(self.total_frames, start_frame + int(effect.total_duration * self.fps))
+        return start_frame, end_frame
+
+    def resolve_overlaps(self):
+        ranges = []
+        for effect in self.zoom_effects:
+            start_frame, end_frame = self.effect_frames(effect)
+            if ranges and start_frame < ranges[-1][2]:
+                previous, previous_start, previous_end = ranges[-1]
+                logging.warning("Zoom at %.2fs overlaps zoom at %.2fs by %d frames; cutting the earlier one",
+                                effect.start_time, previous.start_time, previous_end - start_frame)
+                ranges[-1] = (previous, previous_start, start_frame)
+            ranges.append((effect, start_frame, end_frame))
+        return [(effect, start, end) for effect, start, end in ranges if end > start]
+
+    def compile(self):
+        """(Re)build the arrays from the current effect parameters, e.g. after the scales were refined."""
+        self.scales = np.ones(self.total_frames, dtype=np.float64)
+        self.center_x = np.full(self.total_frames, self.width / 2, dtype=np.float32)
+        self.center_y = np.full(self.total_frames, self.height / 2 - self.height / 4, dtype=np.float32)
+        for effect, start_frame, end_frame in self.ranges:
+            times = np.arange(start_frame, end_frame) / self.fps
+            self.scales[start_frame:end_frame] = effect.scale_at(times, easing=self.easing)
+        if self.face_boxes:
+            self.compile_face_centers()
+
+    def follow_faces(self, face_boxes: Dict[int, tuple], smoothing_seconds: float = 0.5):
+        """
+        Center every zoom on the face. `face_boxes` are sparse detections (frame number -> (x, y, w, h));
+        the face center is interpolated between them and smoothed with a moving average of `smoothing_seconds`.
+        """
+        self.face_boxes = face_boxes
+        self.smoothing_seconds = smoothing_seconds
+        self.compile()
+
+    def compile_face_centers(self):
+        window = max(1, int(round(self.smoothing_seconds * self.fps)))
+        for _, start_frame, end_frame in self.ranges:
+            sample_frames = sorted(frame for frame in self.face_boxes if start_frame <= frame < end_frame)
+            if not sample_frames:
+                continue
+            boxes = np.array([self.face_boxes[frame] for frame in sample_frames], dtype=np.float64)
+            frames = np.arange(start_frame, end_frame)
+            # Before the first and after the last detection the center holds still
+            center_x = np.interp(frames, sample_frames, boxes[:, 0] + boxes[:, 2] / 2)
+            center_y = np.interp(frames, sample_frames, boxes[:, 1] + boxes[:, 3] / 2)
+            self.center_x[start_frame:end_frame] = np.clip(moving_average(center_x, window), 0, self.width)
+            self.center_y[start_frame:end_frame] = np.clip(moving_average(center_y, window), 0, self.height)
+
+    def resized(self, width: int, height: int) -> "ZoomTimeline":
+        """Copy of the timeline for a downscaled render: same scales, zoom centers mapped to the new frame size."""
+        timeline = ZoomTimeline.__new__(ZoomTimeline)
+        timeline.__dict__.update(self.__dict__)
+        timeline.width, timeline.height = width, height
+        timeline.center_x = self.center_x * (width / self.width)
+        timeline.center_y = self.center_y * (height / self.height)
+        return timeline
+
+    def save(self, path: str):
+        """Store the compiled arrays, e.g. for render workers on other machines (see load)."""
+        with open(path, "wb") as f:
+            np.savez(f, scales=self.scales, center_x=self.center_x, center_y=self.center_y,
+                     meta=np.array([self.fps, self.width, self.height, self.total_frames], dtype=np.float64))
+
+    @classmethod
+    def load(cls, path: str) -> "ZoomTimeline":
+        """Timeline with the arrays of a saved one; it renders the same frames but has no effects to recompile."""
+        with np.load(path) as data:
+            fps, width, height, total_frames = data["meta"].tolist()
+            timeline = cls([], fps, int(total_frames), int(width), int(height))
+            timeline.scales = data["scales"]
+            timeline.center_x = data["center_x"]
+            timeline.center_y = data["center_y"]
+        return timeline
+
+    def signature(self, start_frame: int = 0, end_frame: int = None) -> str:
+        """
+        Hash of the compiled arrays over [start_frame, end_frame) (default: all frames), the frame rate and size.
+        Equal signatures render equal frames, whatever effects produced them.
+        """
+        end_frame = self.total_frames if end_frame is None else end_frame
+        digest = hashlib.sha256(f"{self.fps}|{self.width}x{self.height}|{start_frame}-{end_frame}".encode())
+        for values in (self.scales, self.center_x, self.center_y):
+            digest.update(values[start_frame:end_frame].tobytes())
+        return digest.hexdigest()
+
+    def start_times(self) -> List[float]:
+        """Time (seconds) of the first frame of every zoom, e.g. to put a keyframe there."""
+        return [start_frame / self.fps for _, start_frame, _ in self.ranges]
+
+    def zoomed_frames(self) -> int:
+        return int(np.count_nonzero(self.scales != 1.0))